@@ -1,40 +1,22 @@
-import argparse
 import backtrader as bt
-import datetime
-import pandas as pd
-from binance.client import Client
-import pytz
-
-API_KEY = ''
-API_SECRET = ''
+from instrumentation import instrumented, stage
+from kline_feed import KlineArrayData, prepare_columns
+from kline_source import KLINE_INTERVAL_1MINUTE, fetch_klines
+from kline_store import load_klines
+from ledger import EquityRecorder, LedgerMixin
+from performance import compute
+from result_cache import run_key
+from vector_engine import run_vectorized
 
 def fetch_binance_data(symbol, interval, start_date, end_date, timezone):
-    client = Client(API_KEY, API_SECRET)
-    klines = client.get_historical_klines(
-        symbol=symbol,
-        interval=interval,
-        start_str=start_date,
-        end_str=end_date
-    )
-    data = []
-    for kline in klines:
-        utc_time = datetime.datetime.fromtimestamp(kline[0] / 1000, tz=pytz.utc)
-        local_time = utc_time.astimezone(pytz.timezone(timezone))
-        data.append({
-            'datetime': local_time,
-            'open': float(kline[1]),
-            'high': float(kline[2]),
-            'low': float(kline[3]),
-            'close': float(kline[4]),
-            'volume': float(kline[5]),
-        })
-    
-    df = pd.DataFrame(data)
-    if df.isnull().values.any() or (df[['open', 'high', 'low', 'close']] == 0).any().any():
-        raise ValueError("Data contains null or zero values, which is invalid for backtesting")
-    return df.to_dict('records')
-
-class ReverseMartingaleStrategy(bt.Strategy):
+    # Served from the local kline store as typed columns; only missing ranges go to the
+    # kline source.
+    # Bars stay in UTC: backtrader normalizes tz-aware datetimes to UTC anyway, so the
+    # timezone argument is kept for compatibility only.
+    columns = load_klines(symbol, interval, start_date, end_date, fetch_klines)
+    return prepare_columns(columns)
+
+class ReverseMartingaleStrategy(LedgerMixin, bt.Strategy):
     params = (
         ('fixed_position_size_bool', False),
         ('start_position_size', 5),  # Initial position size is 5% of total capital
@@ -48,6 +30,7 @@ class ReverseMartingaleStrategy(bt.Strategy):
         self.macd = bt.indicators.MACD(self.data.close)
         self.current_unit_size = None
         self.add_position_count = 0
+        self.add_rejected = 0  # add-position attempts refused by the cash check
         self.entry_price = None
         self.last_entry_time = None  # 紀錄最後一次進場時間
 
@@ -78,8 +61,10 @@ class ReverseMartingaleStrategy(bt.Strategy):
                     self.buy(size=new_unit_size)
                     self.add_position_count += 1
                     self.last_entry_time = current_time  # 更新進場時間
+                else:
+                    self.add_rejected += 1
 
-class MultifactorMartingaleStrategy(bt.Strategy):
+class MultifactorMartingaleStrategy(LedgerMixin, bt.Strategy):
     params = (
         ('start_position_size', 5),  # Initial position size as a percentage of total capital
         ('loss_threshold', 5),     # Percentage drop to trigger additional positions
@@ -93,6 +78,7 @@ class MultifactorMartingaleStrategy(bt.Strategy):
         self.rsi = bt.indicators.RSI(self.data.close, period=14)
         self.entry_price = None
         self.add_position_count = 0
+        self.add_rejected = 0  # add-position attempts refused by the cash check
         self.last_entry_time = None  # 紀錄最後一次進場時間
 
     def next(self):
@@ -115,7 +101,9 @@ class MultifactorMartingaleStrategy(bt.Strategy):
                     self.buy(size=new_unit_size)
                     self.add_position_count += 1
                     self.last_entry_time = current_time  # 更新進場時間
-class TimeLimitedMartingaleStrategy(bt.Strategy):
+                else:
+                    self.add_rejected += 1
+class TimeLimitedMartingaleStrategy(LedgerMixin, bt.Strategy):
     params = (
         ('macd_fast', 12),  # Fast EMA period
         ('macd_slow', 26),  # Slow EMA period
@@ -137,6 +125,7 @@ class TimeLimitedMartingaleStrategy(bt.Strategy):
         self.current_unit_size = None
         self.entry_price = None
         self.add_position_count = 0  # Number of additional positions taken
+        self.add_rejected = 0  # add-position attempts refused by the cash check
         self.last_entry_time = None  # 紀錄最後一次進場時間
 
     def next(self):
@@ -161,7 +150,9 @@ class TimeLimitedMartingaleStrategy(bt.Strategy):
                     self.add_position_count += 1
                     self.last_entry_time = current_time  # 更新進場時間
                     self.entry_price = self.data.close[0]
-class RiskLimitedMartingaleStrategy(bt.Strategy):
+                else:
+                    self.add_rejected += 1
+class RiskLimitedMartingaleStrategy(LedgerMixin, bt.Strategy):
     params = (
         ('fixed_position_size', False),  # Whether to use fixed position size
         ('start_position_size', 0.5),    # Reduced initial position size to conserve capital
@@ -174,6 +165,7 @@ class RiskLimitedMartingaleStrategy(bt.Strategy):
     def __init__(self):
         self.current_unit_size = None
         self.add_position_count = 0  # Tracks the number of additional positions
+        self.add_rejected = 0  # add-position attempts refused by the cash check
         self.macd = bt.indicators.MACD(self.data.close)
         self.entry_price = None  # Tracks the initial entry price
         self.last_entry_time = None  # 紀錄最後一次進場時間
@@ -203,6 +195,8 @@ class RiskLimitedMartingaleStrategy(bt.Strategy):
                     self.add_position_count += 1
                     self.last_entry_time = current_time  # 更新進場時間
                     self.entry_price = self.data.close[0]  # Update entry price after adding position
+                else:
+                    self.add_rejected += 1
             
 
 strategies = {
@@ -219,34 +213,71 @@ market_strategies = {
     "Downtrend": RiskLimitedMartingaleStrategy,
 }
 
-def martingale(symbol, start_date, end_date, market_condition, capital):
+def martingale(symbol, start_date, end_date, market_condition, capital, engine='backtrader', instrument=None,
+               ledger_path=None, curve_path=None, metrics=None, bars=None, cache=None):
 
     timezone = 'UTC'
-    interval = Client.KLINE_INTERVAL_1MINUTE  # 1 分鐘 K 線
+    interval = KLINE_INTERVAL_1MINUTE  # 1 分鐘 K 線
+
 
+    # instrument: an instrumentation.Metrics to collect stage timings, counters and the
+    # optional profile of this run into; None runs uninstrumented
+    # ledger_path: save the run's trade ledger (every fill) there as .npz
+    # curve_path: save the run's equity curve there as .npz, to compute other metrics later
+    # metrics: names of performance metrics to compute from the equity curve; when given, a
+    # {name: value} dict is added as the last element of the result
+    # bars: the window's columns when the caller already holds them (as fetch_binance_data
+    # returns them, e.g. job_planner.window_bars); nothing is fetched then
+    # cache: a result_cache.ResultCache; a run whose inputs (code, params, cash, commission, bars)
+    # are already in it is not run again. Runs that save a ledger or curve are not cached.
 
     # Fetch Binance data
-    raw_data = fetch_binance_data(symbol, interval, start_date, end_date, timezone)
+    if bars is not None:
+        raw_data = bars
+    else:
+        with stage(instrument, 'fetch'):
+            raw_data = fetch_binance_data(symbol, interval, start_date, end_date, timezone)
+
+    if cache is not None and ledger_path is None and curve_path is None:
+        strategy = market_strategies[market_condition]
+        key = run_key(martingale, strategy, raw_data, capital, 0.0, engine=engine, metrics=metrics)
+        result = cache.get(key)
+        if result is None:
+            result = martingale(symbol, start_date, end_date, market_condition, capital, engine=engine,
+                                instrument=instrument, metrics=metrics, bars=raw_data)
+            cache.put(key, result, function='martingale', strategy=strategy.__name__, symbol=symbol,
+                      start_date=start_date, end_date=end_date)
+        elif instrument is not None:
+            instrument.count('cache_hits', 1)
+        return result
+
+    # engine='numpy' runs the same rules on precomputed indicator arrays instead of cerebro
+    if engine == 'numpy':
+        with stage(instrument, 'engine', profile=True):
+            result = run_vectorized(market_strategies[market_condition], raw_data, capital, commission=0.0)
+        if instrument is not None:
+            instrument.count('bars', result.bars)
+            instrument.count('orders', result.orders)
+            instrument.count('add_rejected', result.add_rejected)
+        if curve_path is not None:
+            result.curve().save(curve_path)
+        if ledger_path is not None:
+            result.ledger().save(ledger_path)
+        if metrics is not None:
+            return result.value, result.sharpe, result.buy_count, result.last_entry_time, result.metrics(metrics)
+        return result.value, result.sharpe, result.buy_count, result.last_entry_time
 
     # Load data into backtrader
-    class BinanceData(bt.feeds.PandasData):
-        params = (
-            ('datetime', 'datetime'),
-            ('open', 'open'),
-            ('high', 'high'),
-            ('low', 'low'),
-            ('close', 'close'),
-            ('volume', 'volume')
-        )
-
-    df = pd.DataFrame(raw_data)
-    data = BinanceData(dataname=df)
+    with stage(instrument, 'convert'):
+        data = KlineArrayData(columns=raw_data)
 
     # Create backtesting engine
     cerebro = bt.Cerebro()
 
     # Add chosen strategy
     strategy = market_strategies[market_condition]
+    if instrument is not None:
+        strategy = instrumented(strategy, instrument)
     cerebro.addstrategy(strategy)
 
     # Add data
@@ -254,14 +285,23 @@ def martingale(symbol, start_date, end_date, market_condition, capital):
 
     # Configure initial capital
     cerebro.broker.set_cash(capital)
-    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name="sharpe", timeframe=bt.TimeFrame.Days, annualize=True)
-    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name="trade_analyzer")  # 用於計算交易次數
+    # Only the equity curve is recorded during the run; metrics are computed from it afterwards
+    cerebro.addanalyzer(EquityRecorder, _name="equity")
 
     # Run backtest
-    results = cerebro.run()
-
-    sharpe_analyzer = results[0].analyzers.sharpe
-    buy_count = results[0].add_position_count + 1  # 自定義屬性，從策略中取得
+    with stage(instrument, 'run', profile=True):
+        results = cerebro.run()
+
+    curve = results[0].analyzers.equity.get_analysis()
+    sharpe_ratio = compute(curve, ('sharpe',))['sharpe']
+    if curve_path is not None:
+        curve.save(curve_path)
+    ledger = results[0].ledger
+    buy_count = ledger.buy_count()  # 所有成交的買單（進場與加碼）
+    if ledger_path is not None:
+        ledger.save(ledger_path)
     last_entry = results[0].last_entry_time  # 紀錄最後一次進場時間
     #cerebro.plot()
-    return cerebro.broker.getvalue(), sharpe_analyzer.get_analysis().get('sharperatio', 'N/A'), buy_count, last_entry
+    if metrics is not None:
+        return cerebro.broker.getvalue(), sharpe_ratio, buy_count, last_entry, compute(curve, metrics)
+    return cerebro.broker.getvalue(), sharpe_ratio, buy_count, last_entry
@@ -1,42 +1,44 @@
-import argparse
 import backtrader as bt
-import datetime
-import pandas as pd
-from binance.client import Client
-import pytz
-
-API_KEY = ''
-API_SECRET = ''
-
+from instrumentation import instrumented, stage
+from kline_feed import KlineArrayData, prepare_columns
+from kline_source import KLINE_INTERVAL_1MINUTE, fetch_klines
+from kline_store import load_klines
+from ledger import EquityRecorder, LedgerMixin
+from performance import compute
+from result_cache import run_key
+from vector_engine import run_vectorized
 
 def fetch_binance_data(symbol, interval, start_date, end_date, timezone):
-    client = Client(API_KEY, API_SECRET)
-    klines = client.get_historical_klines(
-        symbol=symbol,
-        interval=interval,
-        start_str=start_date,
-        end_str=end_date
-    )
-    data = []
-    for kline in klines:
-        utc_time = datetime.datetime.fromtimestamp(kline[0] / 1000, tz=pytz.utc)
-        local_time = utc_time.astimezone(pytz.timezone(timezone))
-        data.append({
-            'datetime': local_time,
-            'open': float(kline[1]),
-            'high': float(kline[2]),
-            'low': float(kline[3]),
-            'close': float(kline[4]),
-            'volume': float(kline[5]),
-        })
-
-    df = pd.DataFrame(data)
-    if df.isnull().values.any() or (df[['open', 'high', 'low', 'close']] == 0).any().any():
-        raise ValueError("Data contains null or zero values, which is invalid for backtesting")
-    return df.to_dict('records')
-
-
-class ReverseMartingaleStrategy(bt.Strategy):
+    # Served from the local kline store as typed columns; only missing ranges go to the
+    # kline source.
+    # Bars stay in UTC: backtrader normalizes tz-aware datetimes to UTC anyway, so the
+    # timezone argument is kept for compatibility only.
+    columns = load_klines(symbol, interval, start_date, end_date, fetch_klines)
+    return prepare_columns(columns)
+
+class StopExitStrategy(LedgerMixin, bt.Strategy):
+    # Take-profit / stop-loss exit shared by the withstop strategies: once the position's return
+    # reaches take_profit or -stop_loss percent it is closed and the strategy is done for the
+    # window. When the close fills, close_time is recorded and the bar loop stops.
+
+    def check_exit(self):
+        if self.position.size <= 0:
+            return False
+        price_percent = (self.data.close[0] - self.position.price) / self.position.price * 100
+        if price_percent >= self.params.take_profit or price_percent <= -self.params.stop_loss:
+            self.close()
+            self.exited = True
+            return True
+        return False
+
+    def notify_order(self, order):
+        if self.exited and order.status == order.Completed and order.issell():
+            self.close_time = bt.num2date(order.executed.dt)
+            self.env.runstop()  # nothing is left to do in this window
+        super().notify_order(order)
+
+
+class ReverseMartingaleStrategy(StopExitStrategy):
     params = (
         ('fixed_position_size_bool', False),
         ('start_position_size', 1),  # Initial position size is 5% of total capital
@@ -52,6 +54,7 @@ class ReverseMartingaleStrategy(bt.Strategy):
         self.macd = bt.indicators.MACD(self.data.close)
         self.current_unit_size = None
         self.add_position_count = 0
+        self.add_rejected = 0  # add-position attempts refused by the cash check
         self.entry_price = None
         self.last_entry_time = None  # 紀錄最後一次進場時間
         self.close_time = None
@@ -61,6 +64,8 @@ class ReverseMartingaleStrategy(bt.Strategy):
         if self.exited:
             return
         current_time = self.data.datetime.datetime(0)
+        if self.check_exit():
+            return
         # Determine position size
         if self.params.fixed_position_size_bool:
             self.current_unit_size = self.params.start_position_size
@@ -87,9 +92,11 @@ class ReverseMartingaleStrategy(bt.Strategy):
                     self.buy(size=new_unit_size)
                     self.add_position_count += 1
                     self.last_entry_time = current_time  # 更新進場時間
+                else:
+                    self.add_rejected += 1
 
 
-class MultifactorMartingaleStrategy(bt.Strategy):
+class MultifactorMartingaleStrategy(StopExitStrategy):
     params = (
         ('start_position_size', 1),  # Initial position size as a percentage of total capital
         ('loss_threshold', 2),  # Percentage drop to trigger additional positions
@@ -105,6 +112,7 @@ class MultifactorMartingaleStrategy(bt.Strategy):
         self.rsi = bt.indicators.RSI(self.data.close, period=14)
         self.entry_price = None
         self.add_position_count = 0
+        self.add_rejected = 0  # add-position attempts refused by the cash check
         self.last_entry_time = None  # 紀錄最後一次進場時間
         self.close_time = None
         self.exited = False
@@ -113,6 +121,8 @@ class MultifactorMartingaleStrategy(bt.Strategy):
         if self.exited:
             return
         current_time = self.data.datetime.datetime(0)
+        if self.check_exit():
+            return
         if self.position.size == 0:  # Entry logic
             if self.macd.macd[0] > self.macd.signal[0] and self.rsi[0] < 40:
                 current_unit_size = (self.broker.getvalue() * (self.params.start_position_size / 100)) / \
@@ -132,9 +142,11 @@ class MultifactorMartingaleStrategy(bt.Strategy):
                     self.buy(size=new_unit_size)
                     self.add_position_count += 1
                     self.last_entry_time = current_time  # 更新進場時間
+                else:
+                    self.add_rejected += 1
 
 
-class TimeLimitedMartingaleStrategy(bt.Strategy):
+class TimeLimitedMartingaleStrategy(StopExitStrategy):
     params = (
         ('macd_fast', 12),  # Fast EMA period
         ('macd_slow', 26),  # Slow EMA period
@@ -158,13 +170,17 @@ class TimeLimitedMartingaleStrategy(bt.Strategy):
         self.current_unit_size = None
         self.entry_price = None
         self.add_position_count = 0  # Number of additional positions taken
+        self.add_rejected = 0  # add-position attempts refused by the cash check
         self.last_entry_time = None  # 紀錄最後一次進場時間
+        self.close_time = None
         self.exited = False
 
     def next(self):
         if self.exited:
             return
         current_time = self.data.datetime.datetime(0)
+        if self.check_exit():
+            return
         # Entry condition: MACD crossover
         if not self.position and self.macd.macd[0] > self.macd.signal[0]:
             self.current_unit_size = (self.broker.getvalue() * (self.params.initial_risk_percent / 100)) / \
@@ -187,9 +203,11 @@ class TimeLimitedMartingaleStrategy(bt.Strategy):
                     self.add_position_count += 1
                     self.last_entry_time = current_time  # 更新進場時間
                     self.entry_price = self.data.close[0]
+                else:
+                    self.add_rejected += 1
 
 
-class RiskLimitedMartingaleStrategy(bt.Strategy):
+class RiskLimitedMartingaleStrategy(StopExitStrategy):
     params = (
         ('fixed_position_size', False),  # Whether to use fixed position size
         ('start_position_size', 0.5),  # Reduced initial position size to conserve capital
@@ -204,6 +222,7 @@ class RiskLimitedMartingaleStrategy(bt.Strategy):
     def __init__(self):
         self.current_unit_size = None
         self.add_position_count = 0  # Tracks the number of additional positions
+        self.add_rejected = 0  # add-position attempts refused by the cash check
         self.macd = bt.indicators.MACD(self.data.close)
         self.entry_price = None  # Tracks the initial entry price
         self.last_entry_time = None  # 紀錄最後一次進場時間
@@ -214,6 +233,8 @@ class RiskLimitedMartingaleStrategy(bt.Strategy):
         if self.exited:
             return
         current_time = self.data.datetime.datetime(0)
+        if self.check_exit():
+            return
         # Entry logic
         if not self.position:  # No current position
             if self.macd.macd[0] > self.macd.signal[0]:  # MACD crossover signal
@@ -238,6 +259,8 @@ class RiskLimitedMartingaleStrategy(bt.Strategy):
                     self.add_position_count += 1
                     self.last_entry_time = current_time  # 更新進場時間
                     self.entry_price = self.data.close[0]  # Update entry price after adding position
+                else:
+                    self.add_rejected += 1
 
 
 strategies = {
@@ -255,32 +278,69 @@ market_strategies = {
 }
 
 
-def martingale_withstop(symbol, start_date, end_date, market_condition, capital):
+def martingale_withstop(symbol, start_date, end_date, market_condition, capital, engine='backtrader', instrument=None,
+                        ledger_path=None, curve_path=None, metrics=None, bars=None, cache=None):
     timezone = 'UTC'
-    interval = Client.KLINE_INTERVAL_1MINUTE  # 1 分鐘 K 線
+    interval = KLINE_INTERVAL_1MINUTE  # 1 分鐘 K 線
+
+    # instrument: an instrumentation.Metrics to collect stage timings, counters and the
+    # optional profile of this run into; None runs uninstrumented
+    # ledger_path: save the run's trade ledger (every fill) there as .npz
+    # curve_path: save the run's equity curve there as .npz, to compute other metrics later
+    # metrics: names of performance metrics to compute from the equity curve; when given, a
+    # {name: value} dict is added as the last element of the result
+    # bars: the window's columns when the caller already holds them (as fetch_binance_data
+    # returns them, e.g. job_planner.window_bars); nothing is fetched then
+    # cache: a result_cache.ResultCache; a run whose inputs (code, params, cash, commission, bars)
+    # are already in it is not run again. Runs that save a ledger or curve are not cached.
 
     # Fetch Binance data
-    raw_data = fetch_binance_data(symbol, interval, start_date, end_date, timezone)
+    if bars is not None:
+        raw_data = bars
+    else:
+        with stage(instrument, 'fetch'):
+            raw_data = fetch_binance_data(symbol, interval, start_date, end_date, timezone)
+
+    if cache is not None and ledger_path is None and curve_path is None:
+        strategy = market_strategies[market_condition]
+        key = run_key(martingale_withstop, strategy, raw_data, capital, 0.001, engine=engine, metrics=metrics)
+        result = cache.get(key)
+        if result is None:
+            result = martingale_withstop(symbol, start_date, end_date, market_condition, capital, engine=engine,
+                                         instrument=instrument, metrics=metrics, bars=raw_data)
+            cache.put(key, result, function='martingale_withstop', strategy=strategy.__name__, symbol=symbol,
+                      start_date=start_date, end_date=end_date)
+        elif instrument is not None:
+            instrument.count('cache_hits', 1)
+        return result
+
+    # engine='numpy' runs the same rules on precomputed indicator arrays instead of cerebro
+    if engine == 'numpy':
+        with stage(instrument, 'engine', profile=True):
+            result = run_vectorized(market_strategies[market_condition], raw_data, capital, commission=0.001)
+        if instrument is not None:
+            instrument.count('bars', result.bars)
+            instrument.count('orders', result.orders)
+            instrument.count('add_rejected', result.add_rejected)
+        if curve_path is not None:
+            result.curve().save(curve_path)
+        if ledger_path is not None:
+            result.ledger().save(ledger_path)
+        if metrics is not None:
+            return result.value, result.max_drawdown, result.buy_count, result.last_entry_time, result.close_time, result.metrics(metrics)
+        return result.value, result.max_drawdown, result.buy_count, result.last_entry_time, result.close_time
 
     # Load data into backtrader
-    class BinanceData(bt.feeds.PandasData):
-        params = (
-            ('datetime', 'datetime'),
-            ('open', 'open'),
-            ('high', 'high'),
-            ('low', 'low'),
-            ('close', 'close'),
-            ('volume', 'volume')
-        )
-
-    df = pd.DataFrame(raw_data)
-    data = BinanceData(dataname=df)
+    with stage(instrument, 'convert'):
+        data = KlineArrayData(columns=raw_data)
 
     # Create backtesting engine
     cerebro = bt.Cerebro()
 
     # Add chosen strategy
     strategy = market_strategies[market_condition]
+    if instrument is not None:
+        strategy = instrumented(strategy, instrument)
     cerebro.addstrategy(strategy)
 
     # Add data
@@ -289,21 +349,27 @@ def martingale_withstop(symbol, start_date, end_date, market_condition, capital)
     # Configure initial capital
     cerebro.broker.set_cash(capital)
     cerebro.broker.setcommission(commission=0.001)
-    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name="sharpe", timeframe=bt.TimeFrame.Days, annualize=True)
-    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name="trade_analyzer")  # 用於計算交易次數
-    cerebro.addanalyzer(bt.analyzers.DrawDown, _name="drawdown")
+    # Only the equity curve is recorded during the run; metrics are computed from it afterwards
+    cerebro.addanalyzer(EquityRecorder, _name="equity")
 
 
     # Run backtest
-    results = cerebro.run()
+    with stage(instrument, 'run', profile=True):
+        results = cerebro.run()
 
     # 提取最大回撤
-    drawdown = results[0].analyzers.drawdown.get_analysis()
-    max_drawdown = drawdown.max.drawdown  # 最大回撤百分比
-
-    sharpe_analyzer = results[0].analyzers.sharpe
-    buy_count = results[0].add_position_count + 1  # 自定義屬性，從策略中取得
+    curve = results[0].analyzers.equity.get_analysis()
+    max_drawdown = compute(curve, ('max_drawdown',))['max_drawdown']  # 最大回撤百分比
+    if curve_path is not None:
+        curve.save(curve_path)
+
+    ledger = results[0].ledger
+    buy_count = ledger.buy_count()  # 所有成交的買單（進場與加碼）
+    if ledger_path is not None:
+        ledger.save(ledger_path)
     last_entry = results[0].last_entry_time  # 紀錄最後一次進場時間
     close_time = results[0].close_time  # 紀錄最後一次進場時間
     #cerebro.plot()
+    if metrics is not None:
+        return cerebro.broker.getvalue(), max_drawdown, buy_count, last_entry, close_time, compute(curve, metrics)
     return cerebro.broker.getvalue(), max_drawdown, buy_count, last_entry, close_time
@@ -1,59 +1,150 @@
+import argparse
 import json
-import pandas as pd
+import os
 from datetime import datetime, timedelta
-from market_conditionv1 import market_prediction
+from market_conditionv1 import market_prediction, market_prediction_batch, set_daily_source
 from Martingalev1 import martingale
+from instrumentation import Metrics, stage
+from job_planner import load_union, plan_summary, plan_windows, window_bars, window_range
+from kline_source import set_source
+from parallel import run_parallel, run_sequential
+from result_cache import DEFAULT_ROOT as CACHE_ROOT, get_cache
+from results_writer import ResultsWriter, completed_keys, export_csv
+from shared_bars import SharedBarManager
 
-def main():
+def predict_markets(jobs):
+    # Classify every window of a symbol from one daily history instead of one fetch per window
+    dates_by_symbol = {}
+    for start_date, symbol in jobs:
+        dates_by_symbol.setdefault(symbol, []).append(start_date)
+    markets = {}
+    for symbol, dates in dates_by_symbol.items():
+        try:
+            predictions = market_prediction_batch(symbol, dates)
+        except Exception as exc:
+            print(f"Batch prediction failed for {symbol}, falling back to per-window: {exc}")
+            continue
+        for start_date, market in predictions.items():
+            markets[(start_date, symbol)] = market
+    return markets
+
+def run_window(start_date, symbol, market=None, instrument=False, profile_dir=None, ledger_dir=None, cache_dir=None,
+               union=None):
+    # instrument=True adds a metrics record (stage timings, counters, profile with profile_dir)
+    # as the last element of the result; ledger_dir saves every window's fills as .npz there.
+    # union: key of the planned range holding the window (or its shared_bars.SharedBars), whose
+    # bars are sliced from it. cache_dir: result cache; windows whose inputs are unchanged
+    # since they were cached are not run again
+    metrics = Metrics(profile=profile_dir is not None) if instrument else None
+    target_datetime = datetime.strptime(start_date, '%Y-%m-%d')
+    result_date = (target_datetime + timedelta(days=31)).strftime('%Y-%m-%d')
+    starting_date = (target_datetime + timedelta(days=1)).strftime('%Y-%m-%d')
+
+    # Predict market condition
+    if market is None:
+        with stage(metrics, 'regime'):
+            market = market_prediction(symbol, start_date)
+
+    # Run the martingale strategy
+    capital = 1000
+    ledger_path = None
+    if ledger_dir is not None:
+        os.makedirs(ledger_dir, exist_ok=True)
+        ledger_path = os.path.join(ledger_dir, f'{symbol}_{start_date}.npz')
+    cache = get_cache(cache_dir) if cache_dir is not None else None
+    bars = None
+    if union is not None:
+        with stage(metrics, 'fetch'):
+            bars = window_bars(symbol, *window_range(start_date), union)
+    end_value, sharpe_ratio, total_trades, last_entry = martingale(symbol, starting_date, result_date, market, capital, instrument=metrics, ledger_path=ledger_path, bars=bars, cache=cache)
+    if metrics is None:
+        return market, end_value, sharpe_ratio, total_trades, last_entry
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+        metrics.dump_profile(os.path.join(profile_dir, f'{symbol}_{start_date}.prof'))
+    return market, end_value, sharpe_ratio, total_trades, last_entry, metrics.record()
+
+FIELDS = ('symbol', 'start_date', 'market', 'end_value', 'sharpe_ratio', 'trade time', 'last_entry_time')
+CSV_COLUMNS = ['symbol', 'start_date', 'end_value', 'sharpe_ratio', 'trade time', 'last_entry_time']
+
+def main(workers=1, resume=False, instrument=False, profile_dir=None, ledger_dir=None, cache_dir=None, results_path='results2_v1.jsonl'):
     print("Start testing the strategy...")
 
     # Load parsed data from JSON file
     with open(r'data.json', 'r') as file:
         parsed_data = json.load(file)
 
-    end_values = []
-    sharpe_ratios = []
-    trade = []
-    last_entry_time = []
-
-    # Loop through each entry in the JSON data
-    n = 0
-    for start_date, symbol in parsed_data.items():
-        target_datetime = datetime.strptime(start_date, '%Y-%m-%d')
-        result_date = (target_datetime + timedelta(days=31)).strftime('%Y-%m-%d')
-        starting_date = (target_datetime + timedelta(days=1)).strftime('%Y-%m-%d')
-
-        # Predict market condition
-        market = market_prediction(symbol, start_date)
-
-        # Run the martingale strategy
-        capital = 1000
-        end_value, sharpe_ratio, total_trades, last_entry = martingale(symbol, starting_date, result_date, market, capital)
-        print(f"Market prediction for {symbol} starting on {start_date}: {market}, End Value = {end_value}, Sharpe Ratio = {sharpe_ratio}, trade = {total_trades}, last_entry = {last_entry}")
-
-        # Append results
-        end_values.append(end_value)
-        sharpe_ratios.append(sharpe_ratio)
-        trade.append(total_trades)
-        last_entry_time.append(last_entry)
-        n += 1
-        if n == 180:
-            print("Reached 180 iterations. Exiting loop.")
-            break
-
-    # Save results to CSV file
-    results = {
-        'symbol': list(parsed_data.values())[:n],
-        'start_date': list(parsed_data.keys())[:n],
-        'end_value': end_values,
-        'sharpe_ratio': sharpe_ratios,
-        'trade time': trade,
-        'last_entry_time': last_entry_time
-    }
-    df = pd.DataFrame(results)
+    # Only the first 180 windows are tested
+    all_jobs = list(parsed_data.items())[:180]
+
+    # Resume: windows already finished in results_path are not run again
+    done = completed_keys(results_path) if resume else set()
+    jobs = [(start_date, symbol) for start_date, symbol in all_jobs if (symbol, start_date) not in done]
+    if resume:
+        print(f"Resuming: {len(all_jobs) - len(jobs)} windows already done, {len(jobs)} to run")
+
+    markets = predict_markets(jobs)
+
+    # Windows run union by union, each union's bars read once and sliced for its windows
+    unions = plan_windows(jobs)
+    print(plan_summary(unions))
+    jobs = [(start_date, union.symbol, markets.get((start_date, union.symbol)), instrument, profile_dir,
+             ledger_dir, cache_dir, union.key)
+            for union in unions for start_date, _, _ in union.windows]
+
+    # Every window is appended to results_path as soon as it finishes
+    with ResultsWriter(results_path, resume=resume) as writer:
+        def report(i, job, result, error):
+            start_date, symbol = job[:2]
+            if error is not None:
+                print(f"Failed for {symbol} starting on {start_date}: {error}")
+                writer.write({'symbol': symbol, 'start_date': start_date, 'error': error})
+                return
+            market, end_value, sharpe_ratio, total_trades, last_entry = result[:5]
+            print(f"Market prediction for {symbol} starting on {start_date}: {market}, End Value = {end_value}, Sharpe Ratio = {sharpe_ratio}, trade = {total_trades}, last_entry = {last_entry}")
+            row = dict(zip(FIELDS, (symbol, start_date) + tuple(result[:5])))
+            if len(result) > 5:
+                row['metrics'] = result[5]  # stage timings and counters of the window
+            writer.write(row)
+
+        if workers > 1:
+            # Windows run on a process pool. The parent loads every union once into shared memory,
+            # just before its first window is submitted, and frees it after its last window
+            with SharedBarManager({union.key: len(union.windows) for union in unions}, load_union) as buffers:
+                def report_and_release(i, job, result, error):
+                    buffers.release(job[-1])
+                    report(i, job, result, error)
+
+                run_parallel(run_window, jobs, workers=workers, on_result=report_and_release, keep_results=False,
+                             prepare=lambda job: job[:-1] + (buffers.share(job[-1]),), max_pending=2 * workers)
+        else:
+            run_sequential(run_window, jobs, on_result=report, keep_results=False)
+
+    if len(all_jobs) == 180:
+        print("Reached 180 iterations. Exiting loop.")
+
+    # Save results to CSV file, in data.json order; failed windows are written with empty values
     output_file = 'results2_v1.csv'
-    df.to_csv(output_file, index=False)
+    export_csv(results_path, output_file, CSV_COLUMNS, order=[(symbol, start_date) for start_date, symbol in all_jobs])
     print(f"Results saved to {output_file}")
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes (1 = sequential)')
+    parser.add_argument('--source', default=None, help="kline source: live, replay:<dir> or http://host:port")
+    parser.add_argument('--daily-from-minutes', action='store_true',
+                        help='build the regime\'s daily bars from the 1-minute store instead of fetching 1d klines')
+    parser.add_argument('--resume', action='store_true', help='skip windows already in the results file')
+    parser.add_argument('--instrument', action='store_true', help='record stage timings and counters per window')
+    parser.add_argument('--profile', default=None, metavar='DIR', help='also cProfile every window into DIR (implies --instrument)')
+    parser.add_argument('--ledger', default=None, metavar='DIR', help='save every window\'s trade ledger into DIR')
+    parser.add_argument('--cache', nargs='?', const=CACHE_ROOT, default=None, metavar='DIR',
+                        help='reuse results of unchanged windows from the result cache (default directory without DIR)')
+    parser.add_argument('--results', default='results2_v1.jsonl', help='JSON Lines results file')
+    args = parser.parse_args()
+    if args.source:
+        set_source(args.source)
+    if args.daily_from_minutes:
+        set_daily_source('minutes')
+    main(workers=args.workers, resume=args.resume, instrument=args.instrument or args.profile is not None,
+         profile_dir=args.profile, ledger_dir=args.ledger, cache_dir=args.cache, results_path=args.results)
@@ -0,0 +1,522 @@
+import argparse
+import csv
+import json
+import os
+import re
+import shutil
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Typed, columnar store of backtest results with pre-built indexes, replacing the notebook's
+# regex + ad-hoc CSV workflow. Every result row is one window of one run:
+#
+#   run, symbol, market, strategy, params   categories: int32 codes + a dictionary per column
+#   start_date                              datetime64[D]; rows are kept sorted on it
+#   end_value, max_drawdown, sharpe_ratio   float64, NaN when a run did not record it
+#   trades                                  int32, -1 when missing
+#   last_entry_time, close_time             datetime64[s], NaT when missing
+#
+# Columns are .npy files memory-mapped on open (like the kline store), so opening a store of
+# millions of rows costs nothing. A date range is a binary search on the sorted start dates,
+# every category has a posting list (row ids grouped by code), and group-bys are bincounts over
+# the codes, so queries do not scan or parse anything they do not need.
+#
+# Importers normalize the legacy CSVs (inconsistent headers, M/D/YYYY dates, annotation
+# columns), the Strategyv1 / Strategyv1_withstop console logs (predictions.log) and the JSON
+# Lines results files, including compare_strategies' one-row-per-window comparisons.
+
+DEFAULT_ROOT = os.environ.get(
+    'RESULTS_STORE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'results_store')
+)
+
+CATEGORIES = ('run', 'symbol', 'market', 'strategy', 'params')
+DTYPES = {
+    'start_date': 'datetime64[D]',
+    'end_value': np.float64,
+    'max_drawdown': np.float64,
+    'sharpe_ratio': np.float64,
+    'trades': np.int32,
+    'last_entry_time': 'datetime64[s]',
+    'close_time': 'datetime64[s]',
+}
+COLUMNS = CATEGORIES + tuple(DTYPES)
+
+# Header spellings found in the result files -> column
+ALIASES = {
+    'symbol': 'symbol',
+    'start_date': 'start_date',
+    'market': 'market',
+    'market_prediction': 'market',
+    'strategy': 'strategy',
+    'params': 'params',
+    'end_value': 'end_value',
+    'end value': 'end_value',
+    'max_drawdown': 'max_drawdown',
+    'sharpe_ratio': 'sharpe_ratio',
+    'sharpe ratio': 'sharpe_ratio',
+    'sharpe': 'sharpe_ratio',
+    'trade time': 'trades',
+    'trade': 'trades',
+    'trades': 'trades',
+    'last_entry_time': 'last_entry_time',
+    'last_entry': 'last_entry_time',
+    'close_time': 'close_time',
+    'close': 'close_time',
+}
+
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y')
+TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%m/%d/%Y %H:%M', '%m/%d/%Y %H:%M:%S')
+
+LOG_LINE = re.compile(r"Market prediction for (?P<symbol>\w+) starting on (?P<start_date>\d{4}-\d{2}-\d{2}): "
+                      r"(?P<market>[^,]+), (?P<fields>.*)$")
+LOG_FIELD = re.compile(r"(?P<name>[A-Za-z_ ]+?) = (?P<value>[^,]*)")
+
+CAPITAL = 1000
+DENSE_GROUPS = 1 << 22  # larger group-by products are counted over the codes that occur
+
+
+def _parse_time(value, formats):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value
+    value = str(value).strip()
+    if not value or value == 'None':
+        return None
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognized date: {value!r}")
+
+
+def _parse_float(value):
+    if value is None:
+        return np.nan
+    if isinstance(value, str):
+        value = value.strip()
+        if not value or value == 'None':
+            return np.nan
+    return float(value)
+
+
+def normalize(row):
+    # One raw result row (any header spelling, any date format) -> a record of COLUMNS, or
+    # None for rows that are not results (blank lines, annotation-only rows, failed windows)
+    record = {}
+    for key, value in row.items():
+        column = ALIASES.get(str(key).strip().lower()) if key is not None else None
+        if column is not None and column not in record:
+            record[column] = value
+    if not record.get('symbol') or not record.get('start_date') or row.get('error'):
+        return None
+    start_date = _parse_time(record['start_date'], DATE_FORMATS)
+    if start_date is None:
+        return None
+    params = record.get('params')
+    if isinstance(params, dict):
+        params = json.dumps(params, sort_keys=True)
+    trades = _parse_float(record.get('trades'))
+    return {
+        'symbol': str(record['symbol']).strip(),
+        'market': str(record.get('market') or '').strip(),
+        'strategy': str(record.get('strategy') or '').strip(),
+        'params': params or '',
+        'start_date': start_date.date(),
+        'end_value': _parse_float(record.get('end_value')),
+        'max_drawdown': _parse_float(record.get('max_drawdown')),
+        'sharpe_ratio': _parse_float(record.get('sharpe_ratio')),
+        'trades': -1 if trades != trades else int(trades),
+        'last_entry_time': _parse_time(record.get('last_entry_time'), TIME_FORMATS),
+        'close_time': _parse_time(record.get('close_time'), TIME_FORMATS),
+    }
+
+
+_selected = {}
+
+
+def selected_strategy(market):
+    # Strategy the regime selects (same mapping in both martingale modules)
+    if market not in _selected:
+        import Martingalev1
+        from compare_strategies import strategy_for
+        _selected[market] = strategy_for(Martingalev1, market) or ''
+    return _selected[market]
+
+
+def _with_strategy(records):
+    for record in records:
+        if not record['strategy'] and record['market']:
+            record['strategy'] = selected_strategy(record['market'])
+        yield record
+
+
+def read_csv(path):
+    # Legacy result CSVs; annotation cells may be in any encoding and are dropped anyway
+    with open(path, 'r', newline='', encoding='utf-8', errors='replace') as file:
+        for row in csv.DictReader(file):
+            record = normalize(row)
+            if record is not None:
+                yield record
+
+
+def read_log(path):
+    # Console output of Strategyv1 / Strategyv1_withstop (predictions.log)
+    with open(path, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            match = LOG_LINE.search(line)
+            if not match:
+                continue
+            row = {name: value for name, value in LOG_FIELD.findall(match.group('fields'))}
+            row.update(symbol=match.group('symbol'), start_date=match.group('start_date'),
+                       market=match.group('market'))
+            record = normalize(row)
+            if record is not None:
+                yield record
+
+
+def read_jsonl(path):
+    # ResultsWriter files. compare_strategies rows ({name}_end_value, {name}_max_drawdown per
+    # strategy) become one record per strategy.
+    with open(path, 'r') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # half-written last line
+            names = [key[:-len('_end_value')] for key in row if key.endswith('_end_value')]
+            if names and 'end_value' not in row:
+                for name in names:
+                    record = normalize(dict(row, strategy=name, end_value=row[f'{name}_end_value'],
+                                            max_drawdown=row.get(f'{name}_max_drawdown')))
+                    if record is not None:
+                        yield record
+                continue
+            record = normalize(row)
+            if record is not None:
+                yield record
+
+
+READERS = {
+    '.csv': read_csv,
+    '.log': read_log,
+    '.jsonl': read_jsonl,
+}
+
+
+def read_results(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in READERS:
+        raise ValueError(f"Unsupported results file: {path}")
+    return _with_strategy(READERS[ext](path))
+
+
+def _encode(values, dictionary):
+    # Codes of values in dictionary (a list extended in place with unseen values)
+    lookup = {value: code for code, value in enumerate(dictionary)}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(dictionary)
+            dictionary.append(value)
+        codes[i] = code
+    return codes
+
+
+def _typed(records, dictionaries):
+    columns = {name: _encode([record[name] for record in records], dictionaries[name])
+               for name in CATEGORIES}
+    for name, dtype in DTYPES.items():
+        values = [record[name] for record in records]
+        if np.dtype(dtype).kind == 'M':
+            values = [np.datetime64('NaT') if value is None else value for value in values]
+        columns[name] = np.array(values, dtype=dtype)
+    return columns
+
+
+def _posting(codes, size):
+    # Row ids grouped by code (ascending within a code) and the offsets of each code's group
+    order = np.argsort(codes, kind='stable').astype(np.int64)
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=size), out=offsets[1:])
+    return order, offsets
+
+
+class ResultsStore:
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+        self._index = None
+        self._columns = None
+
+    def _index_path(self):
+        return os.path.join(self.root, 'index.json')
+
+    def index(self):
+        if self._index is None:
+            path = self._index_path()
+            if os.path.exists(path):
+                with open(path, 'r') as file:
+                    self._index = json.load(file)
+            else:
+                self._index = {'data': None, 'rows': 0, 'categories': {name: [] for name in CATEGORIES}}
+        return self._index
+
+    def columns(self):
+        # Memory-mapped columns (and posting lists, as '<category>.order' / '.offsets')
+        if self._columns is None:
+            index = self.index()
+            if index['data'] is None:
+                self._columns = _typed([], {name: [] for name in CATEGORIES})
+                for name in CATEGORIES:
+                    self._columns[name + '.order'], self._columns[name + '.offsets'] = _posting(
+                        self._columns[name], 0)
+            else:
+                data_dir = os.path.join(self.root, index['data'])
+                self._columns = {
+                    entry[:-len('.npy')]: np.load(os.path.join(data_dir, entry), mmap_mode='r')
+                    for entry in os.listdir(data_dir) if entry.endswith('.npy')
+                }
+        return self._columns
+
+    def __len__(self):
+        return self.index()['rows']
+
+    def categories(self, name):
+        return self.index()['categories'][name]
+
+    def import_records(self, records, run):
+        # Replace the rows of `run` with records; returns the number of rows imported
+        index = self.index()
+        dictionaries = {name: list(values) for name, values in index['categories'].items()}
+        records = list(records)
+        for record in records:
+            record['run'] = run
+        new = _typed(records, dictionaries)
+
+        old = self.columns()
+        keep = np.ones(len(self), dtype=bool)
+        if run in index['categories']['run']:
+            keep = np.asarray(old['run']) != index['categories']['run'].index(run)
+        merged = {name: np.concatenate([np.asarray(old[name])[keep], new[name]]) for name in COLUMNS}
+        order = np.lexsort((merged['symbol'], merged['run'], merged['start_date']))
+        merged = {name: column[order] for name, column in merged.items()}
+        self._write(merged, dictionaries)
+        return len(records)
+
+    def import_file(self, path, run=None):
+        run = run or os.path.splitext(os.path.basename(path))[0]
+        return self.import_records(read_results(path), run)
+
+    def import_files(self, paths, run=None):
+        # Files of the same run (all of them with `run`, else those with the same file name) are
+        # imported together, so each replaces the run once instead of the last file winning.
+        # Returns {path: number of rows}
+        runs = {}
+        counts = {}
+        for path in paths:
+            records = list(read_results(path))
+            counts[path] = len(records)
+            runs.setdefault(run or os.path.splitext(os.path.basename(path))[0], []).extend(records)
+        for name, records in runs.items():
+            self.import_records(records, name)
+        return counts
+
+    def drop_run(self, run):
+        if run in self.categories('run'):
+            self.import_records([], run)
+
+    def _write(self, columns, dictionaries):
+        # Fresh data directory + atomic index swap, as in KlineStore.write
+        os.makedirs(self.root, exist_ok=True)
+        data_name = 'data-' + uuid.uuid4().hex[:12]
+        data_dir = os.path.join(self.root, data_name)
+        os.makedirs(data_dir)
+        for name, column in columns.items():
+            np.save(os.path.join(data_dir, name + '.npy'), np.ascontiguousarray(column))
+        for name in CATEGORIES:
+            order, offsets = _posting(columns[name], len(dictionaries[name]))
+            np.save(os.path.join(data_dir, name + '.order.npy'), order)
+            np.save(os.path.join(data_dir, name + '.offsets.npy'), offsets)
+
+        rows = len(columns['start_date'])
+        tmp = self._index_path() + '.' + uuid.uuid4().hex[:8]
+        with open(tmp, 'w') as file:
+            json.dump({'data': data_name, 'rows': rows, 'categories': dictionaries}, file)
+        os.replace(tmp, self._index_path())
+        for entry in os.listdir(self.root):
+            if entry.startswith('data-') and entry != data_name:
+                shutil.rmtree(os.path.join(self.root, entry), ignore_errors=True)
+        self._index = None
+        self._columns = None
+
+    def select(self, start=None, end=None, **filters):
+        # Rows with start <= start_date <= end (dates as 'YYYY-MM-DD') whose category columns
+        # match filters (a value or a list of values per column): a slice when only the dates
+        # restrict them (zero-copy on the memory-mapped columns), sorted row ids otherwise
+        columns = self.columns()
+        dates = columns['start_date']
+        lo = 0 if start is None else int(np.searchsorted(dates, np.datetime64(start, 'D'), side='left'))
+        hi = len(dates) if end is None else int(np.searchsorted(dates, np.datetime64(end, 'D'), side='right'))
+        rows = None
+        for name, wanted in filters.items():
+            if wanted is None:
+                continue
+            if name not in CATEGORIES:
+                raise ValueError(f"Not a category column: {name}")
+            if isinstance(wanted, str):
+                wanted = [wanted]
+            lookup = {value: code for code, value in enumerate(self.categories(name))}
+            order = columns[name + '.order']
+            offsets = columns[name + '.offsets']
+            parts = [order[offsets[lookup[value]]:offsets[lookup[value] + 1]]
+                     for value in wanted if value in lookup]
+            matched = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+            matched = matched[np.searchsorted(matched, lo):np.searchsorted(matched, hi)]
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        return slice(lo, hi) if rows is None else rows
+
+    def _group_codes(self, by, rows):
+        # Per-row group codes of `rows` and a decoder from code to group labels
+        columns = self.columns()
+        codes = np.zeros(len(columns['start_date'][rows]), dtype=np.int64)
+        decoders = []
+        size = 1
+        for name in by:
+            if name in CATEGORIES:
+                part = np.asarray(columns[name][rows], dtype=np.int64)
+                labels = self.categories(name)
+            elif name in ('date', 'month', 'year'):
+                # Offsets from the first period of the selection (rows are sorted by date)
+                unit = {'date': 'D', 'month': 'M', 'year': 'Y'}[name]
+                values = np.asarray(columns['start_date'][rows]).astype(f'datetime64[{unit}]')
+                first = values.min() if len(values) else np.datetime64('1970-01-01', unit)
+                part = (values - first).astype(np.int64)
+                span = int(part.max()) + 1 if len(part) else 0
+                labels = [str(first + step) for step in range(span)]
+            else:
+                raise ValueError(f"Cannot group by {name}")
+            codes = codes * len(labels) + part
+            decoders.append(labels)
+            size *= max(len(labels), 1)
+
+        def decode(code):
+            out = []
+            for labels in reversed(decoders):
+                code, part = divmod(int(code), len(labels))
+                out.append(labels[part])
+            return out[::-1]
+        return codes, size, decode
+
+    def summary(self, by=(), start=None, end=None, capital=CAPITAL, **filters):
+        # Mean / extreme end value and drawdown, win rate and mean Sharpe of the selected rows,
+        # per group of the `by` columns (categories, or 'date' / 'month' / 'year' of start_date)
+        if isinstance(by, str):
+            by = (by,)
+        rows = self.select(start, end, **filters)
+        columns = self.columns()
+        end_value = np.asarray(columns['end_value'][rows])
+        drawdown = np.asarray(columns['max_drawdown'][rows])
+        sharpe = np.asarray(columns['sharpe_ratio'][rows])
+
+        codes, size, decode = self._group_codes(by, rows)
+        group_codes = None
+        if size > DENSE_GROUPS:
+            # Too many combinations for dense counts: group on the codes that occur
+            group_codes, codes = np.unique(codes, return_inverse=True)
+            size = len(group_codes)
+
+        # NaN (not recorded) values are left out of each statistic: they weigh 0 in the sums and
+        # counts and are replaced by the identity of min / max, so every pass runs over all codes
+        def mean(values):
+            valid = ~np.isnan(values)
+            sums = np.bincount(codes, weights=np.where(valid, values, 0.0), minlength=size)
+            return sums / np.bincount(codes, weights=valid, minlength=size)
+
+        def extreme(func, values, fill):
+            out = np.full(size, fill)
+            func.at(out, codes, np.where(np.isnan(values), fill, values))
+            return out
+
+        count = np.bincount(codes, minlength=size)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            wins = np.where(np.isnan(end_value), np.nan, end_value > capital)
+            stats = {
+                'count': count,
+                'mean_end_value': mean(end_value),
+                'min_end_value': extreme(np.minimum, end_value, np.inf),
+                'max_end_value': extreme(np.maximum, end_value, -np.inf),
+                'win_rate': mean(wins),
+                'mean_max_drawdown': mean(drawdown),
+                'worst_max_drawdown': extreme(np.maximum, drawdown, -np.inf),
+                'mean_sharpe_ratio': mean(sharpe),
+            }
+        groups = np.flatnonzero(count)
+        table = pd.DataFrame({name: values[groups] for name, values in stats.items()})
+        for name in ('min_end_value', 'max_end_value', 'worst_max_drawdown'):
+            table[name] = table[name].replace([np.inf, -np.inf], np.nan)
+        labels = [decode(code if group_codes is None else group_codes[code]) for code in groups]
+        for i, name in enumerate(by):
+            table.insert(i, name, [label[i] for label in labels])
+        return table
+
+    def frame(self, start=None, end=None, **filters):
+        # Selected rows as a DataFrame with decoded categories
+        rows = self.select(start, end, **filters)
+        columns = self.columns()
+        data = {}
+        for name in COLUMNS:
+            values = np.asarray(columns[name][rows])
+            if name in CATEGORIES:
+                values = np.asarray(self.categories(name), dtype=object)[values] if len(values) else values
+            data[name] = values
+        return pd.DataFrame(data)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Columnar store and queries over backtest results')
+    parser.add_argument('--store', default=DEFAULT_ROOT)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    importer = commands.add_parser('import', help='import result CSVs, JSON Lines files or console logs')
+    importer.add_argument('paths', nargs='+')
+    importer.add_argument('--run', default=None, help='run name (default: the file name without extension)')
+
+    commands.add_parser('runs', help='list the runs in the store')
+
+    dropper = commands.add_parser('drop', help='remove a run from the store')
+    dropper.add_argument('run')
+
+    summary = commands.add_parser('summary', help='aggregate end value / drawdown per group')
+    summary.add_argument('--by', action='append', default=None,
+                         help=f"group column: {', '.join(CATEGORIES)}, date, month or year (repeatable)")
+    summary.add_argument('--start', default=None, help='first start_date (YYYY-MM-DD)')
+    summary.add_argument('--end', default=None, help='last start_date (YYYY-MM-DD)')
+    for name in CATEGORIES:
+        summary.add_argument(f'--{name}', action='append', default=None, help=f'only rows with this {name}')
+    summary.add_argument('--csv', default=None, help='also write the table to a CSV file')
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    if args.command == 'import':
+        for path, count in store.import_files(args.paths, args.run).items():
+            print(f"Imported {count} rows from {path}")
+        print(f"{len(store)} rows in {args.store}")
+    elif args.command == 'runs':
+        print(store.summary(by='run')[['run', 'count', 'mean_end_value', 'mean_max_drawdown']].to_string(index=False))
+    elif args.command == 'drop':
+        store.drop_run(args.run)
+        print(f"{len(store)} rows in {args.store}")
+    else:
+        table = store.summary(by=tuple(args.by or ()), start=args.start, end=args.end,
+                              **{name: getattr(args, name) for name in CATEGORIES})
+        print(table.to_string(index=False))
+        if args.csv:
+            table.to_csv(args.csv, index=False)
@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from kline_source import KLINE_INTERVAL_1DAY, KLINE_INTERVAL_1MINUTE, PAGE_LIMIT, KlineSource
+from kline_store import INTERVAL_MS, date_to_ms, get_store, klines_to_columns, merge_ranges
+
+# Concurrent paginated kline downloads. A time range is split into 1000-kline page requests that
+# run concurrently under a token bucket modelled on Binance's request-weight limit, with retries
+# and backoff on 429/418/5xx and network errors; pages are reassembled in order and de-duplicated
+# by open time. prefetch() fills the kline store for a whole sweep before it starts.
+
+BASE_URL = 'https://api.binance.com'
+WEIGHT_PER_MINUTE = 6000  # REQUEST_WEIGHT limit per IP
+RETRY_STATUS = (418, 429, 500, 502, 503, 504)
+
+
+def klines_weight(limit):
+    # Request weight of GET /api/v3/klines by page size
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+
+def page_ranges(interval, start_ms, end_ms, limit=PAGE_LIMIT):
+    # Inclusive [start, end] open-time ranges of at most `limit` klines each
+    span = INTERVAL_MS[interval] * limit
+    return [(start, min(start + span - 1, end_ms)) for start in range(start_ms, end_ms + 1, span)]
+
+
+class TokenBucket:
+    def __init__(self, capacity=WEIGHT_PER_MINUTE, period=60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, weight):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill()
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                await asyncio.sleep((weight - self.tokens) / self.rate)
+
+    def rebind(self):
+        # New lock for the next event loop (asyncio.run); the budget and any ban carry over
+        self._lock = asyncio.Lock()
+
+    def observe(self, used_weight):
+        # Trust the server's X-MBX-USED-WEIGHT-1M count when it is lower than our budget
+        self._refill()
+        self.tokens = min(self.tokens, self.capacity - used_weight)
+
+    def block(self, seconds):
+        # Stop issuing requests after a 429/418 until Retry-After has passed
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+class AsyncKlineDownloader(KlineSource):
+    def __init__(self, base_url=BASE_URL, concurrency=8, bucket=None, retries=5, backoff=0.5,
+                 timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.bucket = bucket
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._semaphore = None
+
+    def _get(self, url):
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            used = response.headers.get('X-MBX-USED-WEIGHT-1M')
+            return json.loads(response.read()), used
+
+    async def fetch_page(self, symbol, interval, start_ms, end_ms, limit=PAGE_LIMIT):
+        query = urllib.parse.urlencode({
+            'symbol': symbol, 'interval': interval,
+            'startTime': start_ms, 'endTime': end_ms, 'limit': limit,
+        })
+        url = f'{self.base_url}/api/v3/klines?{query}'
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire(klines_weight(limit))
+            try:
+                async with self._semaphore:
+                    page, used = await asyncio.to_thread(self._get, url)
+                if used is not None:
+                    self.bucket.observe(int(used))
+                return page
+            except urllib.error.HTTPError as exc:
+                if exc.code not in RETRY_STATUS or attempt == self.retries:
+                    raise
+                retry_after = exc.headers.get('Retry-After') if exc.headers else None
+                if exc.code in (418, 429):
+                    self.bucket.block(float(retry_after) if retry_after else 60.0)
+            except (urllib.error.URLError, TimeoutError, ConnectionError):
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+
+    def _start(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self.bucket is None:
+            self.bucket = TokenBucket()
+
+    async def fetch_range(self, symbol, interval, start_ms, end_ms):
+        self._start()
+        pages = await asyncio.gather(*(
+            self.fetch_page(symbol, interval, start, end)
+            for start, end in page_ranges(interval, start_ms, end_ms)
+        ))
+        rows = []
+        last = None
+        for page in pages:
+            for row in page:
+                if start_ms <= row[0] <= end_ms and (last is None or row[0] > last):
+                    rows.append(row)
+                    last = row[0]
+        return rows
+
+    def get_historical_klines(self, symbol, interval, start_ms, end_ms):
+        # Synchronous entry point, so the downloader can also be used as a kline source. Every
+        # call runs its own event loop; the bucket (weight spent, Retry-After bans) is kept across
+        # calls and only its lock is made anew
+        self._semaphore = None
+        if self.bucket is not None:
+            self.bucket.rebind()
+        return asyncio.run(self.fetch_range(symbol, interval, start_ms, end_ms))
+
+    async def prefetch(self, ranges, store):
+        # Download every gap of every (symbol, interval, start_ms, end_ms) range into the store
+        self._start()
+        gaps = []
+        for symbol, interval, start_ms, end_ms in ranges:
+            for gap_start, gap_stop in store.missing(symbol, interval, start_ms, end_ms):
+                gaps.append((symbol, interval, gap_start, gap_stop - 1))
+
+        async def fill(symbol, interval, start_ms, end_ms):
+            rows = await self.fetch_range(symbol, interval, start_ms, end_ms)
+            store.write(symbol, interval, klines_to_columns(rows), start_ms, end_ms)
+            return len(rows)
+
+        counts = await asyncio.gather(*(fill(*gap) for gap in gaps))
+        return len(gaps), sum(counts)
+
+
+def sweep_ranges(parsed_data, daily_from_minutes=False):
+    # Everything a Strategyv1 sweep reads: 52 daily bars for the regime and 30 days of 1-minute
+    # bars after each prediction date, merged per symbol into few union ranges. With
+    # daily_from_minutes the regime's days come from 1-minute bars too, which merge with the
+    # window's own range.
+    day = INTERVAL_MS[KLINE_INTERVAL_1DAY]
+    by_key = {}
+    for start_date, symbol in parsed_data.items():
+        start = date_to_ms(start_date)
+        if daily_from_minutes:
+            by_key.setdefault((symbol, KLINE_INTERVAL_1MINUTE), []).append([start - 51 * day, start + day])
+        else:
+            by_key.setdefault((symbol, KLINE_INTERVAL_1DAY), []).append([start - 51 * day, start + 1])
+        by_key.setdefault((symbol, KLINE_INTERVAL_1MINUTE), []).append([start + day, start + 31 * day + 1])
+    ranges = []
+    for (symbol, interval), spans in by_key.items():
+        ranges.extend((symbol, interval, start, stop - 1) for start, stop in merge_ranges(spans))
+    return ranges
+
+
+def prefetch(parsed_data, base_url=BASE_URL, store=None, concurrency=8, daily_from_minutes=False):
+    downloader = AsyncKlineDownloader(base_url, concurrency=concurrency)
+    return asyncio.run(downloader.prefetch(sweep_ranges(parsed_data, daily_from_minutes), store or get_store()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prefetch every kline a data.json sweep needs')
+    parser.add_argument('--data', default='data.json')
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--daily-from-minutes', action='store_true',
+                        help='fetch the regime lookback as 1-minute bars (for Strategyv1 --daily-from-minutes)')
+    args = parser.parse_args()
+
+    with open(args.data, 'r') as file:
+        parsed_data = json.load(file)
+    started = time.perf_counter()
+    gaps, rows = prefetch(parsed_data, args.base_url, concurrency=args.concurrency,
+                          daily_from_minutes=args.daily_from_minutes)
+    print(f"Downloaded {rows} klines in {gaps} ranges in {time.perf_counter() - started:.1f}s")
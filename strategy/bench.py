@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import backtrader as bt
+import numpy as np
+
+from instrumentation import Metrics, instrumented
+from kline_feed import KlineArrayData, prepare_columns
+from kline_store import KlineStore
+from ledger import EquityRecorder
+from Martingalev1_withstop import strategies
+from performance import compute
+from synthetic import synthetic_klines
+from vector_engine import indicator_arrays, run_vectorized
+
+# Offline benchmark of the martingale_withstop pipeline on synthetic bars. Every stage is timed
+# separately for each strategy:
+#
+#   backtrader  fetch (kline store read), convert (typed columns + feed), indicator_setup
+#               (strategy __init__), indicators (runonce precompute), next (strategy logic),
+#               analyzers (equity recording + post-hoc metrics), bar_loop (the rest of cerebro's
+#               loop: broker, orders, observers)
+#   numpy       fetch, indicators, bar_loop (rules, fills and metrics)
+#
+# Peak traced memory comes from a separate tracemalloc pass, so it does not slow the timings.
+# Results are written as JSON; --compare prints the throughput change against an older file.
+
+CAPITAL = 1000
+COMMISSION = 0.001  # same as martingale_withstop
+SYMBOL = 'SYNTHUSDT'
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_backtrader(strategy, store, start_ms, end_ms):
+    timings = dict.fromkeys(('fetch', 'convert', 'indicator_setup', 'indicators', 'next',
+                             'analyzers', 'bar_loop'), 0.0)
+    metrics = Metrics()
+
+    started = time.perf_counter()
+    columns = store.read(SYMBOL, '1m', start_ms, end_ms)
+    timings['fetch'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    data = KlineArrayData(columns=prepare_columns(columns))
+    timings['convert'] = time.perf_counter() - started
+
+    # Same configuration as martingale_withstop
+    started = time.perf_counter()
+    cerebro = bt.Cerebro()
+    cerebro.addstrategy(instrumented(strategy, metrics))
+    cerebro.adddata(data)
+    cerebro.broker.set_cash(CAPITAL)
+    cerebro.broker.setcommission(commission=COMMISSION)
+    cerebro.addanalyzer(EquityRecorder, _name="equity")
+    results = cerebro.run()
+    finished = time.perf_counter()
+    performance = compute(results[0].analyzers.equity.get_analysis(), ('sharpe', 'max_drawdown'))
+    elapsed = time.perf_counter() - started
+    timings.update(metrics.stages)
+    # The post-hoc metrics are part of the analyzers stage
+    timings['analyzers'] = timings.get('analyzers', 0.0) + time.perf_counter() - finished
+
+    timings['bar_loop'] = elapsed - sum(timings[stage] for stage in
+                                        ('indicator_setup', 'indicators', 'next', 'analyzers'))
+    return timings, len(columns['close']), cerebro.broker.getvalue(), performance['max_drawdown']
+
+
+def bench_numpy(strategy, store, start_ms, end_ms):
+    timings = {}
+    started = time.perf_counter()
+    columns = store.read(SYMBOL, '1m', start_ms, end_ms)
+    timings['fetch'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    ind = indicator_arrays(strategy, columns)
+    timings['indicators'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result = run_vectorized(strategy, columns, CAPITAL, commission=COMMISSION, indicators=ind)
+    timings['bar_loop'] = time.perf_counter() - started
+    return timings, len(columns['close']), result.value, result.max_drawdown
+
+
+ENGINES = {
+    'backtrader': bench_backtrader,
+    'numpy': bench_numpy,
+}
+
+
+def peak_memory(func, *args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(n_bars=43_200, seed=0, engines=tuple(ENGINES), names=tuple(strategies), repeat=3,
+                   memory=True):
+    columns = synthetic_klines(n_bars, seed=seed)
+    start_ms = int(columns['open_time'][0])
+    end_ms = int(columns['open_time'][-1])
+    rows = []
+    with tempfile.TemporaryDirectory() as root:
+        store = KlineStore(root)
+        store.write(SYMBOL, '1m', columns, start_ms, end_ms)
+        for engine in engines:
+            bench = ENGINES[engine]
+            for name in names:
+                strategy = strategies[name]
+                # Best of `repeat` runs per stage
+                runs = [bench(strategy, store, start_ms, end_ms) for _ in range(repeat)]
+                stages = {stage: min(run[0][stage] for run in runs) for stage in runs[0][0]}
+                _, bars, value, max_drawdown = runs[0]
+                total = sum(stages.values())
+                row = {
+                    'engine': engine,
+                    'strategy': name,
+                    'bars': bars,
+                    'stages': stages,
+                    'total_s': total,
+                    'bars_per_s': bars / total if total else None,
+                    'end_value': value,
+                    'max_drawdown': max_drawdown,
+                }
+                if memory:
+                    row['peak_memory_bytes'] = peak_memory(bench, strategy, store, start_ms, end_ms)
+                rows.append(row)
+                print(f"{engine:>10} {name:>12}: {total:.3f}s, {row['bars_per_s']:,.0f} bars/s")
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'backtrader': bt.__version__,
+        'machine': platform.machine(),
+        'n_bars': n_bars,
+        'seed': seed,
+        'repeat': repeat,
+        'results': rows,
+    }
+
+
+def compare(old, new):
+    # Throughput ratio (new / old) per engine and strategy, and per stage
+    before = {(row['engine'], row['strategy']): row for row in old['results']}
+    lines = []
+    for row in new['results']:
+        key = (row['engine'], row['strategy'])
+        if key not in before:
+            continue
+        base = before[key]
+        ratio = row['bars_per_s'] / base['bars_per_s'] if base['bars_per_s'] else float('nan')
+        stages = ', '.join(
+            f"{stage} {base['stages'][stage] / seconds:.2f}x" if seconds else f"{stage} -"
+            for stage, seconds in row['stages'].items() if stage in base['stages'])
+        lines.append(f"{key[0]:>10} {key[1]:>12}: {ratio:.2f}x throughput ({stages})")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the withstop strategies on synthetic bars')
+    parser.add_argument('--bars', type=int, default=43_200, help='number of 1-minute bars (default 30 days)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--engine', choices=sorted(ENGINES), action='append', default=None)
+    parser.add_argument('--strategy', choices=sorted(strategies), action='append', default=None)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--compare', default=None, help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.bars, args.seed, tuple(args.engine or ENGINES),
+                            tuple(args.strategy or strategies), args.repeat, not args.no_memory)
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved to {args.out}")
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            print(compare(json.load(file), report))
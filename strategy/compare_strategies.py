@@ -0,0 +1,116 @@
+import argparse
+import json
+
+from kline_source import KLINE_INTERVAL_1MINUTE, set_source
+from market_conditionv1 import market_prediction, set_daily_source
+from optimizer import COMMISSIONS, MODULES, window_dates
+from parallel import run_parallel, run_sequential
+from results_writer import ResultsWriter, completed_keys, export_csv
+from Strategyv1_withstop import predict_markets
+from vector_engine import run_many
+
+# Every strategy of a module on every data.json window, in one pass over the window's bars: the
+# bars are fetched once, indicators shared by the strategies (MACD with the default periods) are
+# computed once, and the strategies step through the bars together on the NumPy engine, each with
+# its own account. A row holds every strategy's end value and max drawdown next to the predicted
+# regime and the strategy the regime selects, so regime selection can be checked against the best
+# strategy of the window.
+
+CAPITAL = 1000
+
+
+def strategy_for(module, market):
+    # Name (in module.strategies) of the strategy the regime selects
+    selected = module.market_strategies.get(market)
+    for name, strategy in module.strategies.items():
+        if strategy is selected:
+            return name
+    return None
+
+
+def run_window_all(start_date, symbol, market=None, module_name='withstop', names=None):
+    module = MODULES[module_name]
+    names = names or list(module.strategies)
+    starting_date, result_date = window_dates(start_date)
+    if market is None:
+        market = market_prediction(symbol, start_date)
+
+    columns = module.fetch_binance_data(symbol, KLINE_INTERVAL_1MINUTE, starting_date, result_date, 'UTC')
+    results = run_many({name: module.strategies[name] for name in names}, columns, CAPITAL,
+                       commission=COMMISSIONS[module_name])
+
+    row = {'symbol': symbol, 'start_date': start_date, 'market': market,
+           'selected': strategy_for(module, market)}
+    for name, result in results.items():
+        row[f'{name}_end_value'] = result.value
+        row[f'{name}_max_drawdown'] = result.max_drawdown
+    row['best'] = max(results, key=lambda name: results[name].value)
+    return row
+
+
+def columns_for(names):
+    columns = ['symbol', 'start_date', 'market', 'selected', 'best']
+    for name in names:
+        columns += [f'{name}_end_value', f'{name}_max_drawdown']
+    return columns
+
+
+def main(module_name='withstop', names=None, workers=1, resume=False,
+         results_path='strategy_comparison.jsonl', output_file='strategy_comparison.csv'):
+    names = names or list(MODULES[module_name].strategies)
+    print(f"Comparing {', '.join(names)} ({module_name}) on every window...")
+
+    with open(r'data.json', 'r') as file:
+        parsed_data = json.load(file)
+    all_jobs = list(parsed_data.items())
+
+    done = completed_keys(results_path) if resume else set()
+    jobs = [(start_date, symbol) for start_date, symbol in all_jobs if (symbol, start_date) not in done]
+    if resume:
+        print(f"Resuming: {len(all_jobs) - len(jobs)} windows already done, {len(jobs)} to run")
+
+    markets = predict_markets(jobs)
+    jobs = [(start_date, symbol, markets.get((start_date, symbol)), module_name, names)
+            for start_date, symbol in jobs]
+
+    with ResultsWriter(results_path, resume=resume) as writer:
+        def report(i, job, row, error):
+            start_date, symbol = job[:2]
+            if error is not None:
+                print(f"Failed for {symbol} starting on {start_date}: {error}")
+                writer.write({'symbol': symbol, 'start_date': start_date, 'error': error})
+                return
+            print(f"{symbol} starting on {start_date}: {row['market']}, selected = {row['selected']}, best = {row['best']}")
+            writer.write(row)
+
+        if workers > 1:
+            run_parallel(run_window_all, jobs, workers=workers, on_result=report, keep_results=False)
+        else:
+            run_sequential(run_window_all, jobs, on_result=report, keep_results=False)
+
+    export_csv(results_path, output_file, columns_for(names),
+               order=[(symbol, start_date) for start_date, symbol in all_jobs])
+    print(f"Results saved to {output_file}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run every strategy on every data.json window in one pass')
+    parser.add_argument('--module', choices=sorted(MODULES), default='withstop')
+    parser.add_argument('--strategy', action='append', default=None,
+                        help='strategy to compare (repeatable, default all of the module)')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes (1 = sequential)')
+    parser.add_argument('--source', default=None, help="kline source: live, replay:<dir> or http://host:port")
+    parser.add_argument('--daily-from-minutes', action='store_true',
+                        help='build the regime\'s daily bars from the 1-minute store instead of fetching 1d klines')
+    parser.add_argument('--resume', action='store_true', help='skip windows already in the results file')
+    parser.add_argument('--results', default='strategy_comparison.jsonl', help='JSON Lines results file')
+    parser.add_argument('--out', default='strategy_comparison.csv')
+    args = parser.parse_args()
+    if args.source:
+        set_source(args.source)
+    if args.daily_from_minutes:
+        set_daily_source('minutes')
+    unknown = set(args.strategy or ()) - set(MODULES[args.module].strategies)
+    if unknown:
+        parser.error(f"unknown strategies for {args.module}: {', '.join(sorted(unknown))}")
+    main(args.module, args.strategy, args.workers, args.resume, args.results, args.out)
@@ -0,0 +1,264 @@
+import math
+from collections import deque
+
+import numpy as np
+
+# Streaming indicators with constant-time updates and small, JSON-serializable state. They follow
+# backtrader's definitions and seeding (EMA/SMMA start from the simple mean of their first
+# `period` inputs, ATR uses the previous close), so a backtest on arrays, a live feed and the
+# regime classifier all get the same numbers. The batch functions below compute whole arrays
+# with the same definitions, and a saved state() can be resumed with from_state() to continue a
+# series without replaying its history.
+#
+# EMA, SMMA, MACD and RSI also update many series at once when given an array per bar (one value
+# per series, e.g. Monte Carlo paths). The series must start together: a bar with a NaN in any of
+# them counts as not started.
+
+NAN = float('nan')
+
+
+def _missing(x):
+    # NaN input: the series has not started yet
+    return x != x if isinstance(x, float) else bool(np.isnan(x).any())
+
+
+def _mean(values):
+    # Exact mean of the seed inputs, per series when they are arrays
+    if isinstance(values[0], np.ndarray):
+        return np.array([math.fsum(column) for column in np.array(values).T.tolist()]) / len(values)
+    return math.fsum(values) / len(values)
+
+
+def _slots(cls):
+    return [name for klass in reversed(cls.__mro__) for name in getattr(klass, '__slots__', ())]
+
+
+class Indicator:
+    __slots__ = ()
+
+    def state(self):
+        state = {}
+        for name in _slots(type(self)):
+            value = getattr(self, name)
+            if isinstance(value, Indicator):
+                value = value.state()
+            elif isinstance(value, deque):
+                value = list(value)
+            state[name] = value
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        indicator = cls.__new__(cls)
+        for name in _slots(cls):
+            value = state[name]
+            if isinstance(value, dict):
+                value = INDICATORS[value['kind']].from_state(value)
+            setattr(indicator, name, value)
+        indicator._restore()
+        return indicator
+
+    def _restore(self):
+        pass
+
+
+class EMA(Indicator):
+    # Exponential smoothing; NaN inputs before the first value are skipped
+    __slots__ = ('kind', 'period', 'alpha', 'seed', 'value')
+
+    def __init__(self, period, alpha=None):
+        self.kind = type(self).__name__
+        self.period = period
+        self.alpha = 2.0 / (1.0 + period) if alpha is None else alpha
+        self.seed = []
+        self.value = NAN
+
+    def update(self, x):
+        if self.seed is not None:
+            if _missing(x):
+                return NAN
+            self.seed.append(x)
+            if len(self.seed) < self.period:
+                return NAN
+            self.value = _mean(self.seed)
+            self.seed = None
+            return self.value
+        self.value = self.value * (1.0 - self.alpha) + x * self.alpha
+        return self.value
+
+
+class SMMA(EMA):
+    # Wilder's smoothed moving average
+    __slots__ = ()
+
+    def __init__(self, period):
+        super().__init__(period, alpha=1.0 / period)
+
+
+class SMA(Indicator):
+    # Trailing simple mean; each value depends only on its own window
+    __slots__ = ('kind', 'period', 'window', 'value')
+
+    def __init__(self, period):
+        self.kind = type(self).__name__
+        self.period = period
+        self.window = deque(maxlen=period)
+        self.value = NAN
+
+    def update(self, x):
+        self.window.append(x)
+        if len(self.window) < self.period:
+            return NAN
+        self.value = sum(self.window) / self.period
+        return self.value
+
+    def _restore(self):
+        self.window = deque(self.window, maxlen=self.period)
+
+
+class MACD(Indicator):
+    __slots__ = ('kind', 'fast', 'slow', 'signal', 'macd', 'value')
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.kind = type(self).__name__
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.signal = EMA(signal)
+        self.macd = NAN
+        self.value = NAN
+
+    def update(self, close):
+        # Returns (macd, signal)
+        self.macd = self.fast.update(close) - self.slow.update(close)
+        self.value = self.signal.update(self.macd)
+        return self.macd, self.value
+
+
+class RSI(Indicator):
+    __slots__ = ('kind', 'prev', 'up', 'down', 'value')
+
+    def __init__(self, period=14):
+        self.kind = type(self).__name__
+        self.prev = None
+        self.up = SMMA(period)
+        self.down = SMMA(period)
+        self.value = NAN
+
+    def update(self, close):
+        if self.prev is None:
+            self.prev = close
+            return NAN
+        change = close - self.prev
+        self.prev = close
+        if isinstance(change, np.ndarray):
+            maup = self.up.update(np.maximum(change, 0.0))
+            madown = self.down.update(np.maximum(-change, 0.0))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.value = np.where(madown == 0.0, np.where(maup > 0.0, 100.0, NAN),
+                                      100.0 - 100.0 / (1.0 + maup / madown))
+            return self.value
+        maup = self.up.update(max(change, 0.0))
+        madown = self.down.update(max(-change, 0.0))
+        if madown == 0.0:
+            # Same as the array maths: x / 0 -> inf -> RSI 100, 0 / 0 -> NaN
+            self.value = 100.0 if maup > 0.0 else NAN
+        else:
+            self.value = 100.0 - 100.0 / (1.0 + maup / madown)
+        return self.value
+
+
+class ATR(Indicator):
+    __slots__ = ('kind', 'prev', 'tr', 'value')
+
+    def __init__(self, period=5):
+        self.kind = type(self).__name__
+        self.prev = None
+        self.tr = SMMA(period)
+        self.value = NAN
+
+    def update(self, high, low, close):
+        if self.prev is None:
+            self.prev = close
+            return NAN
+        tr = max(high, self.prev) - min(low, self.prev)
+        self.prev = close
+        self.value = self.tr.update(tr)
+        return self.value
+
+
+INDICATORS = {cls.__name__: cls for cls in (EMA, SMMA, SMA, MACD, RSI, ATR)}
+
+
+# Batch versions over whole arrays. The elementwise parts (differences, true range, window sums)
+# are NumPy array operations; the smoothing recursions run as one flat loop over floats, with the
+# same seeding and arithmetic as the classes above, so their values are identical to a streaming
+# run.
+
+def _smooth(values, period, alpha):
+    # EMA.update over a whole series: seeded with the fsum mean of the first `period` non-NaN
+    # inputs, then value * (1 - alpha) + x * alpha
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), NAN)
+    valid = np.flatnonzero(~np.isnan(values))
+    if len(valid) < period:
+        return out
+    seeded = valid[period - 1]
+    value = math.fsum(values[valid[:period]].tolist()) / period
+    out[seeded] = value
+    keep = 1.0 - alpha
+    for i, x in enumerate(values[seeded + 1:].tolist(), seeded + 1):
+        value = value * keep + x * alpha
+        out[i] = value
+    return out
+
+
+def ema(values, period, alpha=None):
+    return _smooth(values, period, 2.0 / (1.0 + period) if alpha is None else alpha)
+
+
+def smma(values, period):
+    return _smooth(values, period, 1.0 / period)
+
+
+def sma(values, period):
+    # Window sums added up oldest value first, as SMA.update's sum(), one array add per lag
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), NAN)
+    n = len(values) - period + 1
+    if n > 0:
+        total = values[:n].copy()
+        for lag in range(1, period):
+            total += values[lag:lag + n]
+        out[period - 1:] = total / period
+    return out
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    line = ema(close, fast) - ema(close, slow)
+    return line, ema(line, signal)
+
+
+def rsi(close, period=14):
+    close = np.asarray(close, dtype=np.float64)
+    out = np.full(len(close), NAN)
+    if len(close) < 2:
+        return out
+    change = np.diff(close)
+    maup = smma(np.maximum(change, 0.0), period)
+    madown = smma(np.maximum(-change, 0.0), period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[1:] = np.where(madown == 0.0, np.where(maup > 0.0, 100.0, NAN),
+                           100.0 - 100.0 / (1.0 + maup / madown))
+    return out
+
+
+def atr(high, low, close, period=5):
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    out = np.full(len(close), NAN)
+    if len(close) < 2:
+        return out
+    prev = close[:-1]
+    out[1:] = smma(np.maximum(high[1:], prev) - np.minimum(low[1:], prev), period)
+    return out
@@ -0,0 +1,109 @@
+import cProfile
+import io
+import pstats
+import time
+from contextlib import contextmanager, nullcontext
+
+# Opt-in metrics for a backtest window: wall-clock time per stage, counters (bars processed,
+# orders placed, add-position attempts refused by the cash check) and an optional cProfile
+# capture. Runs without a Metrics object use the plain strategy classes and skip every timer,
+# so instrumentation costs nothing when it is off.
+
+
+class Metrics:
+    def __init__(self, profile=False):
+        self.stages = {}
+        self.counters = {}
+        self.profiler = cProfile.Profile() if profile else None
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def stage(self, name, profile=False):
+        # Time a block; profile=True also runs it under the profiler when one is set up
+        profiler = self.profiler if profile else None
+        if profiler is not None:
+            profiler.enable()
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(name, time.perf_counter() - started)
+            if profiler is not None:
+                profiler.disable()
+
+    def profile_top(self, limit=15, sort='cumulative'):
+        # The `limit` most expensive functions of the profile
+        if self.profiler is None:
+            return None
+        stats = pstats.Stats(self.profiler, stream=io.StringIO())
+        stats.sort_stats(sort)
+        top = []
+        for func in stats.fcn_list[:limit]:
+            calls, primitive, tottime, cumtime, _ = stats.stats[func]
+            filename, line, name = func
+            top.append({'function': f'{filename}:{line}({name})', 'calls': calls,
+                        'tottime': tottime, 'cumtime': cumtime})
+        return top
+
+    def dump_profile(self, path):
+        if self.profiler is not None:
+            self.profiler.dump_stats(path)
+
+    def record(self, profile_limit=15):
+        record = {'stages': dict(self.stages), 'counters': dict(self.counters)}
+        if self.profiler is not None:
+            record['profile'] = self.profile_top(profile_limit)
+        return record
+
+
+def stage(metrics, name, profile=False):
+    # metrics.stage(...) when instrumenting, a no-op context otherwise
+    if metrics is None:
+        return nullcontext()
+    return metrics.stage(name, profile)
+
+
+def instrumented(strategy, metrics):
+    # Subclass of a backtrader strategy that books indicator construction, the runonce
+    # indicator precompute, next() and the analyzers into `metrics`, and counts bars and orders
+    class Instrumented(strategy):
+        def __init__(self):
+            started = time.perf_counter()
+            super().__init__()
+            metrics.add('indicator_setup', time.perf_counter() - started)
+
+        def _once(self):
+            started = time.perf_counter()
+            super()._once()
+            metrics.add('indicators', time.perf_counter() - started)
+
+        def next(self):
+            started = time.perf_counter()
+            super().next()
+            metrics.add('next', time.perf_counter() - started)
+
+        def _next_analyzers(self, minperstatus, once=False):
+            started = time.perf_counter()
+            super()._next_analyzers(minperstatus, once)
+            metrics.add('analyzers', time.perf_counter() - started)
+
+        def buy(self, *args, **kwargs):
+            metrics.count('orders')
+            return super().buy(*args, **kwargs)
+
+        def sell(self, *args, **kwargs):
+            metrics.count('orders')
+            return super().sell(*args, **kwargs)
+
+        def stop(self):
+            super().stop()
+            metrics.count('bars', len(self.data))
+            metrics.count('add_rejected', getattr(self, 'add_rejected', 0))
+
+    Instrumented.__name__ = strategy.__name__
+    return Instrumented
@@ -0,0 +1,107 @@
+import numpy as np
+
+from kline_feed import INVALID_DATA, invalid_rows, to_datetime64
+from kline_source import KLINE_INTERVAL_1MINUTE, fetch_klines
+from kline_store import INTERVAL_MS, date_to_ms, get_store, merge_ranges
+from shared_bars import SharedBars, attach
+
+# Planning stage of the data.json sweeps. Windows of the same symbol often start a few days or
+# weeks apart, so their 30-day 1-minute ranges overlap heavily. plan_windows groups the windows
+# by symbol and merges overlapping ranges into unions; each union is read (and, for its gaps,
+# downloaded) once, validated once, and every window of it gets zero-copy slices of the union's
+# columns. Reads, parsing and memory then scale with the unique symbol-days, not the windows.
+#
+# A process keeps only the last union it loaded. plan_windows orders the windows union by union,
+# so a sequential sweep loads each union once. Sweeps on a process pool load the unions in the
+# parent and hand them to the workers in shared memory (shared_bars).
+
+DAY_MS = INTERVAL_MS['1d']
+
+
+def window_range(start_date):
+    # 1-minute bars of a window, [start+1 day, start+31 days] (both ends inclusive, epoch ms),
+    # the range martingale() reads for the dates of window_dates
+    start = date_to_ms(start_date)
+    return start + DAY_MS, start + 31 * DAY_MS
+
+
+class UnionRange:
+    # One symbol's merged range [start_ms, end_ms] and the windows it covers, as
+    # (start_date, start_ms, end_ms) in start order
+    __slots__ = ('symbol', 'start_ms', 'end_ms', 'windows')
+
+    def __init__(self, symbol, start_ms, end_ms):
+        self.symbol = symbol
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.windows = []
+
+    @property
+    def key(self):
+        return self.symbol, self.start_ms, self.end_ms
+
+    def days(self):
+        return (self.end_ms - self.start_ms) / DAY_MS
+
+
+def plan_windows(jobs):
+    # jobs: (start_date, symbol) pairs; returns the unions, ordered by symbol and start
+    spans = {}
+    for start_date, symbol in jobs:
+        spans.setdefault(symbol, []).append((start_date,) + window_range(start_date))
+
+    unions = []
+    for symbol in sorted(spans):
+        windows = sorted(spans[symbol], key=lambda window: window[1])
+        for start, stop in merge_ranges([[start_ms, end_ms + 1] for _, start_ms, end_ms in windows]):
+            union = UnionRange(symbol, start, stop - 1)
+            union.windows = [window for window in windows if start <= window[1] < stop]
+            unions.append(union)
+    return unions
+
+
+def plan_summary(unions):
+    windows = sum(len(union.windows) for union in unions)
+    window_days = sum((end_ms - start_ms) / DAY_MS for union in unions for _, start_ms, end_ms in union.windows)
+    union_days = sum(union.days() for union in unions)
+    return (f"{windows} windows in {len(unions)} symbol ranges: {union_days:.0f} symbol-days "
+            f"read instead of {window_days:.0f}")
+
+
+def load_union(symbol, start_ms, end_ms):
+    # Columns of a union (memory-mapped from the kline store, gaps downloaded first) and the mask
+    # of its invalid bars
+    columns = dict(get_store().load(symbol, KLINE_INTERVAL_1MINUTE, start_ms, end_ms, fetch_klines))
+    columns['datetime'] = to_datetime64(columns['open_time'])
+    return columns, invalid_rows(columns)
+
+
+_loaded = {'key': None, 'columns': None, 'invalid': None}
+
+
+def union_columns(union):
+    # union: a UnionRange.key, loaded here, or a shared_bars.SharedBars block the parent process
+    # has loaded. The last union is kept for the next window of the same union.
+    key = union.name if isinstance(union, SharedBars) else union
+    if _loaded['key'] != key:
+        _loaded.update(key=None, columns=None, invalid=None)  # release the previous union first
+        columns, invalid = attach(union) if isinstance(union, SharedBars) else load_union(*union)
+        _loaded.update(key=key, columns=columns, invalid=invalid)
+    return _loaded['columns'], _loaded['invalid']
+
+
+def window_bars(symbol, start_ms, end_ms, union):
+    # The window's prepared columns (as fetch_binance_data returns them) as views into the
+    # union's columns. union is the UnionRange.key the window belongs to, or its SharedBars.
+    columns, invalid = union_columns(union)
+    return slice_window(columns, invalid, start_ms, end_ms)
+
+
+def slice_window(columns, invalid, start_ms, end_ms):
+    # Views of the bars in [start_ms, end_ms] of a union's columns; ValueError if one is invalid
+    open_time = columns['open_time']
+    lo = np.searchsorted(open_time, start_ms, side='left')
+    hi = np.searchsorted(open_time, end_ms, side='right')
+    if invalid[lo:hi].any():
+        raise ValueError(INVALID_DATA)
+    return {name: column[lo:hi] for name, column in columns.items()}
@@ -0,0 +1,92 @@
+import backtrader as bt
+import numpy as np
+
+from kline_store import klines_to_columns
+
+# Array-backed ingestion: raw klines (or columns read from the kline store) stay as typed NumPy
+# columns all the way into backtrader, without per-row dicts or intermediate DataFrames.
+
+EPOCH_ORDINAL = 719163  # datetime.datetime(1970, 1, 1).toordinal(), backtrader's day numbering
+MS_PER_DAY = 86_400_000
+PRICE_COLUMNS = ('open', 'high', 'low', 'close')
+
+
+def to_datetime64(open_time):
+    # Epoch ms -> datetime64[ms] (UTC), a view on the int64 column rather than a copy
+    return np.asarray(open_time, dtype=np.int64).view('datetime64[ms]')
+
+
+def to_bt_num(open_time):
+    # Epoch ms -> backtrader float day numbers, vectorized equivalent of bt.date2num
+    open_time = np.asarray(open_time, dtype=np.int64)
+    days, ms = np.divmod(open_time, MS_PER_DAY)
+    return (days + EPOCH_ORDINAL).astype(np.float64) + ms / MS_PER_DAY
+
+
+INVALID_DATA = "Data contains null or zero values, which is invalid for backtesting"
+
+
+def validate_columns(columns):
+    for name in PRICE_COLUMNS + ('volume',):
+        if np.isnan(columns[name]).any():
+            raise ValueError(INVALID_DATA)
+    for name in PRICE_COLUMNS:
+        if not columns[name].all():
+            raise ValueError(INVALID_DATA)
+    return columns
+
+
+def invalid_rows(columns):
+    # Boolean mask of the bars validate_columns would reject (a NaN anywhere, a zero price), so
+    # a long series can be checked once and its windows judged by slicing the mask
+    bad = np.isnan(columns['volume'])
+    for name in PRICE_COLUMNS:
+        values = columns[name]
+        bad |= np.isnan(values) | (values == 0)
+    return bad
+
+
+def prepare_columns(columns):
+    columns = validate_columns(dict(columns))
+    columns['datetime'] = to_datetime64(columns['open_time'])
+    return columns
+
+
+def ingest_klines(klines):
+    # Raw Binance kline payload -> validated columns with a datetime64 view
+    return prepare_columns(klines_to_columns(klines))
+
+
+class KlineArrayData(bt.feed.DataBase):
+    # Feeds backtrader straight from the column arrays; each bar is read by index, so nothing
+    # is copied beyond what backtrader's own line buffers hold
+    params = (
+        ('columns', None),
+    )
+
+    def start(self):
+        super(KlineArrayData, self).start()
+        columns = self.p.columns
+        self._dtnum = to_bt_num(columns['open_time'])
+        self._open = columns['open']
+        self._high = columns['high']
+        self._low = columns['low']
+        self._close = columns['close']
+        self._volume = columns['volume']
+        self._idx = -1
+
+    def _load(self):
+        self._idx += 1
+        i = self._idx
+        if i >= len(self._dtnum):
+            return False
+
+        lines = self.lines
+        lines.datetime[0] = self._dtnum[i]
+        lines.open[0] = self._open[i]
+        lines.high[0] = self._high[i]
+        lines.low[0] = self._low[i]
+        lines.close[0] = self._close[i]
+        lines.volume[0] = self._volume[i]
+        lines.openinterest[0] = 0.0
+        return True
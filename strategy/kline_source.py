@@ -0,0 +1,258 @@
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from kline_store import INTERVAL_MS, KlineStore
+
+# Where kline rows come from when the kline store has a gap. Every source answers
+# get_historical_klines(symbol, interval, start_ms, end_ms) with raw Binance kline rows
+# (open time inclusive on both ends) and can be passed as the store's fetch callable.
+#
+#   live           python-binance Client, created on first use
+#   replay:<dir>   recorded fixture files, no network
+#   http://host    any server speaking GET /api/v3/klines, e.g. serve_klines() below
+#
+# The KLINE_SOURCE environment variable picks the default source (live when unset), so worker
+# processes of a sweep follow the parent's choice.
+
+API_KEY = ''
+API_SECRET = ''
+
+KLINE_INTERVAL_1MINUTE = '1m'
+KLINE_INTERVAL_1DAY = '1d'
+
+PAGE_LIMIT = 1000
+
+
+class KlineSource(ABC):
+    @abstractmethod
+    def get_historical_klines(self, symbol, interval, start_ms, end_ms):
+        ...
+
+    def __call__(self, symbol, interval, start_ms, end_ms):
+        return self.get_historical_klines(symbol, interval, start_ms, end_ms)
+
+
+class LiveSource(KlineSource):
+    def __init__(self, api_key=API_KEY, api_secret=API_SECRET):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self._client = None
+
+    @property
+    def client(self):
+        # Creating a Client pings the API, so it only happens once something is downloaded
+        if self._client is None:
+            from binance.client import Client
+            self._client = Client(self.api_key, self.api_secret)
+        return self._client
+
+    def get_historical_klines(self, symbol, interval, start_ms, end_ms):
+        return self.client.get_historical_klines(
+            symbol=symbol,
+            interval=interval,
+            start_str=start_ms,
+            end_str=end_ms,
+            limit=PAGE_LIMIT
+        )
+
+
+def fixture_path(root, symbol, interval):
+    return os.path.join(root, f'{symbol}_{interval}.json')
+
+
+class ReplaySource(KlineSource):
+    # Serves recorded fixtures: one JSON file of raw kline rows per symbol and interval
+    def __init__(self, root):
+        self.root = root
+        self._cache = {}
+
+    def _rows(self, symbol, interval):
+        key = (symbol, interval)
+        if key not in self._cache:
+            path = fixture_path(self.root, symbol, interval)
+            if not os.path.exists(path):
+                raise KeyError(f"No recorded klines for {symbol} {interval} in {self.root}")
+            with open(path, 'r') as file:
+                rows = json.load(file)
+            self._cache[key] = (np.array([row[0] for row in rows], dtype=np.int64), rows)
+        return self._cache[key]
+
+    def get_historical_klines(self, symbol, interval, start_ms, end_ms):
+        open_time, rows = self._rows(symbol, interval)
+        lo = np.searchsorted(open_time, start_ms, side='left')
+        hi = np.searchsorted(open_time, end_ms, side='right')
+        return rows[lo:hi]
+
+
+class RecordingSource(KlineSource):
+    # Wraps another source and records everything it returns as replay fixtures
+    def __init__(self, source, root):
+        self.source = source
+        self.root = root
+
+    def get_historical_klines(self, symbol, interval, start_ms, end_ms):
+        rows = self.source.get_historical_klines(symbol, interval, start_ms, end_ms)
+        os.makedirs(self.root, exist_ok=True)
+        path = fixture_path(self.root, symbol, interval)
+        recorded = {}
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                recorded = {row[0]: row for row in json.load(file)}
+        recorded.update((row[0], row) for row in rows)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump([recorded[t] for t in sorted(recorded)], file)
+        os.replace(tmp, path)
+        return rows
+
+
+class StoreSource(KlineSource):
+    # Reads what a KlineStore already holds, without downloading anything
+    def __init__(self, store=None):
+        self.store = store or KlineStore()
+
+    def get_historical_klines(self, symbol, interval, start_ms, end_ms):
+        columns = self.store.read(symbol, interval, start_ms, end_ms)
+        return columns_to_klines(columns, interval)
+
+
+def columns_to_klines(columns, interval):
+    step = INTERVAL_MS[interval]
+    rows = []
+    for t, o, h, l, c, v in zip(columns['open_time'].tolist(), columns['open'].tolist(),
+                                columns['high'].tolist(), columns['low'].tolist(),
+                                columns['close'].tolist(), columns['volume'].tolist()):
+        rows.append([t, repr(o), repr(h), repr(l), repr(c), repr(v), t + step - 1, '0', 0, '0', '0', '0'])
+    return rows
+
+
+class HttpSource(KlineSource):
+    # Pages through GET /api/v3/klines the way get_historical_klines does
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def get_page(self, symbol, interval, start_ms, end_ms, limit=PAGE_LIMIT):
+        query = urllib.parse.urlencode({
+            'symbol': symbol, 'interval': interval,
+            'startTime': start_ms, 'endTime': end_ms, 'limit': limit,
+        })
+        with urllib.request.urlopen(f'{self.base_url}/api/v3/klines?{query}', timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def get_historical_klines(self, symbol, interval, start_ms, end_ms):
+        rows = []
+        cursor = start_ms
+        while cursor <= end_ms:
+            page = self.get_page(symbol, interval, cursor, end_ms)
+            if not page:
+                break
+            rows.extend(page)
+            if len(page) < PAGE_LIMIT:
+                break
+            cursor = page[-1][0] + 1
+        return rows
+
+
+def serve_klines(source, host='127.0.0.1', port=0):
+    # Local stand-in for the Binance REST API: /api/v3/ping, /api/v3/time and /api/v3/klines
+    # answered from `source`. Returns the running server; its URL is server.url.
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            if url.path == '/api/v3/ping':
+                return self._send(200, {})
+            if url.path == '/api/v3/time':
+                return self._send(200, {'serverTime': int(time.time() * 1000)})
+            if url.path != '/api/v3/klines':
+                return self._send(404, {'code': -1, 'msg': 'Unknown endpoint.'})
+            try:
+                interval = query['interval']
+                limit = min(int(query.get('limit', 500)), PAGE_LIMIT)
+                start_ms = int(query.get('startTime', 0))
+                end_ms = int(query.get('endTime', 2 ** 62))
+                rows = source.get_historical_klines(query['symbol'], interval, start_ms, end_ms)
+            except KeyError:
+                return self._send(400, {'code': -1121, 'msg': 'Invalid symbol.'})
+            except ValueError:
+                return self._send(400, {'code': -1100, 'msg': 'Illegal characters found in a parameter.'})
+            self._send(200, rows[:limit])
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.url = f'http://{server.server_address[0]}:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def source_from_spec(spec):
+    if spec == 'live':
+        return LiveSource()
+    if spec.startswith('replay:'):
+        return ReplaySource(spec[len('replay:'):])
+    if spec.startswith('http://') or spec.startswith('https://'):
+        return HttpSource(spec)
+    raise ValueError(f"Unknown kline source: {spec}")
+
+
+_default_source = None
+
+
+def get_source():
+    global _default_source
+    if _default_source is None:
+        _default_source = source_from_spec(os.environ.get('KLINE_SOURCE', 'live'))
+    return _default_source
+
+
+def set_source(spec_or_source):
+    # Accepts a KlineSource or a spec string; the spec is exported so worker processes match
+    global _default_source
+    if isinstance(spec_or_source, str):
+        os.environ['KLINE_SOURCE'] = spec_or_source
+        _default_source = source_from_spec(spec_or_source)
+    else:
+        _default_source = spec_or_source
+
+
+def fetch_klines(symbol, interval, start_ms, end_ms):
+    # Fetch callable for the kline store that always goes through the current default source
+    return get_source().get_historical_klines(symbol, interval, start_ms, end_ms)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve stored klines on a local Binance API stand-in')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--replay', help='directory of recorded fixtures')
+    group.add_argument('--store', help='kline store directory')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    source = ReplaySource(args.replay) if args.replay else StoreSource(KlineStore(args.store))
+    server = serve_klines(source, args.host, args.port)
+    print(f"Serving klines on {server.url} (KLINE_SOURCE={server.url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
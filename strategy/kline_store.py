@@ -0,0 +1,228 @@
+import json
+import os
+import time
+import uuid
+import shutil
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+import numpy as np
+
+# On-disk kline store: one directory per (symbol, interval), one .npy file per column so every
+# column can be memory-mapped on its own, plus an index.json that records which time ranges
+# have already been downloaded. Ranges are half-open [start_ms, stop_ms) in epoch milliseconds.
+#
+# Several processes (sweep and optimizer workers) may fill gaps of the same symbol at once, so
+# every (symbol, interval) has a .lock file: writers merge into the index under an exclusive
+# flock, re-reading it first, and readers map the current data directory under a shared one,
+# so a writer never drops another's ranges or deletes a directory a reader is about to open.
+
+DEFAULT_ROOT = os.environ.get(
+    'KLINE_STORE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'klines')
+)
+
+COLUMNS = ('open_time', 'open', 'high', 'low', 'close', 'volume')
+
+INTERVAL_MS = {
+    '1m': 60_000,
+    '3m': 3 * 60_000,
+    '5m': 5 * 60_000,
+    '15m': 15 * 60_000,
+    '30m': 30 * 60_000,
+    '1h': 3_600_000,
+    '2h': 2 * 3_600_000,
+    '4h': 4 * 3_600_000,
+    '6h': 6 * 3_600_000,
+    '8h': 8 * 3_600_000,
+    '12h': 12 * 3_600_000,
+    '1d': 86_400_000,
+    '3d': 3 * 86_400_000,
+    '1w': 7 * 86_400_000,
+}
+
+
+def date_to_ms(date_str):
+    # Same convention as python-binance: plain dates are UTC midnight
+    dt = datetime.strptime(date_str, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def klines_to_columns(klines):
+    # Raw Binance kline rows -> typed column arrays
+    if not klines:
+        return empty_columns()
+    values = np.array([kline[1:6] for kline in klines], dtype=np.float64)
+    columns = {'open_time': np.array([kline[0] for kline in klines], dtype=np.int64)}
+    for i, name in enumerate(COLUMNS[1:]):
+        columns[name] = np.ascontiguousarray(values[:, i])
+    return columns
+
+
+def empty_columns():
+    columns = {name: np.empty(0, dtype=np.float64) for name in COLUMNS[1:]}
+    columns['open_time'] = np.empty(0, dtype=np.int64)
+    return columns
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return merged
+
+
+def missing_ranges(ranges, start, stop):
+    # Parts of [start, stop) not covered by the (merged) ranges
+    gaps = []
+    cursor = start
+    for a, b in ranges:
+        if b <= cursor:
+            continue
+        if a >= stop:
+            break
+        if a > cursor:
+            gaps.append([cursor, a])
+        cursor = max(cursor, b)
+        if cursor >= stop:
+            break
+    if cursor < stop:
+        gaps.append([cursor, stop])
+    return gaps
+
+
+class KlineStore:
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = root
+
+    def _dir(self, symbol, interval):
+        return os.path.join(self.root, symbol, interval)
+
+    @contextmanager
+    def _lock(self, symbol, interval, exclusive):
+        # flock on <symbol>/<interval>/.lock: exclusive for writers, shared for readers
+        base = self._dir(symbol, interval)
+        if fcntl is None or (not exclusive and not os.path.isdir(base)):
+            yield  # nothing stored yet, so nothing to guard
+            return
+        os.makedirs(base, exist_ok=True)
+        fd = os.open(os.path.join(base, '.lock'), os.O_RDONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)  # releases the lock
+
+    def _index(self, symbol, interval):
+        path = os.path.join(self._dir(symbol, interval), 'index.json')
+        if not os.path.exists(path):
+            return {'data': None, 'ranges': []}
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def coverage(self, symbol, interval):
+        return self._index(symbol, interval)['ranges']
+
+    def missing(self, symbol, interval, start_ms, end_ms):
+        # end_ms is inclusive, like the endTime of the Binance klines endpoint
+        return missing_ranges(self.coverage(symbol, interval), start_ms, end_ms + 1)
+
+    def read_all(self, symbol, interval):
+        with self._lock(symbol, interval, exclusive=False):
+            return self._read_all(symbol, interval)
+
+    def _read_all(self, symbol, interval):
+        # Callers hold the lock; once mapped, the columns outlive their directory's removal
+        index = self._index(symbol, interval)
+        if index['data'] is None:
+            return empty_columns()
+        data_dir = os.path.join(self._dir(symbol, interval), index['data'])
+        return {
+            name: np.load(os.path.join(data_dir, name + '.npy'), mmap_mode='r')
+            for name in COLUMNS
+        }
+
+    def read(self, symbol, interval, start_ms, end_ms):
+        # Memory-mapped views of the bars with start_ms <= open_time <= end_ms
+        return self._slice(self.read_all(symbol, interval), start_ms, end_ms)
+
+    @staticmethod
+    def _slice(columns, start_ms, end_ms):
+        open_time = columns['open_time']
+        lo = np.searchsorted(open_time, start_ms, side='left')
+        hi = np.searchsorted(open_time, end_ms, side='right')
+        return {name: column[lo:hi] for name, column in columns.items()}
+
+    def write(self, symbol, interval, columns, start_ms, end_ms):
+        # Merge freshly downloaded bars for [start_ms, end_ms] into the store
+        with self._lock(symbol, interval, exclusive=True):
+            self._write(symbol, interval, columns, start_ms, end_ms)
+
+    def _write(self, symbol, interval, columns, start_ms, end_ms):
+        # Callers hold the exclusive lock, so the index read here is the latest one
+        index = self._index(symbol, interval)
+        old = self._read_all(symbol, interval)
+        keep = (old['open_time'] < start_ms) | (old['open_time'] > end_ms)
+        merged = {name: np.concatenate([old[name][keep], columns[name]]) for name in COLUMNS}
+        order = np.argsort(merged['open_time'], kind='stable')
+        merged = {name: column[order] for name, column in merged.items()}
+
+        # Never mark the still-open candle (or the future) as held
+        step = INTERVAL_MS[interval]
+        now_ms = int(time.time() * 1000)
+        stop = min(end_ms + 1, now_ms - now_ms % step)
+        ranges = index['ranges']
+        if stop > start_ms:
+            ranges = merge_ranges(ranges + [[start_ms, stop]])
+
+        # Write a fresh data directory and swap the index atomically, so readers never see a
+        # half-written set of columns
+        base = self._dir(symbol, interval)
+        data_name = 'data-' + uuid.uuid4().hex[:12]
+        data_dir = os.path.join(base, data_name)
+        os.makedirs(data_dir)
+        for name in COLUMNS:
+            np.save(os.path.join(data_dir, name + '.npy'), np.ascontiguousarray(merged[name]))
+        tmp = os.path.join(base, 'index.json.' + uuid.uuid4().hex[:8])
+        with open(tmp, 'w') as file:
+            json.dump({'data': data_name, 'ranges': ranges}, file)
+        os.replace(tmp, os.path.join(base, 'index.json'))
+
+        for entry in os.listdir(base):
+            if entry.startswith('data-') and entry != data_name:
+                shutil.rmtree(os.path.join(base, entry), ignore_errors=True)
+
+    def load(self, symbol, interval, start_ms, end_ms, fetch):
+        # Serve [start_ms, end_ms] from disk, downloading only the gaps.
+        # fetch(symbol, interval, start_ms, end_ms) must return raw Binance kline rows.
+        if not self.missing(symbol, interval, start_ms, end_ms):
+            return self.read(symbol, interval, start_ms, end_ms)
+        with self._lock(symbol, interval, exclusive=True):
+            # Gaps again: another process may have filled some while this one waited
+            for gap_start, gap_stop in self.missing(symbol, interval, start_ms, end_ms):
+                klines = fetch(symbol, interval, gap_start, gap_stop - 1)
+                self._write(symbol, interval, klines_to_columns(klines), gap_start, gap_stop - 1)
+            return self._slice(self._read_all(symbol, interval), start_ms, end_ms)
+
+
+_default_store = None
+
+
+def get_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = KlineStore()
+    return _default_store
+
+
+def load_klines(symbol, interval, start_date, end_date, fetch):
+    # Date-string front end used by the fetch_binance_data functions
+    return get_store().load(symbol, interval, date_to_ms(start_date), date_to_ms(end_date), fetch)
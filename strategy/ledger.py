@@ -0,0 +1,123 @@
+import datetime
+
+import backtrader as bt
+import numpy as np
+
+from performance import EquityCurve
+
+# Compact record of every filled order of a backtest, in preallocated column arrays that double
+# when full. A fill costs a handful of array stores, instead of the per-trade nested dicts of
+# bt.analyzers.TradeAnalyzer, and the columns can be saved as one .npz file for later analysis.
+#
+#   time        fill time, epoch milliseconds (UTC)
+#   side        BUY (1) or SELL (-1)
+#   price       execution price
+#   size        executed size (positive for both sides)
+#   commission  commission paid
+#   add_level   the strategy's add_position_count when the order filled (0 = first entry)
+#
+# EquityRecorder is the matching analyzer for the account value: it fills preallocated arrays
+# with the value and position after every bar, for the post-hoc metrics of performance.py.
+
+BUY = 1
+SELL = -1
+
+FIELDS = (
+    ('time', np.int64),
+    ('side', np.int8),
+    ('price', np.float64),
+    ('size', np.float64),
+    ('commission', np.float64),
+    ('add_level', np.int16),
+)
+
+MS_PER_DAY = 86_400_000
+EPOCH_NUM = bt.date2num(datetime.datetime(1970, 1, 1))
+
+
+class TradeLedger:
+    __slots__ = ('columns', 'n')
+
+    def __init__(self, capacity=64):
+        self.columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in FIELDS}
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def record(self, time_ms, side, price, size, commission, add_level):
+        i = self.n
+        columns = self.columns
+        if i == len(columns['time']):
+            for name, values in columns.items():
+                grown = np.empty(2 * len(values), dtype=values.dtype)
+                grown[:i] = values
+                columns[name] = grown
+        columns['time'][i] = time_ms
+        columns['side'][i] = side
+        columns['price'][i] = price
+        columns['size'][i] = size
+        columns['commission'][i] = commission
+        columns['add_level'][i] = add_level
+        self.n = i + 1
+
+    def to_columns(self):
+        return {name: values[:self.n] for name, values in self.columns.items()}
+
+    def buy_count(self):
+        # Exact number of filled buys (entries and add-positions) of the run
+        return int(np.count_nonzero(self.columns['side'][:self.n] == BUY))
+
+    def save(self, path):
+        np.savez(path, **self.to_columns())
+
+
+def load_ledger(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+class LedgerMixin:
+    # Mixin for backtrader strategies: every completed order is recorded in self.ledger.
+    # notify_order hands the order on to the next class in the MRO, so it combines with
+    # strategies that handle orders themselves (StopExitStrategy).
+
+    def start(self):
+        super().start()
+        self.ledger = TradeLedger()
+
+    def notify_order(self, order):
+        if order.status == order.Completed:
+            executed = order.executed
+            self.ledger.record(round((executed.dt - EPOCH_NUM) * MS_PER_DAY),
+                               BUY if order.isbuy() else SELL, executed.price, abs(executed.size),
+                               executed.comm, getattr(self, 'add_position_count', 0))
+        super().notify_order(order)
+
+
+class EquityRecorder(bt.Analyzer):
+    # Account value and position size after every bar; get_analysis() returns an EquityCurve
+
+    def start(self):
+        size = max(self.strategy.data.buflen(), 1)
+        self.times = np.empty(size)
+        self.values = np.empty(size)
+        self.positions = np.empty(size)
+        self.n = 0
+
+    def next(self):
+        i = self.n
+        if i == len(self.values):
+            self.times, self.values, self.positions = (
+                np.concatenate([column, np.empty(len(column))])
+                for column in (self.times, self.values, self.positions))
+        strategy = self.strategy
+        self.times[i] = strategy.data.datetime[0]
+        self.values[i] = strategy.broker.getvalue()
+        self.positions[i] = strategy.position.size
+        self.n = i + 1
+
+    def get_analysis(self):
+        n = self.n
+        time_ms = np.round((self.times[:n] - EPOCH_NUM) * MS_PER_DAY).astype(np.int64)
+        return EquityCurve(time_ms, self.values[:n], self.strategy.broker.startingcash, self.positions[:n])
@@ -1,72 +1,117 @@
+import numpy as np
 import pandas as pd
+import os
 from datetime import datetime, timedelta
-from binance.client import Client
+from indicators import sma
+from kline_source import KLINE_INTERVAL_1DAY, KLINE_INTERVAL_1MINUTE, fetch_klines
+from kline_store import load_klines
+from resample import load_resampled
 
-API_KEY = ''
-API_SECRET = ''
+# DAILY_SOURCE=minutes builds the daily bars from the 1-minute kline store (the series the
+# strategies trade on) instead of downloading 1d klines; like KLINE_SOURCE it is an environment
+# variable so sweep workers follow the parent.
 
-client = Client(API_KEY, API_SECRET)
+def daily_source():
+    return os.environ.get('DAILY_SOURCE', 'klines')
+
+def set_daily_source(name):
+    if name not in ('klines', 'minutes'):
+        raise ValueError(f"Unknown daily source: {name}")
+    os.environ['DAILY_SOURCE'] = name
+
+def load_columns(symbol, interval, start_date, end_date):
+    # Served from the local kline store; only missing ranges go to the kline source
+    if interval != KLINE_INTERVAL_1MINUTE and daily_source() == 'minutes':
+        return load_resampled(symbol, interval, start_date, end_date, fetch_klines)
+    return load_klines(symbol, interval, start_date, end_date, fetch_klines)
 
 def fetch_binance_data(symbol, interval, start_date, end_date):
-    klines = client.get_historical_klines(
-        symbol=symbol,
-        interval=interval,
-        start_str=start_date,
-        end_str=end_date,
-        limit=1000
+    columns = load_columns(symbol, interval, start_date, end_date)
+    df = pd.DataFrame(
+        {name: columns[name] for name in ('open', 'high', 'low', 'close', 'volume')},
+        index=pd.Index([datetime.fromtimestamp(t / 1000) for t in columns['open_time'].tolist()], name='datetime')
     )
-    data = [
-        {
-            'datetime': datetime.fromtimestamp(kline[0] / 1000),
-            'open': float(kline[1]),
-            'high': float(kline[2]),
-            'low': float(kline[3]),
-            'close': float(kline[4]),
-            'volume': float(kline[5]),
-        }
-        for kline in klines
-    ]
-    df = pd.DataFrame(data)
-    df.set_index('datetime', inplace=True)
     return df
 
+def rolling_mean(values, window):
+    # Trailing mean over `window` rows (NaN until the window is full); each value depends only
+    # on its own window, so it is the same whatever row the series starts at
+    return sma(values, window)
+
+def segment_means(values, starts, stops):
+    # Mean of values[starts[k]:stops[k]] for every k in one vectorized pass (NaN if empty)
+    starts = np.asarray(starts, dtype=np.intp)
+    stops = np.asarray(stops, dtype=np.intp)
+    if not len(starts):
+        return np.empty(0)
+    counts = stops - starts
+    values = np.append(np.asarray(values, dtype=np.float64), 0.0)
+    bounds = np.empty(2 * len(starts), dtype=np.intp)
+    bounds[0::2] = np.minimum(starts, len(values) - 1)
+    bounds[1::2] = np.minimum(stops, len(values) - 1)
+    sums = np.add.reduceat(values, bounds)[0::2]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
 def calculate_indicators(df):
-    df['SMA_5'] = df['close'].rolling(window=5).mean()
-    df['TR'] = df[['high', 'low', 'close']].apply(
-        lambda row: max(
-            row['high'] - row['low'], 
-            abs(row['high'] - row['close']), 
-            abs(row['low'] - row['close'])
-        ), axis=1
-    )
-    df['ATR'] = df['TR'].rolling(window=5).mean()
+    df['SMA_5'] = rolling_mean(df['close'].values, 5)
+    high = df['high'].values
+    low = df['low'].values
+    close = df['close'].values
+    df['TR'] = np.maximum(high - low, np.maximum(np.abs(high - close), np.abs(low - close)))
+    df['ATR'] = rolling_mean(df['TR'].values, 5)
     return df
 
 
-def predict_next_week_market(df, prediction_date):
-    if prediction_date not in df.index:
-        return "Insufficient data for prediction"
-
-    sma_5 = df.loc[prediction_date, 'SMA_5']
-    if isinstance(sma_5, pd.Series):
-        sma_5 = sma_5.iloc[0]
-    atr_mean = df['ATR'].mean()
-
-    past_week = df.loc[:prediction_date].tail(7)
-    past_close_mean = past_week['close'].mean()
-    past_atr_mean = past_week['ATR'].mean()
-
-    if past_atr_mean > atr_mean * 1.5:
-        return "High Volatility"
-    elif past_close_mean > sma_5 and past_atr_mean < atr_mean:
-        return "Uptrend"
-    elif past_close_mean < sma_5 and past_atr_mean > atr_mean:
-        return "Downtrend"
+def predict_market_batch(df, prediction_dates, lookback_days=None):
+    # Labels for many prediction dates from one daily history. Each date only sees the rows of
+    # its own window [date - lookback_days, date] (the whole history up to the date when
+    # lookback_days is None), exactly what market_prediction fetches for it, so the labels are
+    # the same as classifying every date separately.
+    index = pd.DatetimeIndex(df.index)
+    dates = pd.DatetimeIndex([pd.Timestamp(date) for date in prediction_dates])
+    labels = np.full(len(dates), "Insufficient data for prediction", dtype=object)
+
+    found = index.get_indexer(dates)
+    valid = np.flatnonzero(found >= 0)
+    if not len(valid):
+        return labels.tolist()
+    end = found[valid]
+    if lookback_days is None:
+        start = np.zeros(len(end), dtype=np.intp)
     else:
-        return "Ranging"
+        start = index.searchsorted(dates[valid] - pd.Timedelta(days=lookback_days), side='left')
+
+    close = df['close'].values.astype(np.float64)
+    high = df['high'].values.astype(np.float64)
+    low = df['low'].values.astype(np.float64)
+    tr = np.maximum(high - low, np.maximum(np.abs(high - close), np.abs(low - close)))
+    sma = rolling_mean(close, 5)
+    atr = rolling_mean(tr, 5)
+
+    # Inside a window the 5-row averages only exist from its 5th row on
+    sma_5 = np.where(end - start >= 4, sma[end], np.nan)
+    atr_start = start + 4
+    atr_mean = segment_means(atr, atr_start, np.maximum(end + 1, atr_start))
+    week_start = np.maximum(start, end - 6)
+    past_close_mean = segment_means(close, week_start, end + 1)
+    week_atr_start = np.maximum(week_start, atr_start)
+    past_atr_mean = segment_means(atr, week_atr_start, np.maximum(end + 1, week_atr_start))
+
+    with np.errstate(invalid='ignore'):
+        high_volatility = past_atr_mean > atr_mean * 1.5
+        uptrend = (past_close_mean > sma_5) & (past_atr_mean < atr_mean)
+        downtrend = (past_close_mean < sma_5) & (past_atr_mean > atr_mean)
+    labels[valid] = np.select([high_volatility, uptrend, downtrend],
+                              ["High Volatility", "Uptrend", "Downtrend"], "Ranging")
+    return labels.tolist()
+
+
+def predict_next_week_market(df, prediction_date):
+    return predict_market_batch(df, [prediction_date])[0]
 
 def market_prediction(symbol, start_date):
-    interval = Client.KLINE_INTERVAL_1DAY
+    interval = KLINE_INTERVAL_1DAY
     target_datetime = datetime.strptime(start_date, '%Y-%m-%d')
     result_date = (target_datetime - timedelta(days=51)).strftime('%Y-%m-%d')
 
@@ -74,6 +119,14 @@ def market_prediction(symbol, start_date):
     df = calculate_indicators(df)
     return predict_next_week_market(df, start_date)
 
+def market_prediction_batch(symbol, start_dates):
+    # One daily fetch covering every date of the symbol instead of one per date
+    interval = KLINE_INTERVAL_1DAY
+    first = min(datetime.strptime(date, '%Y-%m-%d') for date in start_dates)
+    last = max(start_dates)
+    df = fetch_binance_data(symbol, interval, (first - timedelta(days=51)).strftime('%Y-%m-%d'), last)
+    return dict(zip(start_dates, predict_market_batch(df, start_dates, lookback_days=51)))
+
 # Example usage:
 # prediction = market_prediction('BTCUSDT', '2024-03-18')
 # print(prediction)
@@ -0,0 +1,307 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from kline_source import KLINE_INTERVAL_1MINUTE, set_source
+from optimizer import COMMISSIONS, MODULES, window_dates
+from indicators import MACD, RSI
+from synthetic import synthetic_klines
+from vector_engine import PATH_RULES, PathAccounts, close_paths, exit_signal_paths, fill_paths, strategy_params
+
+# Monte Carlo risk of ruin for the martingale strategies. Price paths are rebuilt from stored
+# 1-minute bars with a moving-block bootstrap (blocks of consecutive bars keep volatility
+# clustering and the bars' shape), optionally drawing only from windows of one regime. A strategy's
+# rules then run on all paths at once through vector_engine's path rules: every account field is
+# an array over paths and each bar is a handful of masked NumPy operations, with the same fills as
+# the backtests (created at the close, filled at the next open, margin-checked twice). Paths are
+# generated in chunks and the streaming indicators (indicators.py) updated bar by bar for all
+# paths at once, so memory does not grow with the path length.
+
+CAPITAL = 1000
+BLOCK_BARS = 60
+CHUNK_BLOCKS = 24
+RUIN_LEVEL = 0.5  # a path is ruined once its value falls to this fraction of the capital
+PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+
+class ReturnPool:
+    # Bar features of the source windows, in log space relative to the previous close:
+    # close return, open gap, and how far the high and low reach past the body. Blocks are only
+    # drawn within one window, so a path never jumps across a gap between windows.
+
+    def __init__(self):
+        self.features = []
+        self.labels = []
+
+    def add(self, columns, label=None):
+        open_ = np.asarray(columns['open'], dtype=np.float64)
+        high = np.asarray(columns['high'], dtype=np.float64)
+        low = np.asarray(columns['low'], dtype=np.float64)
+        close = np.asarray(columns['close'], dtype=np.float64)
+        if len(close) < 2:
+            return
+        prev = close[:-1]
+        open_, high, low, close = open_[1:], high[1:], low[1:], close[1:]
+        self.features.append(np.stack([
+            np.log(close / prev),
+            np.log(open_ / prev),
+            np.log(high / np.maximum(open_, close)),
+            np.log(low / np.minimum(open_, close)),
+        ], axis=1))
+        self.labels.append(label)
+
+    def regimes(self):
+        return sorted({label for label in self.labels if label is not None})
+
+    def block_starts(self, block, regime=None):
+        # Row indices (into concatenated()) where a whole block fits inside one window
+        starts = []
+        offset = 0
+        for features, label in zip(self.features, self.labels):
+            if (regime is None or label == regime) and len(features) >= block:
+                starts.append(offset + np.arange(len(features) - block + 1))
+            offset += len(features)
+        if not starts:
+            raise ValueError(f"No window of {block} bars or more in the pool"
+                             + (f" for regime {regime}" if regime is not None else ''))
+        return np.concatenate(starts)
+
+    def concatenated(self):
+        return np.concatenate(self.features)
+
+
+def pool_from_windows(parsed_data, module_name='withstop', markets=None):
+    # Pool of the data.json windows' 1-minute bars, labelled with their predicted regime when
+    # markets ({(start_date, symbol): market}) is given
+    module = MODULES[module_name]
+    pool = ReturnPool()
+    for start_date, symbol in parsed_data.items():
+        starting_date, result_date = window_dates(start_date)
+        try:
+            columns = module.fetch_binance_data(symbol, KLINE_INTERVAL_1MINUTE, starting_date, result_date, 'UTC')
+        except Exception as exc:
+            print(f"Skipping {symbol} starting on {start_date}: {exc}")
+            continue
+        pool.add(columns, (markets or {}).get((start_date, symbol)))
+    return pool
+
+
+def pool_from_synthetic(n_bars, seed=0):
+    # Offline pool: synthetic bars cut at their regime changes, labelled trend / range / high_vol
+    columns, labels = synthetic_klines(n_bars, seed=seed, return_regimes=True)
+    pool = ReturnPool()
+    edges = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+    for start, stop in zip(np.r_[0, edges], np.r_[edges, n_bars]):
+        pool.add({name: values[start:stop] for name, values in columns.items()}, labels[start])
+    return pool
+
+
+class PathGenerator:
+    # OHLC bars of n_paths paths, produced chunk by chunk from moving blocks of the pool
+
+    def __init__(self, pool, n_paths, block=BLOCK_BARS, regime=None, price=100.0, seed=0):
+        self.features = pool.concatenated()
+        self.starts = pool.block_starts(block, regime)
+        self.n_paths = n_paths
+        self.block = block
+        self.rng = np.random.default_rng(seed)
+        self.prev = np.full(n_paths, float(price))
+
+    def next_chunk(self, n_bars):
+        # {'open', 'high', 'low', 'close'}: arrays of shape (n_paths, n_bars)
+        blocks = -(-n_bars // self.block)
+        starts = self.starts[self.rng.integers(len(self.starts), size=(self.n_paths, blocks))]
+        rows = (starts[:, :, None] + np.arange(self.block)).reshape(self.n_paths, -1)[:, :n_bars]
+        features = self.features[rows]
+        close = self.prev[:, None] * np.exp(np.cumsum(features[:, :, 0], axis=1))
+        prev = np.concatenate([self.prev[:, None], close[:, :-1]], axis=1)
+        open_ = prev * np.exp(features[:, :, 1])
+        high = np.maximum(open_, close) * np.exp(features[:, :, 2])
+        low = np.minimum(open_, close) * np.exp(features[:, :, 3])
+        self.prev = close[:, -1].copy()
+        return {'open': open_, 'high': high, 'low': low, 'close': close}
+
+
+class SimulationResult:
+    def __init__(self, strategy, n_paths, n_bars, capital, accounts, max_drawdown, min_value,
+                 ruin_level, max_adds, seconds):
+        self.strategy = strategy
+        self.n_paths = n_paths
+        self.n_bars = n_bars
+        self.capital = capital
+        self.end_value = accounts.value
+        self.max_drawdown = max_drawdown
+        self.min_value = min_value
+        self.add_position_count = accounts.add_position_count
+        self.add_rejected = accounts.add_rejected
+        self.rejected_fills = accounts.rejected_fills
+        self.closed = accounts.closed
+        self.ruin_level = ruin_level
+        self.max_adds = max_adds
+        self.seconds = seconds
+
+    def cash_exhausted(self):
+        # Paths where an add-position or an order was refused for lack of cash
+        return (self.add_rejected > 0) | (self.rejected_fills > 0)
+
+    def ruined(self):
+        return self.min_value <= self.ruin_level * self.capital
+
+    def summary(self, percentiles=PERCENTILES):
+        def distribution(values):
+            return {f'p{q}': float(v) for q, v in zip(percentiles, np.percentile(values, percentiles))}
+        return {
+            'strategy': self.strategy,
+            'paths': self.n_paths,
+            'bars': self.n_bars,
+            'capital': self.capital,
+            'seconds': self.seconds,
+            'mean_end_value': float(self.end_value.mean()),
+            'end_value': distribution(self.end_value),
+            'max_drawdown': distribution(self.max_drawdown),
+            'min_value': distribution(self.min_value),
+            'loss_probability': float((self.end_value < self.capital).mean()),
+            'cash_exhaustion_probability': float(self.cash_exhausted().mean()),
+            'ruin_level': self.ruin_level,
+            'ruin_probability': float(self.ruined().mean()),
+            'closed_probability': float(self.closed.mean()),
+            'max_adds_reached_probability': float(
+                (self.add_position_count >= self.max_adds).mean()) if self.max_adds is not None else None,
+        }
+
+
+def simulate(strategy, generator, n_bars, capital=CAPITAL, commission=0.0, params=None,
+             ruin_level=RUIN_LEVEL, chunk_bars=None):
+    # Run `strategy` (a Martingalev1 / Martingalev1_withstop class) on n_bars bars of every path
+    # of `generator`. commission and the withstop exits follow the module, as in vector_engine.
+    started = time.perf_counter()
+    p = strategy_params(strategy)
+    p.update(params or {})
+    rule = PATH_RULES[strategy.__name__]
+    withstop = 'take_profit' in p
+    name = strategy.__name__
+
+    if name == 'TimeLimitedMartingaleStrategy':
+        macd = MACD(p['macd_fast'], p['macd_slow'], p['macd_signal'])
+    else:
+        macd = MACD()
+    rsi = RSI(14) if name == 'MultifactorMartingaleStrategy' else None
+
+    n_paths = generator.n_paths
+    a = PathAccounts(n_paths, capital)
+    peak = a.value.copy()
+    max_drawdown = np.zeros(n_paths)
+    min_value = a.value.copy()
+    pending = np.zeros(n_paths)
+    pending_price = np.zeros(n_paths)
+    ready = False
+    chunk_bars = chunk_bars or generator.block * CHUNK_BLOCKS
+
+    done = 0
+    while done < n_bars:
+        bars = generator.next_chunk(min(chunk_bars, n_bars - done))
+        for j in range(bars['close'].shape[1]):
+            open_ = bars['open'][:, j]
+            close = bars['close'][:, j]
+            if pending.any():
+                exiting = (pending != 0.0) & a.exited
+                close_paths(a, exiting, open_, commission)
+                fill_paths(a, np.where(exiting, 0.0, pending), pending_price, open_, commission)
+                pending = np.zeros(n_paths)
+
+            a.value = a.cash + a.size * close
+            np.maximum(peak, a.value, out=peak)
+            np.maximum(max_drawdown, 100.0 * (peak - a.value) / peak, out=max_drawdown)
+            np.minimum(min_value, a.value, out=min_value)
+
+            ind = {}
+            ind['macd'], ind['signal'] = macd.update(close)
+            if rsi is not None:
+                ind['rsi'] = rsi.update(close)
+            if not ready:
+                # First bar on which every indicator has a value (vector_engine.warmup); all
+                # paths warm up on the same bar
+                ready = not any(np.isnan(values).all() for values in ind.values())
+                if not ready:
+                    continue
+
+            # Paths whose position was closed for good (withstop exits) stop trading
+            m = ~a.exited & ~a.closed
+            if withstop:
+                exit_now = exit_signal_paths(a, p, m, close)
+                a.exited |= exit_now
+                m &= ~exit_now
+                pending = np.where(exit_now, -a.size, rule(a, p, m, close, ind, withstop))
+            else:
+                pending = rule(a, p, m, close, ind, withstop)
+            pending_price = close
+            a.orders += pending != 0.0
+        done += bars['close'].shape[1]
+
+    return SimulationResult(name, n_paths, n_bars, capital, a, max_drawdown, min_value, ruin_level,
+                            p.get('max_add_positions'), time.perf_counter() - started)
+
+
+def print_summary(summary):
+    print(f"{summary['strategy']}: {summary['paths']} paths x {summary['bars']} bars in {summary['seconds']:.1f}s")
+    for field in ('end_value', 'max_drawdown', 'min_value'):
+        values = ', '.join(f"{q} {v:.2f}" for q, v in summary[field].items())
+        print(f"  {field}: {values}")
+    print(f"  P(loss) = {summary['loss_probability']:.3f}, "
+          f"P(cash exhausted) = {summary['cash_exhaustion_probability']:.3f}, "
+          f"P(ruin at {summary['ruin_level']:.0%}) = {summary['ruin_probability']:.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monte Carlo risk of ruin of a martingale strategy')
+    parser.add_argument('strategy', help='strategy name (reverse, multifactor, time_limited, risk_limited) '
+                                         'or a market condition (Uptrend, Ranging, ...)')
+    parser.add_argument('--module', choices=sorted(MODULES), default='withstop')
+    parser.add_argument('--data', default='data.json', help='windows whose 1-minute bars are resampled')
+    parser.add_argument('--synthetic', type=int, default=None, metavar='BARS',
+                        help='resample synthetic bars instead of the data.json windows')
+    parser.add_argument('--regime', default=None,
+                        help='only draw blocks from windows of this regime (predicted market, or '
+                             'trend / range / high_vol with --synthetic)')
+    parser.add_argument('--paths', type=int, default=2000)
+    parser.add_argument('--bars', type=int, default=43_200, help='bars per path (default 30 days)')
+    parser.add_argument('--block', type=int, default=BLOCK_BARS, help='bootstrap block length in bars')
+    parser.add_argument('--ruin', type=float, default=RUIN_LEVEL, help='ruin level as a fraction of the capital')
+    parser.add_argument('--params', default=None, help='JSON object of strategy param overrides')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help='write the summary as JSON')
+    parser.add_argument('--source', default=None, help="kline source: live, replay:<dir> or http://host:port")
+    args = parser.parse_args()
+    if args.source:
+        set_source(args.source)
+
+    module = MODULES[args.module]
+    if args.strategy in module.strategies:
+        strategy = module.strategies[args.strategy]
+    elif args.strategy in module.market_strategies:
+        strategy = module.market_strategies[args.strategy]
+    else:
+        parser.error(f"unknown strategy or market: {args.strategy}")
+
+    if args.synthetic:
+        pool = pool_from_synthetic(args.synthetic, args.seed)
+    else:
+        with open(args.data, 'r') as file:
+            parsed_data = json.load(file)
+        markets = None
+        if args.regime is not None:
+            from Strategyv1_withstop import predict_markets
+            markets = predict_markets(list(parsed_data.items()))
+        pool = pool_from_windows(parsed_data, args.module, markets)
+
+    generator = PathGenerator(pool, args.paths, args.block, args.regime, seed=args.seed)
+    result = simulate(strategy, generator, args.bars, commission=COMMISSIONS[args.module],
+                      params=json.loads(args.params) if args.params else None, ruin_level=args.ruin)
+    summary = result.summary()
+    print_summary(summary)
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(summary, file, indent=2)
+        print(f"Summary saved to {args.out}")
@@ -0,0 +1,253 @@
+import argparse
+import itertools
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import Martingalev1
+import Martingalev1_withstop
+from job_planner import plan_summary, plan_windows, slice_window, union_columns, window_bars
+from kline_source import set_source
+from parallel import default_workers
+from shared_bars import SharedBarManager, attach_all
+from vector_engine import indicator_arrays, indicator_key, run_vectorized
+
+# Grid / random search over a strategy's params across the data.json windows, on the NumPy
+# engine. The parent loads each window's bars once (job_planner unions, handed to the workers in
+# shared memory) and skips the windows that cannot be loaded, indicators are computed once per
+# window and indicator key (only the MACD periods of TimeLimitedMartingaleStrategy change them),
+# and finished combinations are appended to a JSON Lines file so an interrupted sweep can resume.
+
+MODULES = {
+    'v1': Martingalev1,
+    'withstop': Martingalev1_withstop,
+}
+
+COMMISSIONS = {
+    'v1': 0.0,
+    'withstop': 0.001,
+}
+
+
+def window_dates(start_date):
+    # Same window as Strategyv1: the 30 days after the prediction date
+    target_datetime = datetime.strptime(start_date, '%Y-%m-%d')
+    starting_date = (target_datetime + timedelta(days=1)).strftime('%Y-%m-%d')
+    result_date = (target_datetime + timedelta(days=31)).strftime('%Y-%m-%d')
+    return starting_date, result_date
+
+
+def grid(space):
+    # {'param': [values, ...]} -> every combination
+    names = sorted(space)
+    for values in itertools.product(*(space[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def random_search(space, n_iter, seed=0):
+    # Lists are sampled from, (low, high) tuples are drawn uniformly (ints stay ints)
+    rng = random.Random(seed)
+    names = sorted(space)
+    for _ in range(n_iter):
+        combo = {}
+        for name in names:
+            choice = space[name]
+            if isinstance(choice, tuple):
+                low, high = choice
+                if isinstance(low, int) and isinstance(high, int):
+                    combo[name] = rng.randint(low, high)
+                else:
+                    combo[name] = rng.uniform(low, high)
+            else:
+                combo[name] = rng.choice(list(choice))
+        yield combo
+
+
+def combo_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def load_windows(jobs, buffers, on_error=None):
+    # Bars of the windows of jobs ((start_date, symbol) pairs), loaded in the parent: every union
+    # is read once and copied into shared memory (buffers, a SharedBarManager). Returns a
+    # (SharedBars, start_ms, end_ms) handle per window; windows that cannot be loaded are skipped
+    # and passed to on_error(symbol, start_date, exc).
+    unions = plan_windows(jobs)
+    print(plan_summary(unions))
+    windows = []
+    for union in unions:
+        for start_date, start_ms, end_ms in union.windows:
+            try:
+                if not len(window_bars(union.symbol, start_ms, end_ms, union.key)['open_time']):
+                    raise ValueError('no bars')
+            except Exception as exc:
+                if on_error is not None:
+                    on_error(union.symbol, start_date, exc)
+                continue
+            windows.append((buffers.share(union.key), start_ms, end_ms))
+    return windows
+
+
+# Per-process state: views of the windows' bars in shared memory, indicators kept for the
+# indicator key of the last chunk (chunks are submitted grouped by key, so they are mostly reused)
+_worker = {}
+
+
+def _init_worker(module_name, strategy_name, windows, capital):
+    module = MODULES[module_name]
+    _worker['strategy'] = module.strategies[strategy_name]
+    _worker['commission'] = COMMISSIONS[module_name]
+    _worker['capital'] = capital
+    views = attach_all([handle for handle, _, _ in windows])
+    _worker['bars'] = [slice_window(columns, invalid, start_ms, end_ms)
+                       for (columns, invalid), (_, start_ms, end_ms) in zip(views, windows)]
+    _worker['indicator_key'] = None
+    _worker['indicators'] = None
+
+
+def _indicators(params):
+    strategy = _worker['strategy']
+    key = indicator_key(strategy, params)
+    if key != _worker['indicator_key']:
+        _worker['indicators'] = [indicator_arrays(strategy, bars, params) for bars in _worker['bars']]
+        _worker['indicator_key'] = key
+    return _worker['indicators']
+
+
+def evaluate(params):
+    strategy = _worker['strategy']
+    indicators = _indicators(params)
+    end_values = []
+    drawdowns = []
+    for bars, ind in zip(_worker['bars'], indicators):
+        result = run_vectorized(strategy, bars, _worker['capital'], _worker['commission'],
+                                params=params, indicators=ind)
+        end_values.append(result.value)
+        drawdowns.append(result.max_drawdown)
+    end_values = np.array(end_values)
+    drawdowns = np.array(drawdowns)
+    return {
+        'params': params,
+        'windows': len(end_values),
+        'mean_end_value': float(end_values.mean()),
+        'median_end_value': float(np.median(end_values)),
+        'min_end_value': float(end_values.min()),
+        'win_rate': float((end_values > _worker['capital']).mean()),
+        'mean_max_drawdown': float(drawdowns.mean()),
+        'worst_max_drawdown': float(drawdowns.max()),
+    }
+
+
+def evaluate_chunk(combos):
+    return [evaluate(params) for params in combos]
+
+
+def load_completed(out_path):
+    completed = {}
+    if os.path.exists(out_path):
+        with open(out_path, 'r') as file:
+            for line in file:
+                if line.strip():
+                    row = json.loads(line)
+                    completed[combo_key(row['params'])] = row
+    return completed
+
+
+def ranked(rows, rank_by='mean_end_value'):
+    table = pd.DataFrame([dict(row['params'], **{k: v for k, v in row.items() if k != 'params'})
+                          for row in rows])
+    if table.empty:
+        return table
+    ascending = 'drawdown' in rank_by
+    return table.sort_values(rank_by, ascending=ascending).reset_index(drop=True)
+
+
+def optimize(strategy_name, space, jobs, module_name='withstop', method='grid', n_iter=100,
+             seed=0, capital=1000, workers=None, chunk_size=8, out_path='optimizer_results.jsonl',
+             rank_by='mean_end_value', on_error=None):
+    # jobs: the windows as (start_date, symbol) pairs, e.g. data.json's items. Windows whose bars
+    # cannot be loaded are left out of every combination, passed to on_error(symbol, start_date,
+    # exc) and listed in the ranked table's attrs['skipped'].
+    if method == 'grid':
+        combos = list(grid(space))
+    else:
+        combos = list(random_search(space, n_iter, seed))
+
+    # Resume: combinations already in out_path are not evaluated again
+    completed = load_completed(out_path)
+    todo = [params for params in combos if combo_key(params) not in completed]
+    print(f"{len(combos)} combinations, {len(combos) - len(todo)} already done, {len(todo)} to run")
+
+    # Group by indicator key so a worker's indicator cache stays warm across its chunks
+    strategy = MODULES[module_name].strategies[strategy_name]
+    todo.sort(key=lambda params: indicator_key(strategy, params))
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+
+    skipped = []
+
+    def skip(symbol, start_date, exc):
+        skipped.append({'symbol': symbol, 'start_date': start_date, 'error': str(exc)})
+        if on_error is not None:
+            on_error(symbol, start_date, exc)
+
+    # Every union is shared until the sweep ends: each combination runs on all the windows
+    with SharedBarManager({}, lambda *key: union_columns(key)) as buffers:
+        windows = load_windows(jobs, buffers, skip) if chunks else []
+        if chunks and not windows:
+            raise ValueError('No window could be loaded')
+        with open(out_path, 'a') as out, ProcessPoolExecutor(
+                max_workers=workers or default_workers(), initializer=_init_worker,
+                initargs=(module_name, strategy_name, windows, capital)) as pool:
+            futures = [pool.submit(evaluate_chunk, chunk) for chunk in chunks]
+            done = 0
+            for future in as_completed(futures):
+                for row in future.result():
+                    out.write(json.dumps(row) + '\n')
+                    completed[combo_key(row['params'])] = row
+                out.flush()
+                done += 1
+                print(f"chunk {done}/{len(chunks)} done")
+
+    table = ranked([completed[combo_key(params)] for params in combos], rank_by)
+    table.attrs['skipped'] = skipped
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parameter sweep over the data.json windows')
+    parser.add_argument('strategy', choices=sorted(Martingalev1.strategies))
+    parser.add_argument('space', help='JSON file: {"param": [values] or {"low": x, "high": y}}')
+    parser.add_argument('--module', choices=sorted(MODULES), default='withstop')
+    parser.add_argument('--data', default='data.json')
+    parser.add_argument('--method', choices=('grid', 'random'), default='grid')
+    parser.add_argument('--n-iter', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default='optimizer_results.jsonl')
+    parser.add_argument('--rank-by', default='mean_end_value')
+    parser.add_argument('--source', default=None, help="kline source: live, replay:<dir> or http://host:port")
+    args = parser.parse_args()
+    if args.source:
+        set_source(args.source)
+
+    with open(args.space, 'r') as file:
+        space = {name: (choice['low'], choice['high']) if isinstance(choice, dict) else choice
+                 for name, choice in json.load(file).items()}
+    with open(args.data, 'r') as file:
+        jobs = list(json.load(file).items())
+
+    table = optimize(args.strategy, space, jobs, module_name=args.module, method=args.method,
+                     n_iter=args.n_iter, seed=args.seed, workers=args.workers, out_path=args.out,
+                     rank_by=args.rank_by,
+                     on_error=lambda symbol, start_date, exc: print(f"Skipping {symbol} starting on {start_date}: {exc}"))
+    table.to_csv(os.path.splitext(args.out)[0] + '_ranked.csv', index=False)
+    print(table.head(20).to_string())
+    if table.attrs['skipped']:
+        skipped_path = os.path.splitext(args.out)[0] + '_skipped.csv'
+        pd.DataFrame(table.attrs['skipped']).to_csv(skipped_path, index=False)
+        print(f"{len(table.attrs['skipped'])} windows skipped, listed in {skipped_path}")
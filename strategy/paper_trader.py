@@ -0,0 +1,326 @@
+import argparse
+import json
+import math
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from indicators import ATR, MACD, RSI
+from kline_source import KLINE_INTERVAL_1MINUTE, fetch_klines, set_source
+from kline_store import INTERVAL_MS, date_to_ms, get_store
+from Martingalev1_withstop import market_strategies
+from market_conditionv1 import market_prediction
+from vector_engine import CLOSED, FILLED, REJECTED, Run, indicator_key, step
+
+# Paper trading on a stream of closed 1-minute klines. The regime of the previous UTC day picks
+# the strategy through market_strategies (as martingale_withstop does), and every closed bar goes
+# through the NumPy engine's per-bar step (vector_engine.step) with O(1) streaming indicators,
+# so orders fill against the same simulated broker as the backtests: created at the bar's close,
+# filled at the next bar's open with martingale_withstop's 0.1% commission. The time spent
+# deciding on every bar is measured and reported.
+#
+# Feeds yield Binance kline stream messages ({'e': 'kline', 'k': {...}}); a QueueFeed is the
+# local stand-in for the websocket, and BinanceKlineFeed is the real one.
+
+COMMISSION = 0.001  # same as martingale_withstop
+
+
+def kline_message(symbol, open_time, open_, high, low, close, volume, closed=True,
+                  interval=KLINE_INTERVAL_1MINUTE):
+    # A kline stream event as Binance sends it (prices as strings)
+    return {
+        'e': 'kline',
+        'E': int(open_time) + INTERVAL_MS[interval],
+        's': symbol,
+        'k': {
+            't': int(open_time), 'T': int(open_time) + INTERVAL_MS[interval] - 1,
+            's': symbol, 'i': interval,
+            'o': repr(open_), 'h': repr(high), 'l': repr(low), 'c': repr(close), 'v': repr(volume),
+            'x': closed,
+        },
+    }
+
+
+def replay_messages(symbol, columns):
+    # Stream messages for stored bars, e.g. to replay a day through a QueueFeed
+    for t, o, h, l, c, v in zip(columns['open_time'].tolist(), columns['open'].tolist(),
+                                columns['high'].tolist(), columns['low'].tolist(),
+                                columns['close'].tolist(), columns['volume'].tolist()):
+        yield kline_message(symbol, t, o, h, l, c, v)
+
+
+class QueueFeed:
+    # Local stand-in for the kline websocket: whatever is put on the queue is streamed, until
+    # None (or close()) ends the stream
+    def __init__(self, maxsize=0):
+        self.queue = queue.Queue(maxsize)
+
+    def put(self, message):
+        self.queue.put(message)
+
+    def close(self):
+        self.queue.put(None)
+
+    def feed(self, messages, interval=0.0):
+        # Push messages from a background thread, `interval` seconds apart
+        def run():
+            for message in messages:
+                self.queue.put(message)
+                if interval:
+                    time.sleep(interval)
+            self.close()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def __iter__(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                return
+            yield message
+
+
+class BinanceKlineFeed(QueueFeed):
+    # Live 1-minute kline stream from Binance through python-binance's websocket manager
+    def __init__(self, symbol, interval=KLINE_INTERVAL_1MINUTE):
+        super().__init__()
+        self.symbol = symbol
+        self.interval = interval
+        self._manager = None
+
+    def start(self):
+        from binance import ThreadedWebsocketManager
+        self._manager = ThreadedWebsocketManager()
+        self._manager.start()
+        self._manager.start_kline_socket(callback=self.put, symbol=self.symbol, interval=self.interval)
+        return self
+
+    def close(self):
+        if self._manager is not None:
+            self._manager.stop()
+            self._manager = None
+        super().close()
+
+    def __iter__(self):
+        if self._manager is None:
+            self.start()
+        return super().__iter__()
+
+
+class StreamingIndicators:
+    # The indicators a strategy reads (see vector_engine.indicator_arrays), updated per bar
+    def __init__(self, strategy, params=None):
+        name = strategy.__name__
+        self.macd = MACD(*indicator_key(strategy, params)) if name == 'TimeLimitedMartingaleStrategy' else MACD()
+        self.rsi = RSI(14) if name == 'MultifactorMartingaleStrategy' else None
+        self.atr = ATR(5) if name == 'ReverseMartingaleStrategy' else None
+
+    def update(self, high, low, close):
+        line, signal = self.macd.update(close)
+        values = {'macd': line, 'signal': signal}
+        if self.rsi is not None:
+            values['rsi'] = self.rsi.update(close)
+        if self.atr is not None:
+            values['atr'] = self.atr.update(high, low, close)
+        return values
+
+    @staticmethod
+    def ready(values):
+        # backtrader only calls next() once every indicator has a value
+        return not any(math.isnan(value) for value in values.values())
+
+
+def iso_time(ms):
+    return None if ms is None else datetime.fromtimestamp(ms / 1000, tz=timezone.utc).isoformat()
+
+
+def latency_summary(latencies_ns):
+    if not len(latencies_ns):
+        return {'bars': 0}
+    us = np.asarray(latencies_ns, dtype=np.float64) / 1000.0
+    return {
+        'bars': int(len(us)),
+        'mean_us': float(us.mean()),
+        'p50_us': float(np.percentile(us, 50)),
+        'p99_us': float(np.percentile(us, 99)),
+        'max_us': float(us.max()),
+    }
+
+
+class PaperTrader:
+    def __init__(self, symbol, market_condition, capital, commission=COMMISSION, params=None,
+                 latency_budget_ms=50.0):
+        self.symbol = symbol
+        self.market_condition = market_condition
+        self.strategy = market_strategies[market_condition]
+        self.commission = commission
+        self.capital = capital
+        self.indicators = StreamingIndicators(self.strategy, params)
+        # The engine's state for this strategy; it trades from the bar its indicators are warm on
+        self.strategy_run = Run(self.strategy, None, capital, params=params)
+        self.account = self.strategy_run.a
+        self.latency_budget_ns = latency_budget_ms * 1e6
+
+        self.bars = 0
+        self.last_open_time = None
+        self.fills = []
+        self.rejected = 0
+        self.latencies = []
+        self.over_budget = 0
+        self.peak = capital
+        self.max_drawdown = 0.0
+        self.last_entry_time = None
+        self.close_time = None
+
+    def warm_up(self, columns):
+        # Feed history through the indicators only, so trading can start on the first live bar
+        for h, l, c in zip(columns['high'].tolist(), columns['low'].tolist(), columns['close'].tolist()):
+            self.indicators.update(h, l, c)
+
+    def on_kline(self, kline):
+        # One closed bar: update the indicators, then fill the order placed on the previous bar
+        # at this open, mark to market and run the strategy's rule (vector_engine.step)
+        started = time.perf_counter_ns()
+        open_time = int(kline['t'])
+        if self.last_open_time is not None and open_time <= self.last_open_time:
+            return None  # duplicate or out-of-order bar
+        self.last_open_time = open_time
+        open_, high, low, close = float(kline['o']), float(kline['h']), float(kline['l']), float(kline['c'])
+        r = self.strategy_run
+        a = r.a
+
+        values = self.indicators.update(high, low, close)
+        if r.first > self.bars and StreamingIndicators.ready(values):
+            r.first = self.bars
+        pending, size = r.pending, a.size
+        outcome = step(r, self.bars, open_, close, self.commission, values)
+        if outcome is CLOSED:
+            # Take-profit / stop-loss close: the strategy is done after this fill
+            self.fills.append((open_time, pending, open_, size * self.commission * open_))
+            self.close_time = open_time
+        elif outcome is FILLED:
+            self.fills.append((open_time, pending, open_, abs(pending * open_) * self.commission))
+        elif outcome is REJECTED:
+            self.rejected += 1
+
+        self.peak = max(self.peak, a.value)
+        self.max_drawdown = max(self.max_drawdown, 100.0 * (self.peak - a.value) / self.peak)
+        if a.last_entry == self.bars:
+            self.last_entry_time = open_time
+        self.bars += 1
+
+        elapsed = time.perf_counter_ns() - started
+        self.latencies.append(elapsed)
+        if elapsed > self.latency_budget_ns:
+            self.over_budget += 1
+        return r.pending
+
+    def on_message(self, message):
+        # Kline events, or bare klines ({'t': ...}); python-binance hands websocket failures
+        # (disconnects, reconnects exhausted) to the callback as {'e': 'error', 'm': ...}
+        event = message.get('e')
+        if event == 'error':
+            raise ConnectionError(f"Kline stream error: {message.get('m')}")
+        if event == 'kline':
+            kline = message['k']
+        elif event is None and 't' in message:
+            kline = message
+        else:
+            return None  # not a kline
+        if not kline.get('x', True):
+            return None  # the candle is still open
+        return self.on_kline(kline)
+
+    def run(self, feed, max_bars=None):
+        for message in feed:
+            self.on_message(message)
+            if self.close_time is not None:
+                break  # exited for good
+            if max_bars is not None and self.bars >= max_bars:
+                break
+        return self.report()
+
+    def report(self):
+        a = self.account
+        return {
+            'symbol': self.symbol,
+            'market_condition': self.market_condition,
+            'strategy': self.strategy.__name__,
+            'bars': self.bars,
+            'value': a.value,
+            'cash': a.cash,
+            'position_size': a.size,
+            'position_price': a.price,
+            'buy_count': a.buys,
+            'orders': a.orders,
+            'fills': len(self.fills),
+            'rejected_orders': self.rejected,
+            'add_rejected': a.add_rejected,
+            'max_drawdown': self.max_drawdown,
+            'last_entry_time': iso_time(self.last_entry_time),
+            'close_time': iso_time(self.close_time),
+            'latency': dict(latency_summary(self.latencies), over_budget=self.over_budget,
+                            budget_ms=self.latency_budget_ns / 1e6),
+        }
+
+
+def previous_day(now=None):
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+def paper_trader(symbol, capital, market_condition=None, prediction_date=None, warmup_bars=200):
+    # Classify the regime on the last complete daily candle and warm the indicators on the
+    # 1-minute bars just before the stream starts
+    prediction_date = prediction_date or previous_day()
+    market_condition = market_condition or market_prediction(symbol, prediction_date)
+    trader = PaperTrader(symbol, market_condition, capital)
+    if warmup_bars:
+        end_ms = date_to_ms(prediction_date) + INTERVAL_MS['1d'] - 1
+        start_ms = end_ms + 1 - warmup_bars * INTERVAL_MS[KLINE_INTERVAL_1MINUTE]
+        history = get_store().load(symbol, KLINE_INTERVAL_1MINUTE, start_ms, end_ms, fetch_klines)
+        trader.warm_up(history)
+    return trader
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Paper-trade a symbol on closed 1-minute klines')
+    parser.add_argument('symbol')
+    parser.add_argument('--capital', type=float, default=1000)
+    parser.add_argument('--market', choices=sorted(market_strategies), default=None,
+                        help='skip the regime prediction and use this market condition')
+    parser.add_argument('--replay', default=None, metavar='DATE',
+                        help='replay the stored 1-minute bars of DATE through a local queue instead of the websocket')
+    parser.add_argument('--speed', type=float, default=0.0, help='seconds between replayed bars')
+    parser.add_argument('--max-bars', type=int, default=None)
+    parser.add_argument('--source', default=None, help="kline source: live, replay:<dir> or http://host:port")
+    args = parser.parse_args()
+    if args.source:
+        set_source(args.source)
+
+    if args.replay:
+        day = datetime.strptime(args.replay, '%Y-%m-%d')
+        trader = paper_trader(args.symbol, args.capital, args.market, previous_day(day))
+        start_ms = date_to_ms(args.replay)
+        bars = get_store().load(args.symbol, KLINE_INTERVAL_1MINUTE, start_ms,
+                                start_ms + INTERVAL_MS['1d'] - 1, fetch_klines)
+        feed = QueueFeed()
+        feed.feed(replay_messages(args.symbol, bars), interval=args.speed)
+    else:
+        trader = paper_trader(args.symbol, args.capital, args.market)
+        feed = BinanceKlineFeed(args.symbol)
+
+    try:
+        report = trader.run(feed, max_bars=args.max_bars)
+    except KeyboardInterrupt:
+        report = trader.report()
+    except ConnectionError as exc:
+        print(exc)
+        report = trader.report()
+    finally:
+        feed.close()
+    print(json.dumps(report, indent=2))
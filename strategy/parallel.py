@@ -0,0 +1,70 @@
+import os
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def error_text(exc):
+    return ''.join(traceback.format_exception_only(type(exc), exc)).strip()
+
+
+def run_parallel(func, jobs, workers=None, on_result=None, keep_results=True, prepare=None, max_pending=None):
+    # Run func(*job) for every job on a process pool. Results come back in input order; a job
+    # that raises leaves None in its slot instead of stopping the sweep. on_result(index, job,
+    # result, error) is called in the parent as each job finishes, in completion order.
+    # With keep_results=False results are only handed to on_result and None is returned.
+    # prepare(job), when given, is called in the parent just before the job is submitted and
+    # returns the arguments func gets instead (an exception there is the job's error);
+    # max_pending bounds the jobs submitted and not yet finished (default: all at once).
+    results = [None] * len(jobs) if keep_results else None
+
+    def finish(i, result, error):
+        if keep_results:
+            results[i] = result
+        if on_result is not None:
+            on_result(i, jobs[i], result, error)
+
+    with ProcessPoolExecutor(max_workers=workers or default_workers()) as pool:
+        futures = {}
+        submitted = 0
+        while submitted < len(jobs) or futures:
+            while submitted < len(jobs) and (max_pending is None or len(futures) < max_pending):
+                i = submitted
+                submitted += 1
+                args = jobs[i]
+                if prepare is not None:
+                    try:
+                        args = prepare(jobs[i])
+                    except Exception as exc:
+                        finish(i, None, error_text(exc))
+                        continue
+                futures[pool.submit(func, *args)] = i
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures.pop(future)
+                result = error = None
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    error = error_text(exc)
+                finish(i, result, error)
+    return results
+
+
+def run_sequential(func, jobs, on_result=None, keep_results=True):
+    # Same contract as run_parallel, in this process and in input order
+    results = [None] * len(jobs) if keep_results else None
+    for i, job in enumerate(jobs):
+        result = error = None
+        try:
+            result = func(*job)
+        except Exception as exc:
+            error = error_text(exc)
+        if keep_results:
+            results[i] = result
+        if on_result is not None:
+            on_result(i, job, result, error)
+    return results
@@ -0,0 +1,169 @@
+import math
+
+import numpy as np
+
+# Performance metrics computed after a run from its equity curve (account value at every bar),
+# instead of analyzers that update on every bar while the backtest runs. Each metric is a
+# function of an EquityCurve registered in METRICS; callers pick the ones they need with
+# compute(), and curves saved with EquityCurve.save() can be given new metrics later without
+# re-running the backtests. sharpe and max_drawdown reproduce bt.analyzers.SharpeRatio
+# (timeframe=Days, annualize=True) and bt.analyzers.DrawDown exactly.
+
+MS_PER_DAY = 86_400_000
+RISK_FREE_RATE = 0.01  # bt.analyzers.SharpeRatio default
+DAYS_PER_YEAR = 252
+CALENDAR_DAYS_PER_YEAR = 365
+
+
+class EquityCurve:
+    # time: bar open times (epoch ms), value: account value after each bar, position: position
+    # size held after each bar (None when not recorded)
+    __slots__ = ('time', 'value', 'capital', 'position')
+
+    def __init__(self, time, value, capital, position=None):
+        self.time = np.asarray(time, dtype=np.int64)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.capital = capital
+        self.position = None if position is None else np.asarray(position, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.value)
+
+    def save(self, path):
+        columns = {'time': self.time, 'value': self.value, 'capital': np.float64(self.capital)}
+        if self.position is not None:
+            columns['position'] = self.position
+        np.savez(path, **columns)
+
+
+def load_curve(path):
+    with np.load(path) as data:
+        position = data['position'] if 'position' in data.files else None
+        return EquityCurve(data['time'], data['value'], float(data['capital']), position)
+
+
+def daily_values(open_time, equity):
+    # Value at the last bar of every UTC day
+    day = np.asarray(open_time) // MS_PER_DAY
+    last = np.append(np.flatnonzero(np.diff(day)), len(day) - 1)
+    return equity[last]
+
+
+def daily_excess_returns(open_time, equity, capital):
+    # Daily returns (the first against the starting capital) less the daily risk-free rate,
+    # as bt.analyzers.SharpeRatio builds them
+    if not len(equity):
+        return []
+    daily = daily_values(open_time, equity)
+    returns = daily / np.append(capital, daily[:-1]) - 1.0
+    rate = pow(1.0 + RISK_FREE_RATE, 1.0 / DAYS_PER_YEAR) - 1.0
+    return [r - rate for r in returns.tolist()]
+
+
+def sharpe_ratio(open_time, equity, capital):
+    # Daily, annualized Sharpe ratio exactly as bt.analyzers.SharpeRatio(timeframe=Days) computes it
+    ret_free = daily_excess_returns(open_time, equity, capital)
+    if not ret_free:
+        return None
+    avg = math.fsum(ret_free) / len(ret_free)
+    dev = math.sqrt(math.fsum([pow(r - avg, 2.0) for r in ret_free]) / len(ret_free))
+    if dev == 0:
+        return None
+    return math.sqrt(DAYS_PER_YEAR) * (avg / dev)
+
+
+def sortino_ratio(open_time, equity, capital):
+    # Same daily excess returns as the Sharpe ratio, over the downside deviation (below 0)
+    ret_free = daily_excess_returns(open_time, equity, capital)
+    if not ret_free:
+        return None
+    avg = math.fsum(ret_free) / len(ret_free)
+    downside = math.sqrt(math.fsum([min(r, 0.0) ** 2 for r in ret_free]) / len(ret_free))
+    if downside == 0:
+        return None
+    return math.sqrt(DAYS_PER_YEAR) * (avg / downside)
+
+
+def max_drawdown(equity):
+    # Maximum drawdown in percent, as bt.analyzers.DrawDown reports it
+    peak = np.maximum.accumulate(equity)
+    return float(np.max(100.0 * (peak - equity) / peak)) if len(equity) else 0.0
+
+
+def max_drawdown_duration(equity):
+    # Longest stretch of bars spent below the previous peak (bt.analyzers.DrawDown's max.len)
+    if not len(equity):
+        return 0
+    index = np.arange(len(equity))
+    at_peak = equity >= np.maximum.accumulate(equity)
+    last_peak = np.maximum.accumulate(np.where(at_peak, index, 0))
+    return int(np.max(index - last_peak))
+
+
+def annual_return(curve):
+    # Compound annual growth rate in percent over the curve's calendar span
+    if len(curve) < 2 or curve.value[-1] <= 0:
+        return None
+    bar_ms = curve.time[1] - curve.time[0]
+    years = (curve.time[-1] - curve.time[0] + bar_ms) / MS_PER_DAY / CALENDAR_DAYS_PER_YEAR
+    return float(((curve.value[-1] / curve.capital) ** (1.0 / years) - 1.0) * 100)
+
+
+def metric_sharpe(curve):
+    return sharpe_ratio(curve.time, curve.value, curve.capital)
+
+
+def metric_sortino(curve):
+    return sortino_ratio(curve.time, curve.value, curve.capital)
+
+
+def metric_max_drawdown(curve):
+    return max_drawdown(curve.value)
+
+
+def metric_max_drawdown_duration(curve):
+    return max_drawdown_duration(curve.value)
+
+
+def metric_total_return(curve):
+    # In percent of the starting capital
+    if not len(curve):
+        return 0.0
+    return float((curve.value[-1] / curve.capital - 1.0) * 100)
+
+
+def metric_exposure(curve):
+    # Fraction of bars that end with an open position
+    if curve.position is None:
+        return None
+    return float(np.count_nonzero(curve.position)) / len(curve) if len(curve) else 0.0
+
+
+def metric_calmar(curve):
+    # Annual return over max drawdown
+    annual = annual_return(curve)
+    drawdown = max_drawdown(curve.value)
+    if annual is None or drawdown == 0:
+        return None
+    return annual / drawdown
+
+
+METRICS = {
+    'sharpe': metric_sharpe,
+    'sortino': metric_sortino,
+    'max_drawdown': metric_max_drawdown,
+    'max_drawdown_duration': metric_max_drawdown_duration,
+    'total_return': metric_total_return,
+    'annual_return': annual_return,
+    'exposure': metric_exposure,
+    'calmar': metric_calmar,
+}
+
+
+def compute(curve, names=None):
+    # {name: value} of the requested metrics (all of them by default)
+    names = tuple(METRICS) if names is None else tuple(names)
+    unknown = [name for name in names if name not in METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)} (available: {', '.join(METRICS)})")
+    return {name: METRICS[name](curve) for name in names}
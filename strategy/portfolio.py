@@ -0,0 +1,228 @@
+import argparse
+import heapq
+import json
+import time
+
+import numpy as np
+
+from job_planner import plan_windows, window_bars
+from kline_source import set_source
+from market_conditionv1 import set_daily_source
+from optimizer import COMMISSIONS, MODULES
+from performance import EquityCurve, compute
+from results_writer import ResultsWriter
+from Strategyv1_withstop import predict_markets
+from vector_engine import Run, bar_time, indicator_arrays, step
+
+# Portfolio backtest: every data.json window trades at the same time against one cash pool,
+# instead of each window on its own $1000. The windows' 1-minute bars are merged into one
+# time-ordered event stream by a k-way merge on a heap holding the next bar of every active
+# window, so a step costs O(log k) for k windows open at once. Each window runs the rules of its
+# regime-selected strategy (vector_engine) with its own position, sized against the portfolio
+# value and checked against the shared cash, as strategies sharing one backtrader broker would.
+#
+# Bars of the same minute are processed window by window (in start order), each through
+# vector_engine.step: pending orders fill at the bar's open, the window's position is marked at
+# its close (its account's value is the portfolio's), then its rule runs. A window's
+# indicators are only computed when its first bar comes up and dropped once it ends. When a
+# window ends with a position still open, the position is sold at its last close, so its cash
+# is free for later windows; a withstop window ends as soon as its exit has filled.
+
+METRICS = ('total_return', 'max_drawdown', 'max_drawdown_duration', 'sharpe', 'sortino')
+
+
+class Sleeve:
+    # One window inside the portfolio: its bars, strategy run and position
+    __slots__ = ('symbol', 'start_date', 'market', 'strategy', 'columns', 'start_ms', 'params',
+                 'run', 'times', 'opens', 'closes', 'i', 'held', 'pnl', 'max_value')
+
+    def __init__(self, symbol, start_date, market, strategy, columns, params=None):
+        self.symbol = symbol
+        self.start_date = start_date
+        self.market = market
+        self.strategy = strategy
+        self.columns = columns
+        self.start_ms = int(columns['open_time'][0])
+        self.params = params
+        self.pnl = 0.0
+        self.held = 0.0  # market value of the position at the last close
+        self.max_value = 0.0  # largest market value the position reached
+
+    def activate(self, cash):
+        ind = indicator_arrays(self.strategy, self.columns, self.params)
+        self.run = Run(self.strategy, ind, cash, params=self.params)
+        self.times = np.asarray(self.columns['open_time'], dtype=np.int64).tolist()
+        self.opens = np.asarray(self.columns['open'], dtype=np.float64).tolist()
+        self.closes = np.asarray(self.columns['close'], dtype=np.float64).tolist()
+        self.i = 0
+
+    def release(self):
+        # The window has ended; only its results are kept
+        self.run.ind_lists = self.times = self.opens = self.closes = None
+
+    def row(self):
+        a = self.run.a
+        open_time = self.columns['open_time']
+        return {
+            'symbol': self.symbol,
+            'start_date': self.start_date,
+            'market': self.market,
+            'strategy': self.strategy.__name__,
+            'pnl': self.pnl,
+            'max_position_value': self.max_value,
+            'orders': a.orders,
+            'buys': a.buys,
+            'add_rejected': a.add_rejected,
+            'last_entry_time': bar_time(open_time, a.last_entry),
+            'close_time': bar_time(open_time, a.close_index),
+        }
+
+
+class PortfolioResult:
+    def __init__(self, sleeves, time_ms, values, capital, max_open):
+        self.sleeves = sleeves
+        self.curve = EquityCurve(time_ms, values, capital)
+        self.value = float(values[-1]) if len(values) else capital
+        self.max_open = max_open  # most windows holding a position at once
+
+    def metrics(self, names=METRICS):
+        return compute(self.curve, names)
+
+    def rows(self):
+        return [sleeve.row() for sleeve in self.sleeves]
+
+
+def run_portfolio(sleeves, capital, commission=0.0):
+    sleeves = sorted(sleeves, key=lambda sleeve: sleeve.start_ms)
+    cash = capital
+    market = 0.0  # market value of all open positions
+    open_positions = 0
+    max_open = 0
+    time_ms = []
+    equity = []
+
+    heap = []  # (open time of the window's next bar, window index)
+    waiting = 0  # sleeves[waiting:] have not started yet
+    now = None
+    while heap or waiting < len(sleeves):
+        # Windows whose first bar is due join the merge
+        while waiting < len(sleeves) and (not heap or sleeves[waiting].start_ms <= heap[0][0]):
+            sleeves[waiting].activate(cash)
+            heapq.heappush(heap, (sleeves[waiting].start_ms, waiting))
+            waiting += 1
+
+        t, k = heap[0]
+        if t != now:
+            if now is not None:
+                time_ms.append(now)
+                equity.append(cash + market)
+            now = t
+        s = sleeves[k]
+        a = s.run.a
+        i = s.i
+        was_open = a.size > 0
+
+        # The window's account holds the shared cash; the other windows' positions count
+        # towards its value
+        a.cash = cash
+        other = market - s.held
+        close = s.closes[i]
+        step(s.run, i, s.opens[i], close, commission, other=other)
+        s.pnl += a.cash - cash
+        cash = a.cash
+        s.held = a.size * close
+        market = other + s.held
+        s.max_value = max(s.max_value, s.held)
+
+        finished = a.close_index is not None or i == len(s.closes) - 1
+        if finished:
+            if a.size:
+                # Sold at the window's last close, so its cash serves later windows
+                fee = abs(a.size * close) * commission
+                proceeds = a.size * close - fee
+                cash += proceeds
+                s.pnl += proceeds
+                market = other
+                s.held = 0.0
+                a.fills.append((i, -a.size, close, fee, a.add_position_count))
+                a.size = 0.0
+                a.changes.append((i, 0.0))
+            heapq.heappop(heap)
+            s.release()
+        else:
+            s.i = i + 1
+            heapq.heapreplace(heap, (s.times[i + 1], k))
+
+        if (a.size > 0) != was_open:
+            open_positions += 1 if a.size > 0 else -1
+            max_open = max(max_open, open_positions)
+
+    if now is not None:
+        time_ms.append(now)
+        equity.append(cash + market)
+    return PortfolioResult(sleeves, np.array(time_ms, dtype=np.int64), np.array(equity), capital, max_open)
+
+
+def load_sleeves(parsed_data, module_name='withstop', on_error=None):
+    # One Sleeve per data.json window, with the regime-selected strategy and the window's bars
+    # (sliced from per-symbol union ranges, see job_planner)
+    module = MODULES[module_name]
+    jobs = list(parsed_data.items())
+    markets = predict_markets(jobs)
+    sleeves = []
+    for union in plan_windows(jobs):
+        for start_date, start_ms, end_ms in union.windows:
+            try:
+                market = markets.get((start_date, union.symbol))
+                if market is None:
+                    raise ValueError('no market prediction')
+                strategy = module.market_strategies.get(market)
+                if strategy is None:
+                    raise ValueError(f'no strategy for {market}')
+                columns = window_bars(union.symbol, start_ms, end_ms, union.key)
+                if not len(columns['open_time']):
+                    raise ValueError('no bars')
+            except Exception as exc:
+                if on_error is not None:
+                    on_error(union.symbol, start_date, exc)
+                continue
+            sleeves.append(Sleeve(union.symbol, start_date, market, strategy, columns))
+    return sleeves
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run every data.json window at once on one cash pool')
+    parser.add_argument('--data', default='data.json')
+    parser.add_argument('--module', choices=sorted(MODULES), default='withstop')
+    parser.add_argument('--capital', type=float, default=10_000)
+    parser.add_argument('--source', default=None, help="kline source: live, replay:<dir> or http://host:port")
+    parser.add_argument('--daily-from-minutes', action='store_true',
+                        help='build the regime\'s daily bars from the 1-minute store instead of fetching 1d klines')
+    parser.add_argument('--out', default='portfolio_windows.jsonl', help='per-window results (JSON Lines)')
+    parser.add_argument('--curve', default=None, metavar='PATH', help='save the portfolio equity curve as .npz')
+    args = parser.parse_args()
+    if args.source:
+        set_source(args.source)
+    if args.daily_from_minutes:
+        set_daily_source('minutes')
+
+    with open(args.data, 'r') as file:
+        parsed_data = json.load(file)
+    started = time.perf_counter()
+    sleeves = load_sleeves(parsed_data, args.module,
+                           on_error=lambda symbol, start_date, exc: print(f"Skipping {symbol} starting on {start_date}: {exc}"))
+    loaded = time.perf_counter()
+    result = run_portfolio(sleeves, args.capital, COMMISSIONS[args.module])
+    print(f"{len(sleeves)} windows, {len(result.curve)} minutes (load {loaded - started:.1f}s, "
+          f"run {time.perf_counter() - loaded:.1f}s)")
+    print(f"End value = {result.value:.2f}, at most {result.max_open} positions open at once")
+    for name, value in result.metrics().items():
+        print(f"  {name} = {value}")
+
+    with ResultsWriter(args.out) as writer:
+        for row in result.rows():
+            writer.write(row)
+    print(f"Window results saved to {args.out}")
+    if args.curve:
+        result.curve.save(args.curve)
+        print(f"Equity curve saved to {args.curve}")
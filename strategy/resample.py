@@ -0,0 +1,67 @@
+import numpy as np
+
+from kline_store import INTERVAL_MS, date_to_ms, get_store
+
+# Coarser OHLCV bars built from stored 1-minute bars. Bars are grouped by the period their open
+# time falls in, with periods aligned to the Unix epoch in UTC the way Binance aligns its
+# candles (days start at 00:00 UTC, weeks on Monday), and aggregated in one vectorized pass:
+# first open, highest high, lowest low, last close, summed volume.
+
+# The epoch is a Thursday; Binance weeks start on Monday
+WEEK_OFFSET_MS = 4 * INTERVAL_MS['1d']
+
+
+def period_ms(interval):
+    if interval not in INTERVAL_MS:
+        raise ValueError(f"Unsupported interval for resampling: {interval}")
+    return INTERVAL_MS[interval]
+
+
+def period_start(open_time, interval):
+    # Open time of the period each timestamp belongs to
+    step = period_ms(interval)
+    offset = WEEK_OFFSET_MS if interval == '1w' else 0
+    open_time = np.asarray(open_time, dtype=np.int64)
+    return (open_time - offset) // step * step + offset
+
+
+def resample(columns, interval, base='1m', drop_partial=True):
+    # columns: kline store columns of `base` bars. With drop_partial, a first or last period that
+    # the input only partly covers is left out, so every bar returned is a whole candle.
+    open_time = np.asarray(columns['open_time'], dtype=np.int64)
+    if not len(open_time):
+        return {name: np.asarray(values)[:0] for name, values in columns.items()}
+    starts_of = period_start(open_time, interval)
+    starts = np.flatnonzero(np.r_[True, starts_of[1:] != starts_of[:-1]])
+    stops = np.r_[starts[1:], len(open_time)]
+
+    out = {
+        'open_time': starts_of[starts],
+        'open': np.asarray(columns['open'], dtype=np.float64)[starts],
+        'high': np.maximum.reduceat(np.asarray(columns['high'], dtype=np.float64), starts),
+        'low': np.minimum.reduceat(np.asarray(columns['low'], dtype=np.float64), starts),
+        'close': np.asarray(columns['close'], dtype=np.float64)[stops - 1],
+        'volume': np.add.reduceat(np.asarray(columns['volume'], dtype=np.float64), starts),
+    }
+    if drop_partial:
+        step = period_ms(interval)
+        base_step = period_ms(base)
+        keep = np.ones(len(starts), dtype=bool)
+        # The first period is partial if the data starts after its open, the last one if the
+        # data ends before its last base bar
+        keep[0] &= open_time[0] == out['open_time'][0]
+        keep[-1] &= open_time[-1] == out['open_time'][-1] + step - base_step
+        out = {name: values[keep] for name, values in out.items()}
+    return out
+
+
+def load_resampled(symbol, interval, start_date, end_date, fetch, store=None):
+    # `interval` bars from start_date through the whole end_date period, built from the 1-minute
+    # store (missing 1-minute ranges are fetched first). Same bars as requesting `interval`
+    # klines for [start_date, end_date], without a second download.
+    start_ms = date_to_ms(start_date)
+    end_ms = int(period_start(date_to_ms(end_date), interval)) + period_ms(interval) - INTERVAL_MS['1m']
+    columns = (store or get_store()).load(symbol, '1m', int(period_start(start_ms, interval)), end_ms, fetch)
+    bars = resample(columns, interval)
+    keep = bars['open_time'] >= start_ms
+    return {name: values[keep] for name, values in bars.items()}
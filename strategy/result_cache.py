@@ -0,0 +1,215 @@
+import argparse
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import uuid
+
+import backtrader as bt
+import numpy as np
+
+from kline_store import COLUMNS
+
+# Content-addressed cache of backtest results. The key is a hash of everything a run's result
+# depends on: the source of the run function, of the strategy class (and its mixins/bases outside
+# backtrader) and of the modules that compute indicators, fills and metrics, the backtrader
+# version, the strategy's effective params, cash, commission, engine, the requested metrics, and
+# a fingerprint of the bar data itself. Any change to one of them gives a new key, so a re-run
+# only recomputes the windows whose inputs changed; symbol and dates are not part of the key,
+# only the bars they select.
+#
+# Entries are pickled (result plus a little metadata for invalidation) one file each, under
+# <root>/<first two hex digits>/<key>.pkl, and written atomically. A hit touches the file, so
+# the total size is bounded by evicting the least recently used entries.
+
+DEFAULT_ROOT = os.environ.get(
+    'RESULT_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'result_cache')
+)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Modules whose code shapes every result besides the strategy itself
+ENGINE_MODULES = ('ledger', 'performance', 'vector_engine', 'kline_feed', 'indicators')
+
+
+def bars_fingerprint(columns):
+    # Hash of the bar columns' contents (dtype, length and bytes)
+    digest = hashlib.blake2b(digest_size=20)
+    for name in COLUMNS:
+        values = np.ascontiguousarray(columns[name])
+        digest.update(f'{name}:{values.dtype.str}:{len(values)};'.encode())
+        digest.update(values.data)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def module_source(name):
+    return inspect.getsource(sys.modules[name] if name in sys.modules else __import__(name))
+
+
+def class_source(klass):
+    try:
+        return inspect.getsource(klass)
+    except (OSError, TypeError):
+        return f'{klass.__module__}.{klass.__qualname__}'  # defined without a source file
+
+
+def strategy_source(strategy):
+    # Source of the strategy class and of every class it inherits from outside backtrader
+    return [class_source(klass) for klass in strategy.__mro__
+            if klass is not object and not klass.__module__.startswith('backtrader')]
+
+
+def strategy_params(strategy):
+    # Effective params of the class (defaults, as martingale runs it)
+    return {name: value for name, value in strategy.params._getitems()}
+
+
+def run_key(func, strategy, columns, capital, commission, **settings):
+    payload = {
+        'function': inspect.getsource(func),
+        'strategy': strategy_source(strategy),
+        'engine_modules': [module_source(name) for name in ENGINE_MODULES],
+        'backtrader': bt.__version__,
+        'params': strategy_params(strategy),
+        'capital': capital,
+        'commission': commission,
+        'settings': settings,
+        'bars': bars_fingerprint(columns),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, root=DEFAULT_ROOT, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._size = None  # bytes on disk, counted on the first put
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + '.pkl')
+
+    def entries(self):
+        # (path, size, last use) of every entry
+        if not os.path.isdir(self.root):
+            return []
+        found = []
+        for sub in os.listdir(self.root):
+            directory = os.path.join(self.root, sub)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if name.endswith('.pkl'):
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue  # evicted by another process meanwhile
+                    found.append((path, stat.st_size, stat.st_mtime))
+        return found
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                entry = pickle.load(file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(path)  # most recently used
+        except FileNotFoundError:
+            pass
+        return entry['result']
+
+    def put(self, key, result, **meta):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.' + uuid.uuid4().hex[:8]
+        with open(tmp, 'wb') as file:
+            pickle.dump({'result': result, 'meta': meta}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self.entries())
+        else:
+            self._size += os.path.getsize(path)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self, max_bytes=None):
+        # Drop least recently used entries until the cache fits in max_bytes; returns the count
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        self._size = total
+        return removed
+
+    def invalidate(self, **meta):
+        # Remove the entries whose metadata match every given field (all entries without one)
+        removed = 0
+        for path, _, _ in self.entries():
+            if meta:
+                try:
+                    with open(path, 'rb') as file:
+                        entry_meta = pickle.load(file)['meta']
+                except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                    continue
+                if any(entry_meta.get(field) != value for field, value in meta.items()):
+                    continue
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        self._size = None
+        return removed
+
+    def stats(self):
+        entries = self.entries()
+        return {'entries': len(entries), 'bytes': sum(size for _, size, _ in entries), 'max_bytes': self.max_bytes}
+
+
+_caches = {}
+
+
+def get_cache(root=DEFAULT_ROOT):
+    # One ResultCache per root and process
+    if root not in _caches:
+        _caches[root] = ResultCache(root)
+    return _caches[root]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or invalidate the backtest result cache')
+    parser.add_argument('--root', default=DEFAULT_ROOT)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help='number of entries and bytes used')
+    invalidate = commands.add_parser('invalidate', help='remove entries (all, or those matching the filters)')
+    invalidate.add_argument('--strategy', default=None, help='strategy class name')
+    invalidate.add_argument('--symbol', default=None)
+    invalidate.add_argument('--function', default=None, help='run function, e.g. martingale_withstop')
+    evict = commands.add_parser('evict', help='drop least recently used entries down to a size')
+    evict.add_argument('--max-mb', type=float, required=True)
+    args = parser.parse_args()
+
+    cache = ResultCache(args.root)
+    if args.command == 'stats':
+        print(json.dumps(cache.stats()))
+    elif args.command == 'invalidate':
+        filters = {field: getattr(args, field) for field in ('strategy', 'symbol', 'function')
+                   if getattr(args, field) is not None}
+        print(f"Removed {cache.invalidate(**filters)} entries")
+    else:
+        print(f"Removed {cache.evict(int(args.max_mb * 1024 * 1024))} entries")
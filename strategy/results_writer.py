@@ -0,0 +1,118 @@
+import csv
+import json
+import os
+
+# Checkpointed sweep results. Every finished window is appended to a JSON Lines file as one
+# object and flushed straight away, so a crashed sweep keeps everything it finished and can be
+# resumed by skipping the windows already in the file. The legacy CSV is exported from the file
+# at the end without holding the rows in memory.
+
+KEY_FIELDS = ('symbol', 'start_date')
+
+
+def row_key(row, fields=KEY_FIELDS):
+    return tuple(row[field] for field in fields)
+
+
+def _default(value):
+    # datetimes (last entry / close time) are written the way the CSVs show them
+    return str(value)
+
+
+def repair(path):
+    # Drop a half-written last line left by a crash, so appends start on a fresh line
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as file:
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        if not size:
+            return
+        file.seek(size - 1)
+        if file.read(1) == b'\n':
+            return
+        end = size
+        while end > 0:
+            step = min(65536, end)
+            file.seek(end - step)
+            chunk = file.read(step)
+            newline = chunk.rfind(b'\n')
+            if newline >= 0:
+                file.truncate(end - step + newline + 1)
+                return
+            end -= step
+        file.truncate(0)
+
+
+class ResultsWriter:
+    def __init__(self, path, resume=False, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        if resume:
+            repair(path)
+        self._file = open(path, 'a' if resume else 'w')
+
+    def write(self, row):
+        self._file.write(json.dumps(row, default=_default) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_rows(path):
+    # Rows of a results file, one at a time; unreadable lines are skipped
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def completed_keys(path, fields=KEY_FIELDS):
+    # Windows that finished without an error; failed ones are run again on resume
+    return {row_key(row, fields) for row in read_rows(path) if not row.get('error')}
+
+
+def export_csv(path, csv_path, columns, order=None, fields=KEY_FIELDS):
+    # Write `columns` of every row to csv_path. With `order` (a list of keys) rows follow that
+    # order, missing keys become empty rows; only line offsets are kept in memory for that.
+    with open(csv_path, 'w', newline='') as out:
+        writer = csv.DictWriter(out, fieldnames=columns, extrasaction='ignore', lineterminator='\n')
+        writer.writeheader()
+        if order is None:
+            for row in read_rows(path):
+                writer.writerow(row)
+            return
+        offsets = {}
+        with open(path, 'rb') as file:
+            offset = 0
+            for line in file:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    pass
+                else:
+                    if not row.get('error') or row_key(row, fields) not in offsets:
+                        offsets[row_key(row, fields)] = offset
+                offset += len(line)
+            for key in order:
+                if key in offsets:
+                    file.seek(offsets[key])
+                    row = json.loads(file.readline())
+                    if row.get('error'):
+                        row = {name: row.get(name) for name in fields}
+                else:
+                    row = dict(zip(fields, key))
+                writer.writerow(row)
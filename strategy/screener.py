@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from kline_source import KLINE_INTERVAL_1DAY, set_source
+from kline_store import INTERVAL_MS, date_to_ms, get_store
+from market_conditionv1 import load_columns, segment_means, set_daily_source
+
+# Cross-sectional regime screener. Daily bars of a whole symbol universe are laid out as
+# symbol x day matrices, and the features of predict_next_week_market (SMA_5, ATR, the window's
+# mean ATR, the past week's mean close and ATR) are computed for every symbol and day at once.
+# Every (symbol, day) gets the label market_prediction would give it, and every day gets a
+# ranked candidate list per regime, from which a data.json can be generated.
+#
+# Each day only sees its own lookback window [day - 51 days, day], as in market_prediction. Daily
+# bars are assumed to be contiguous from a symbol's first bar on (as Binance's are); a day whose
+# window has a missing bar is reported as having insufficient data.
+#
+# Candidates are ranked by how strongly they show their regime:
+#
+#   Uptrend          past week's mean close above SMA_5, in percent
+#   Downtrend        past week's mean close below SMA_5, in percent
+#   High Volatility  past week's mean ATR over the window's mean ATR
+#   Ranging          closeness of the past week's mean close to SMA_5 (minus the gap in percent)
+#
+# and candidates below min_quote_volume (past week's mean close * volume) are left out.
+
+DAY_MS = INTERVAL_MS['1d']
+LOOKBACK_DAYS = 51
+WEEK_DAYS = 7
+INSUFFICIENT = "Insufficient data for prediction"
+# Label codes: index into REGIMES, -1 for insufficient data
+REGIMES = ("High Volatility", "Uptrend", "Downtrend", "Ranging")
+FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+
+class DailyMatrix:
+    # Daily OHLCV of many symbols: every field is a (symbols x days) float64 array, NaN where a
+    # symbol has no bar; column j is the UTC day start_ms + j days
+    __slots__ = ('symbols', 'start_ms') + FIELDS
+
+    def __init__(self, symbols, start_ms, columns):
+        self.symbols = list(symbols)
+        self.start_ms = start_ms
+        for name in FIELDS:
+            setattr(self, name, columns[name])
+
+    @property
+    def n_days(self):
+        return self.close.shape[1]
+
+    def dates(self):
+        return (np.datetime64(self.start_ms, 'ms') + np.arange(self.n_days) * np.timedelta64(1, 'D')).astype('datetime64[D]')
+
+    def day_index(self, date):
+        return (date_to_ms(date) - self.start_ms) // DAY_MS
+
+
+def load_matrix(symbols, start_date, end_date, on_error=None):
+    # Daily bars of every symbol for [start_date - 51 days, end_date], through the kline store
+    # (or built from 1-minute bars with DAILY_SOURCE=minutes). A symbol that cannot be loaded is
+    # left out; on_error(symbol, exc) is told about it.
+    first = (datetime.strptime(start_date, '%Y-%m-%d') - timedelta(days=LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+    start_ms = date_to_ms(first)
+    n_days = (date_to_ms(end_date) - start_ms) // DAY_MS + 1
+    loaded = []
+    for symbol in symbols:
+        try:
+            loaded.append((symbol, load_columns(symbol, KLINE_INTERVAL_1DAY, first, end_date)))
+        except Exception as exc:
+            if on_error is not None:
+                on_error(symbol, exc)
+
+    matrix = {name: np.full((len(loaded), n_days), np.nan) for name in FIELDS}
+    for row, (symbol, columns) in enumerate(loaded):
+        day = (np.asarray(columns['open_time'], dtype=np.int64) - start_ms) // DAY_MS
+        keep = (day >= 0) & (day < n_days)
+        for name in FIELDS:
+            matrix[name][row, day[keep]] = np.asarray(columns[name], dtype=np.float64)[keep]
+    return DailyMatrix([symbol for symbol, _ in loaded], start_ms, matrix)
+
+
+def rolling_mean_2d(values, window):
+    # Trailing mean over `window` days along every row, NaN until the window is full (and for
+    # windows holding a NaN)
+    out = np.full(values.shape, np.nan)
+    if values.shape[1] >= window:
+        out[:, window - 1:] = sliding_window_view(values, window, axis=1).sum(axis=2) / window
+    return out
+
+
+def regime_features(matrix, lookback_days=LOOKBACK_DAYS):
+    # Features of predict_market_batch for every (symbol, day), as (symbols x days) arrays;
+    # 'valid' marks the cells that can be classified
+    close, high, low = matrix.close, matrix.high, matrix.low
+    n_symbols, n_days = close.shape
+    tr = np.maximum(high - low, np.maximum(np.abs(high - close), np.abs(low - close)))
+    sma_5 = rolling_mean_2d(close, 5)
+    atr = rolling_mean_2d(tr, 5)
+
+    # Window of (s, d): days max(d - lookback, first bar of s) .. d
+    missing = np.isnan(close)
+    first = np.where(missing.all(axis=1), n_days, np.argmin(missing, axis=1))
+    day = np.arange(n_days)
+    start = np.maximum(day[None, :] - lookback_days, first[:, None])
+    gaps = np.concatenate([np.zeros((n_symbols, 1), dtype=np.intp), np.cumsum(missing, axis=1)], axis=1)
+    window_gaps = np.take_along_axis(gaps, day[None, :] + 1, axis=1) - np.take_along_axis(gaps, np.minimum(start, n_days), axis=1)
+    valid = ~missing & (start <= day[None, :]) & (window_gaps == 0)
+
+    rows, end = np.nonzero(valid)
+    start = start[rows, end]
+    base = rows * n_days
+    atr_flat = atr.ravel()
+    atr_start = start + 4
+    week_start = np.maximum(start, end - (WEEK_DAYS - 1))
+    week_atr_start = np.maximum(week_start, atr_start)
+
+    features = {}
+    for name in ('sma_5', 'atr_mean', 'past_close_mean', 'past_atr_mean', 'quote_volume'):
+        features[name] = np.full((n_symbols, n_days), np.nan)
+    features['sma_5'][rows, end] = np.where(end - start >= 4, sma_5[rows, end], np.nan)
+    features['atr_mean'][rows, end] = segment_means(atr_flat, base + atr_start, base + np.maximum(end + 1, atr_start))
+    features['past_close_mean'][rows, end] = segment_means(close.ravel(), base + week_start, base + end + 1)
+    features['past_atr_mean'][rows, end] = segment_means(atr_flat, base + week_atr_start,
+                                                         base + np.maximum(end + 1, week_atr_start))
+    features['quote_volume'][rows, end] = segment_means((close * matrix.volume).ravel(), base + week_start, base + end + 1)
+    features['valid'] = valid
+    return features
+
+
+def classify(features):
+    # (symbols x days) label codes: index into REGIMES, -1 where there is not enough data
+    sma_5 = features['sma_5']
+    atr_mean = features['atr_mean']
+    past_close_mean = features['past_close_mean']
+    past_atr_mean = features['past_atr_mean']
+    with np.errstate(invalid='ignore'):
+        high_volatility = past_atr_mean > atr_mean * 1.5
+        uptrend = (past_close_mean > sma_5) & (past_atr_mean < atr_mean)
+        downtrend = (past_close_mean < sma_5) & (past_atr_mean > atr_mean)
+    codes = np.select([high_volatility, uptrend, downtrend], [0, 1, 2], 3)
+    return np.where(features['valid'], codes, -1)
+
+
+def regime_scores(features):
+    # Ranking score of every cell for its own regime (higher ranks first), by label code
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gap = (features['past_close_mean'] / features['sma_5'] - 1.0) * 100
+        return {
+            0: features['past_atr_mean'] / features['atr_mean'],
+            1: gap,
+            2: -gap,
+            3: -np.abs(gap),
+        }
+
+
+def screen(matrix, start_date=None, top=10, min_quote_volume=0.0):
+    # {date: {regime: [(symbol, score), ...]}} for every day from start_date (default: the first
+    # day with a full lookback window) to the end of the matrix, best candidates first
+    features = regime_features(matrix)
+    codes = classify(features)
+    scores = regime_scores(features)
+    first_day = LOOKBACK_DAYS if start_date is None else matrix.day_index(start_date)
+    with np.errstate(invalid='ignore'):
+        liquid = features['quote_volume'] >= min_quote_volume
+
+    symbols = np.array(matrix.symbols, dtype=object)
+    result = {}
+    for day, date in enumerate(matrix.dates().astype(str).tolist()):
+        if day < first_day:
+            continue
+        ranking = {}
+        for code, regime in enumerate(REGIMES):
+            rows = np.flatnonzero((codes[:, day] == code) & liquid[:, day])
+            score = scores[code][rows, day]
+            order = np.argsort(-score, kind='stable')[:top]
+            ranking[regime] = list(zip(symbols[rows[order]].tolist(), score[order].tolist()))
+        result[date] = ranking
+    return result
+
+
+def labels_table(matrix, start_date=None):
+    # {date: {symbol: label}}, the labels market_prediction would give
+    codes = classify(regime_features(matrix))
+    names = np.array(REGIMES + (INSUFFICIENT,), dtype=object)
+    first_day = LOOKBACK_DAYS if start_date is None else matrix.day_index(start_date)
+    return {date: dict(zip(matrix.symbols, names[codes[:, day]].tolist()))
+            for day, date in enumerate(matrix.dates().astype(str).tolist()) if day >= first_day}
+
+
+def generate_data(ranked, regime=None):
+    # data.json mapping of every day to one symbol: the top candidate of `regime`, or with no
+    # regime the top candidate of the regime with the most candidates that day
+    data = {}
+    for date, ranking in ranked.items():
+        if regime is not None:
+            candidates = ranking[regime]
+        else:
+            candidates = max(ranking.values(), key=len)
+        if candidates:
+            data[date] = candidates[0][0]
+    return data
+
+
+def store_symbols(interval, store=None):
+    # Symbols with bars of `interval` in the kline store
+    root = (store or get_store()).root
+    if not os.path.isdir(root):
+        return []
+    return sorted(entry for entry in os.listdir(root)
+                  if os.path.exists(os.path.join(root, entry, interval, 'index.json')))
+
+
+def exchange_usdt_symbols():
+    # Every USDT spot pair Binance currently trades
+    from kline_source import LiveSource
+    info = LiveSource().client.get_exchange_info()
+    return sorted(item['symbol'] for item in info['symbols']
+                  if item['quoteAsset'] == 'USDT' and item['status'] == 'TRADING')
+
+
+def universe(spec, daily_from_minutes=False):
+    # 'exchange', 'store', a file with one symbol per line, or a comma-separated list
+    if spec == 'exchange':
+        return exchange_usdt_symbols()
+    if spec == 'store':
+        return store_symbols('1m' if daily_from_minutes else KLINE_INTERVAL_1DAY)
+    if os.path.exists(spec):
+        with open(spec, 'r') as file:
+            return [line.strip() for line in file if line.strip()]
+    return [symbol.strip() for symbol in spec.split(',') if symbol.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rank every symbol of a universe by regime, day by day')
+    parser.add_argument('--universe', required=True,
+                        help="'exchange' (all USDT pairs), 'store' (symbols in the kline store), a file or a comma list")
+    parser.add_argument('--start', required=True, help='first prediction date')
+    parser.add_argument('--end', required=True, help='last prediction date')
+    parser.add_argument('--top', type=int, default=10, help='candidates kept per regime and day')
+    parser.add_argument('--min-quote-volume', type=float, default=0.0,
+                        help="minimum past week's mean daily quote volume")
+    parser.add_argument('--source', default=None, help="kline source: live, replay:<dir> or http://host:port")
+    parser.add_argument('--daily-from-minutes', action='store_true',
+                        help='build the daily bars from the 1-minute store instead of fetching 1d klines')
+    parser.add_argument('--out', default='screen.json', help='ranked candidates per day and regime')
+    parser.add_argument('--data-json', default=None, metavar='PATH', help='also write a data.json picking one symbol per day')
+    parser.add_argument('--regime', choices=REGIMES, default=None, help='regime the data.json picks from')
+    args = parser.parse_args()
+    if args.source:
+        set_source(args.source)
+    if args.daily_from_minutes:
+        set_daily_source('minutes')
+
+    started = time.perf_counter()
+    symbols = universe(args.universe, args.daily_from_minutes)
+    matrix = load_matrix(symbols, args.start, args.end,
+                         on_error=lambda symbol, exc: print(f"Skipping {symbol}: {exc}"))
+    loaded = time.perf_counter()
+    ranked = screen(matrix, args.start, args.top, args.min_quote_volume)
+    print(f"Screened {len(matrix.symbols)} symbols over {len(ranked)} days "
+          f"(load {loaded - started:.1f}s, screen {time.perf_counter() - loaded:.2f}s)")
+
+    with open(args.out, 'w') as file:
+        json.dump(ranked, file, indent=1)
+    print(f"Candidates saved to {args.out}")
+    if args.data_json:
+        data = generate_data(ranked, args.regime)
+        with open(args.data_json, 'w') as file:
+            json.dump(data, file, indent=4)
+        print(f"{len(data)} windows saved to {args.data_json}")
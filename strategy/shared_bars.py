@@ -0,0 +1,129 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from kline_feed import to_datetime64
+from kline_store import COLUMNS
+
+# Bars shared with the worker processes of a sweep. The parent loads a union's OHLCV columns once
+# (job_planner.load_union) and copies them into one shared-memory block; jobs are submitted with a
+# small picklable SharedBars handle instead of the bars, and workers attach read-only views of the
+# block by name. The parent counts the jobs that still need each block and unlinks it when the
+# last one has finished, so only the unions of the jobs in flight are held in memory.
+#
+# Block layout: the COLUMNS (8 bytes per bar each, open_time as int64, prices and volume as
+# float64) one after the other, then the union's invalid-bar mask (1 byte per bar).
+
+DTYPES = {name: np.int64 if name == 'open_time' else np.float64 for name in COLUMNS}
+BYTES_PER_BAR = 8 * len(COLUMNS) + 1
+
+
+class SharedBars:
+    # Handle of a block: what a job carries to a worker
+    __slots__ = ('name', 'length')
+
+    def __init__(self, name, length):
+        self.name = name
+        self.length = length
+
+
+def block_arrays(buf, length):
+    # Column arrays and invalid-bar mask laid over a block's buffer
+    columns = {}
+    offset = 0
+    for name in COLUMNS:
+        columns[name] = np.ndarray(length, dtype=DTYPES[name], buffer=buf, offset=offset)
+        offset += 8 * length
+    return columns, np.ndarray(length, dtype=np.bool_, buffer=buf, offset=offset)
+
+
+_attached = {'name': None, 'shm': None}
+
+
+def attach(bars):
+    # Worker side: read-only views of the block (prepared columns, as fetch_binance_data returns
+    # them, and the invalid-bar mask). The block stays mapped until the next one is attached.
+    if _attached['name'] != bars.name:
+        detach()
+        _attached['shm'] = shared_memory.SharedMemory(name=bars.name)
+        _attached['name'] = bars.name
+    return _views(_attached['shm'], bars.length)
+
+
+def _views(shm, length):
+    columns, invalid = block_arrays(shm.buf, length)
+    for values in list(columns.values()) + [invalid]:
+        values.flags.writeable = False
+    columns['datetime'] = to_datetime64(columns['open_time'])
+    return columns, invalid
+
+
+_held = {}
+
+
+def attach_all(handles):
+    # Worker side, for jobs that read every block at once (optimizer): views of each block as
+    # attach() gives them, in the order of handles. The blocks stay mapped for the life of the
+    # process.
+    views = []
+    for bars in handles:
+        if bars.name not in _held:
+            _held[bars.name] = shared_memory.SharedMemory(name=bars.name)
+        views.append(_views(_held[bars.name], bars.length))
+    return views
+
+
+def detach():
+    shm = _attached['shm']
+    _attached.update(name=None, shm=None)
+    if shm is not None:
+        try:
+            shm.close()
+        except BufferError:
+            pass  # views of the last window are still alive; the mapping goes when they do
+
+
+class SharedBarManager:
+    # Parent side. uses: {key: number of jobs that read the key's bars}; load(*key) returns the
+    # (columns, invalid) of a key. share(key) before submitting a job, release(key) once it has
+    # finished (failed or not).
+
+    def __init__(self, uses, load):
+        self.remaining = dict(uses)
+        self.load = load
+        self.blocks = {}
+
+    def share(self, key):
+        block = self.blocks.get(key)
+        if block is None:
+            columns, invalid = self.load(*key)
+            length = len(columns['open_time'])
+            shm = shared_memory.SharedMemory(create=True, size=max(length * BYTES_PER_BAR, 1))
+            targets, target_invalid = block_arrays(shm.buf, length)
+            for name in COLUMNS:
+                targets[name][:] = columns[name]
+            target_invalid[:] = invalid
+            del targets, target_invalid
+            block = self.blocks[key] = (shm, SharedBars(shm.name, length))
+        return block[1]
+
+    def release(self, key):
+        self.remaining[key] -= 1
+        if self.remaining[key] <= 0:
+            self._free(key)
+
+    def _free(self, key):
+        block = self.blocks.pop(key, None)
+        if block is not None:
+            block[0].close()
+            block[0].unlink()
+
+    def close(self):
+        for key in list(self.blocks):
+            self._free(key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,76 @@
+import numpy as np
+
+from kline_store import INTERVAL_MS, date_to_ms
+
+# Synthetic 1-minute OHLCV series for benchmarks and offline experiments. The series is cut into
+# segments, each in one regime:
+#
+#   trend      steady drift up or down with moderate noise
+#   range      mean-reverting around the segment's opening price
+#   high_vol   no drift, large fat-tailed moves
+#
+# Everything is drawn from one seeded generator, so a (length, seed) pair always gives the same
+# bars. Columns match the kline store's (open_time int64 ms, float64 prices and volume).
+
+REGIMES = ('trend', 'range', 'high_vol')
+
+TREND_DRIFT = 2e-5
+TREND_VOL = 8e-4
+RANGE_VOL = 6e-4
+RANGE_REVERSION = 0.01
+HIGH_VOL = 3e-3
+
+
+def _segment_returns(rng, regime, n):
+    # Per-bar log returns of one segment
+    if regime == 'trend':
+        return rng.choice((-1.0, 1.0)) * TREND_DRIFT + TREND_VOL * rng.standard_normal(n)
+    if regime == 'high_vol':
+        # Student-t with 3 degrees of freedom, scaled to unit variance
+        return HIGH_VOL * rng.standard_t(3, n) / np.sqrt(3.0)
+    if regime == 'range':
+        noise = (RANGE_VOL * rng.standard_normal(n)).tolist()
+        out = np.empty(n)
+        deviation = 0.0
+        for i in range(n):
+            step = noise[i] - RANGE_REVERSION * deviation
+            deviation += step
+            out[i] = step
+        return out
+    raise ValueError(f"Unknown regime: {regime}")
+
+
+def synthetic_klines(n_bars, start_date='2024-01-01', price=100.0, regimes=REGIMES,
+                     segment_bars=3 * 1440, seed=0, return_regimes=False):
+    # n_bars closed 1-minute klines from start_date; regimes cycle in the given order, one per
+    # segment of segment_bars bars
+    rng = np.random.default_rng(seed)
+    returns = np.empty(n_bars)
+    labels = np.empty(n_bars, dtype=object)
+    for k, start in enumerate(range(0, n_bars, segment_bars)):
+        stop = min(start + segment_bars, n_bars)
+        regime = regimes[k % len(regimes)]
+        returns[start:stop] = _segment_returns(rng, regime, stop - start)
+        labels[start:stop] = regime
+
+    close = price * np.exp(np.cumsum(returns))
+    open_ = np.empty(n_bars)
+    open_[:1] = price
+    open_[1:] = close[:-1]
+    # Wicks reach past the body by a draw scaled to the bar's own move and the base noise
+    spread = np.abs(returns) + TREND_VOL
+    high = np.maximum(open_, close) * (1.0 + spread * rng.random(n_bars) * 0.5)
+    low = np.minimum(open_, close) * (1.0 - spread * rng.random(n_bars) * 0.5)
+    volume = rng.lognormal(3.0, 0.5, n_bars) * (1.0 + np.abs(returns) / TREND_VOL)
+
+    columns = {
+        'open_time': date_to_ms(start_date) + INTERVAL_MS['1m'] * np.arange(n_bars, dtype=np.int64),
+        'open': open_,
+        'high': high,
+        'low': low,
+        'close': close,
+        'volume': volume,
+    }
+    if return_regimes:
+        return columns, labels
+    return columns
@@ -0,0 +1,529 @@
+import datetime
+import math
+from functools import cached_property
+
+import numpy as np
+
+from indicators import atr, macd, rsi
+from ledger import BUY, SELL, TradeLedger
+from performance import EquityCurve, compute, max_drawdown, sharpe_ratio
+
+# NumPy backtest engine for the martingale strategies. Indicators are precomputed as arrays by the
+# indicators module (backtrader's seeding rules), and the add-position/sizing state machine runs
+# as one flat loop over plain floats, reproducing backtrader's market-order fills (created at the
+# close, filled at the next open, margin-checked on submission and on execution).
+
+
+def strategy_params(strategy):
+    return dict(strategy.params._getitems())
+
+
+def indicator_key(strategy, params=None):
+    # The params that change a strategy's indicators; runs sharing a key can share indicators
+    if strategy.__name__ == 'TimeLimitedMartingaleStrategy':
+        p = strategy_params(strategy)
+        p.update(params or {})
+        return p['macd_fast'], p['macd_slow'], p['macd_signal']
+    return ()
+
+
+def indicator_arrays(strategy, columns, params=None, cache=None):
+    # Indicator columns used by each strategy, keyed the same way the rules read them. Pass the
+    # same `cache` dict for several strategies on the same bars to compute each indicator once.
+    if cache is None:
+        cache = {}
+    close = np.asarray(columns['close'], dtype=np.float64)
+    name = strategy.__name__
+    periods = indicator_key(strategy, params) or (12, 26, 9)
+    if ('macd',) + periods not in cache:
+        cache[('macd',) + periods] = macd(close, *periods)
+    line, signal = cache[('macd',) + periods]
+    ind = {'macd': line, 'signal': signal}
+    if name == 'MultifactorMartingaleStrategy':
+        if ('rsi', 14) not in cache:
+            cache[('rsi', 14)] = rsi(close, 14)
+        ind['rsi'] = cache[('rsi', 14)]
+    if name == 'ReverseMartingaleStrategy':
+        if ('atr', 5) not in cache:
+            cache[('atr', 5)] = atr(columns['high'], columns['low'], close, 5)
+        ind['atr'] = cache[('atr', 5)]
+    return ind
+
+
+def warmup(ind):
+    # First bar on which backtrader would call next(): every indicator has a value
+    first = 0
+    for values in ind.values():
+        valid = np.flatnonzero(~np.isnan(values))
+        first = max(first, valid[0] if len(valid) else len(values))
+    return int(first)
+
+
+class Account:
+    __slots__ = ('cash', 'size', 'price', 'value', 'entry_price', 'add_position_count',
+                 'last_entry', 'exited', 'close_index', 'orders', 'add_rejected', 'buys', 'changes', 'fills')
+
+    def __init__(self, cash):
+        self.cash = cash
+        self.size = 0.0
+        self.price = 0.0
+        self.value = cash
+        self.entry_price = None
+        self.add_position_count = 0
+        self.last_entry = None
+        self.exited = False
+        self.close_index = None
+        self.orders = 0
+        self.add_rejected = 0  # add-position attempts refused by the cash check
+        self.buys = 0  # filled buys (entries and add-positions), as the trade ledger counts them
+        self.changes = []  # (bar, position size) after every fill, for the equity curve's position
+        self.fills = []  # (bar, signed size, price, commission, add_position_count) of every fill
+
+
+# Rules mirror the strategies' next() bodies. They get the account, the params dict, the bar
+# index, the close and the indicator values of the bar, and return the size of the market order
+# to submit (0.0 for none). `withstop` selects the Martingalev1_withstop variant of the logic.
+
+def reverse_rule(a, p, i, close, ind, withstop):
+    if p['fixed_position_size_bool']:
+        unit = p['start_position_size']
+    else:
+        unit = (a.value * (p['start_position_size'] / 100)) / close
+
+    order = 0.0
+    if ind['macd'] > ind['signal'] and a.size <= 0:
+        order = unit
+        a.add_position_count = 0
+        a.last_entry = i
+        a.entry_price = close
+
+    if a.size > 0:
+        price_percent = (close - a.price) / a.price * 100
+        if price_percent >= p['profit_threshold'] and (not withstop or price_percent < p['take_profit']):
+            new_unit_size = a.size * p['reverse_mult']
+            if a.cash > new_unit_size * close:
+                order = new_unit_size
+                a.add_position_count += 1
+                a.last_entry = i
+            else:
+                a.add_rejected += 1
+    return order
+
+
+def multifactor_rule(a, p, i, close, ind, withstop):
+    if a.size == 0:
+        if ind['macd'] > ind['signal'] and ind['rsi'] < 40:
+            a.entry_price = close
+            a.add_position_count = 0
+            a.last_entry = i
+            return (a.value * (p['start_position_size'] / 100)) / close
+
+    elif a.size > 0:
+        reference = a.price if withstop else a.entry_price
+        profit_percent = (close - reference) / reference * 100
+        if profit_percent <= -p['loss_threshold'] and a.add_position_count < p['max_add_positions']:
+            new_unit_size = a.size * p['reverse_mult']
+            if a.cash > new_unit_size * close:
+                a.add_position_count += 1
+                a.last_entry = i
+                return new_unit_size
+            else:
+                a.add_rejected += 1
+    return 0.0
+
+
+def time_limited_rule(a, p, i, close, ind, withstop):
+    if not a.size and ind['macd'] > ind['signal']:
+        a.entry_price = close
+        a.add_position_count = 0
+        a.last_entry = i
+        return (a.value * (p['initial_risk_percent'] / 100)) / close
+
+    elif a.size > 0:
+        reference = a.price if withstop else a.entry_price
+        price_drop = (reference - close) / reference * 100
+        if price_drop >= p['add_threshold_percent'] and a.add_position_count < p['max_add_positions']:
+            new_unit_size = a.size * p['martingale_factor']
+            if a.cash > new_unit_size * close:
+                a.add_position_count += 1
+                a.last_entry = i
+                a.entry_price = close
+                return new_unit_size
+            else:
+                a.add_rejected += 1
+    return 0.0
+
+
+def risk_limited_rule(a, p, i, close, ind, withstop):
+    if not a.size:
+        if ind['macd'] > ind['signal']:
+            a.entry_price = close
+            a.add_position_count = 0
+            a.last_entry = i
+            if p['fixed_position_size']:
+                return p['start_position_size']
+            return (a.value * (p['initial_risk_percent'] / 100)) / close
+
+    elif a.size > 0:
+        price_drop = (a.price - close) / a.price * 100
+        if price_drop >= p['add_threshold_percent'] and a.add_position_count < p['max_add_positions']:
+            new_unit_size = a.size * p['martingale_factor']
+            if a.cash >= new_unit_size * close:
+                a.add_position_count += 1
+                a.last_entry = i
+                a.entry_price = close
+                return new_unit_size
+            else:
+                a.add_rejected += 1
+    return 0.0
+
+
+RULES = {
+    'ReverseMartingaleStrategy': reverse_rule,
+    'MultifactorMartingaleStrategy': multifactor_rule,
+    'TimeLimitedMartingaleStrategy': time_limited_rule,
+    'RiskLimitedMartingaleStrategy': risk_limited_rule,
+}
+
+
+def fill(a, size, created_price, open_price, commission):
+    # Market order created at `created_price`, executed at the next bar's open
+    cost = size * created_price
+    if a.cash - cost - abs(cost) * commission < 0.0:
+        return False  # rejected on submission (Order.Margin)
+    cost = size * open_price
+    comm = abs(cost) * commission
+    if a.cash - cost - comm < 0.0:
+        return False  # rejected on execution (Order.Margin)
+    a.cash -= cost + comm
+    new_size = a.size + size
+    a.price = (a.price * a.size + size * open_price) / new_size
+    a.size = new_size
+    a.buys += 1
+    return True
+
+
+def exit_signal(a, p, close):
+    # withstop take-profit / stop-loss on the open position (StopExitStrategy.check_exit)
+    price_percent = (close - a.price) / a.price * 100
+    return price_percent >= p['take_profit'] or price_percent <= -p['stop_loss']
+
+
+def close_position(a, open_price, commission):
+    # Market sell of the whole position at the next bar's open, booked the way backtrader does
+    size = a.size
+    a.cash += size * a.price + size * (open_price - a.price)
+    a.cash -= size * commission * open_price
+    a.size = 0.0
+    a.price = 0.0
+
+
+
+# The same rules on arrays over many price paths at once (montecarlo): every account field holds
+# one value per path, and the mask m selects the paths that decide on the bar. The scalar rules
+# above stay plain ifs over floats, which run_bars needs for speed; tests/test_montecarlo.py
+# keeps the two in step.
+
+class PathAccounts:
+    # Account with one element per path
+    def __init__(self, n_paths, cash):
+        self.cash = np.full(n_paths, float(cash))
+        self.size = np.zeros(n_paths)
+        self.price = np.zeros(n_paths)
+        self.value = self.cash.copy()
+        self.entry_price = np.full(n_paths, np.nan)
+        self.add_position_count = np.zeros(n_paths, dtype=np.int64)
+        self.exited = np.zeros(n_paths, dtype=bool)
+        self.closed = np.zeros(n_paths, dtype=bool)
+        self.orders = np.zeros(n_paths, dtype=np.int64)
+        self.add_rejected = np.zeros(n_paths, dtype=np.int64)
+        self.rejected_fills = np.zeros(n_paths, dtype=np.int64)
+
+
+def _percent_from(reference, close):
+    # (close - reference) / reference * 100, 0 where there is no reference (flat positions)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(reference > 0, (close - reference) / reference * 100, 0.0)
+
+
+def _add(a, want, new_unit_size, close, order, strict=True, entry=False):
+    # Add-position attempt on the `want` paths, refused where the cash check fails
+    need = new_unit_size * close
+    ok = want & ((a.cash > need) if strict else (a.cash >= need))
+    a.add_position_count[ok] += 1
+    if entry:
+        a.entry_price[ok] = close[ok]
+    a.add_rejected[want & ~ok] += 1
+    return np.where(ok, new_unit_size, order)
+
+
+def _enter(a, enter, close):
+    a.entry_price[enter] = close[enter]
+    a.add_position_count[enter] = 0
+
+
+def reverse_path_rule(a, p, m, close, ind, withstop):
+    if p['fixed_position_size_bool']:
+        unit = np.full_like(close, float(p['start_position_size']))
+    else:
+        unit = (a.value * (p['start_position_size'] / 100)) / close
+    enter = m & (ind['macd'] > ind['signal']) & (a.size <= 0)
+    order = np.where(enter, unit, 0.0)
+    _enter(a, enter, close)
+
+    price_percent = _percent_from(a.price, close)
+    want = m & (a.size > 0) & (price_percent >= p['profit_threshold'])
+    if withstop:
+        want &= price_percent < p['take_profit']
+    return _add(a, want, a.size * p['reverse_mult'], close, order)
+
+
+def multifactor_path_rule(a, p, m, close, ind, withstop):
+    enter = m & (a.size == 0) & (ind['macd'] > ind['signal']) & (ind['rsi'] < 40)
+    order = np.where(enter, (a.value * (p['start_position_size'] / 100)) / close, 0.0)
+    _enter(a, enter, close)
+
+    held = m & (a.size > 0)
+    profit_percent = _percent_from(a.price if withstop else a.entry_price, close)
+    want = held & (profit_percent <= -p['loss_threshold']) & (a.add_position_count < p['max_add_positions'])
+    return _add(a, want, a.size * p['reverse_mult'], close, order)
+
+
+def time_limited_path_rule(a, p, m, close, ind, withstop):
+    enter = m & (a.size == 0) & (ind['macd'] > ind['signal'])
+    order = np.where(enter, (a.value * (p['initial_risk_percent'] / 100)) / close, 0.0)
+    _enter(a, enter, close)
+
+    held = m & (a.size > 0)
+    price_drop = -_percent_from(a.price if withstop else a.entry_price, close)
+    want = held & (price_drop >= p['add_threshold_percent']) & (a.add_position_count < p['max_add_positions'])
+    return _add(a, want, a.size * p['martingale_factor'], close, order, entry=True)
+
+
+def risk_limited_path_rule(a, p, m, close, ind, withstop):
+    enter = m & (a.size == 0) & (ind['macd'] > ind['signal'])
+    if p['fixed_position_size']:
+        unit = np.full_like(close, float(p['start_position_size']))
+    else:
+        unit = (a.value * (p['initial_risk_percent'] / 100)) / close
+    order = np.where(enter, unit, 0.0)
+    _enter(a, enter, close)
+
+    held = m & (a.size > 0)
+    price_drop = -_percent_from(a.price, close)
+    want = held & (price_drop >= p['add_threshold_percent']) & (a.add_position_count < p['max_add_positions'])
+    return _add(a, want, a.size * p['martingale_factor'], close, order, strict=False, entry=True)
+
+
+PATH_RULES = {
+    'ReverseMartingaleStrategy': reverse_path_rule,
+    'MultifactorMartingaleStrategy': multifactor_path_rule,
+    'TimeLimitedMartingaleStrategy': time_limited_path_rule,
+    'RiskLimitedMartingaleStrategy': risk_limited_path_rule,
+}
+
+
+def fill_paths(a, pending, pending_price, open_, commission):
+    # fill() for every path with a pending buy
+    m = pending != 0.0
+    cost = pending * pending_price
+    ok = m & (a.cash - cost - np.abs(cost) * commission >= 0.0)
+    cost = pending * open_
+    comm = np.abs(cost) * commission
+    ok &= a.cash - cost - comm >= 0.0
+    a.rejected_fills[m & ~ok] += 1
+    new_size = a.size + pending
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a.price = np.where(ok, (a.price * a.size + pending * open_) / new_size, a.price)
+    a.cash = np.where(ok, a.cash - cost - comm, a.cash)
+    a.size = np.where(ok, new_size, a.size)
+
+
+def exit_signal_paths(a, p, m, close):
+    # exit_signal() on the m paths holding a position
+    price_percent = _percent_from(a.price, close)
+    return m & (a.size > 0) & ((price_percent >= p['take_profit']) | (price_percent <= -p['stop_loss']))
+
+
+def close_paths(a, m, open_, commission):
+    # close_position() on the m paths
+    size = np.where(m, a.size, 0.0)
+    a.cash = a.cash + size * a.price + size * (open_ - a.price) - size * commission * open_
+    a.size = np.where(m, 0.0, a.size)
+    a.price = np.where(m, 0.0, a.price)
+    a.closed |= m
+
+def bar_time(open_time, i):
+    if i is None:
+        return None
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=int(open_time[i]))
+
+
+class EngineResult:
+    # Sharpe ratio and max drawdown are computed from the equity curve on first access; any
+    # other metric of the performance module is available through metrics()
+    def __init__(self, account, open_time, equity, capital):
+        self.value = account.value
+        self.equity = equity
+        self.open_time = open_time[:len(equity)]
+        self.capital = capital
+        self.changes = account.changes
+        self.fills = account.fills
+        self.add_position_count = account.add_position_count
+        self.buy_count = account.buys
+        self.bars = len(equity)
+        self.orders = account.orders
+        self.add_rejected = account.add_rejected
+        self.last_entry_time = bar_time(open_time, account.last_entry)
+        self.close_time = bar_time(open_time, account.close_index)
+
+    @cached_property
+    def sharpe(self):
+        return sharpe_ratio(self.open_time, self.equity, self.capital)
+
+    @cached_property
+    def max_drawdown(self):
+        return max_drawdown(self.equity)
+
+    def position(self):
+        # Position size held after every bar, rebuilt from the fills
+        position = np.zeros(self.bars)
+        if self.changes:
+            bars, sizes = np.array(self.changes).T
+            held = np.searchsorted(bars, np.arange(self.bars), side='right') - 1
+            position = np.where(held >= 0, sizes[held], 0.0)
+        return position
+
+    def curve(self):
+        return EquityCurve(self.open_time, self.equity, self.capital, self.position())
+
+    def ledger(self):
+        # The fills as the TradeLedger a backtrader run records (LedgerMixin)
+        ledger = TradeLedger(max(len(self.fills), 1))
+        for i, size, price, commission, add_level in self.fills:
+            ledger.record(int(self.open_time[i]), BUY if size > 0 else SELL, price, abs(size), commission, add_level)
+        return ledger
+
+    def metrics(self, names=None):
+        return compute(self.curve(), names)
+
+
+class Run:
+    # One strategy's state in the bar loop: its rule, params, indicators, account and the order
+    # pending for the next bar. ind: the indicator arrays (indicator_arrays); None when the caller
+    # computes the indicators as the bars come in and passes each bar's values to step(), setting
+    # `first` once they are warm. n: bars of equity to record (run_bars).
+    __slots__ = ('rule', 'p', 'withstop', 'first', 'names', 'ind_lists', 'capital', 'a', 'equity',
+                 'pending', 'pending_price', 'stop')
+
+    def __init__(self, strategy, ind, capital, n=0, params=None):
+        self.p = strategy_params(strategy)
+        self.p.update(params or {})
+        self.rule = RULES[strategy.__name__]
+        self.withstop = 'take_profit' in self.p
+        if ind is None:
+            self.first = math.inf
+            self.names = []
+            self.ind_lists = []
+        else:
+            self.first = warmup(ind)
+            self.names = list(ind)
+            self.ind_lists = [ind[name].tolist() for name in self.names]
+        self.capital = capital
+        self.a = Account(capital)
+        self.equity = np.empty(n)
+        self.pending = 0.0
+        self.pending_price = 0.0
+        self.stop = None
+
+
+# What step() did with the order pending from the previous bar
+FILLED = 'filled'
+REJECTED = 'rejected'
+CLOSED = 'closed'  # withstop exit: the position is closed for good
+
+
+def step(r, i, open_, close, commission, bar=None, other=0.0):
+    # Bar i of a run, in backtrader's order: the order pending from the previous bar fills at
+    # this bar's open, the account is marked at its close, then the withstop exit or the
+    # strategy's rule decides the order for the next bar. bar: the bar's indicator values (read
+    # from the run's arrays when None); other: value held outside the run's account but sizing
+    # with it (the rest of a portfolio). Returns FILLED, REJECTED, CLOSED or None (no order).
+    a = r.a
+    outcome = None
+    if r.pending:
+        if a.exited:
+            size = a.size
+            close_position(a, open_, commission)
+            a.close_index = i
+            a.changes.append((i, 0.0))
+            a.fills.append((i, -size, open_, size * commission * open_, a.add_position_count))
+            outcome = CLOSED
+        elif fill(a, r.pending, r.pending_price, open_, commission):
+            a.changes.append((i, a.size))
+            a.fills.append((i, r.pending, open_, abs(r.pending * open_) * commission, a.add_position_count))
+            outcome = FILLED
+        else:
+            outcome = REJECTED
+        r.pending = 0.0
+    a.value = a.cash + a.size * close + other
+    if i >= r.first and not a.exited:
+        if r.withstop and a.size > 0 and exit_signal(a, r.p, close):
+            a.exited = True
+            r.pending = -a.size
+        else:
+            if bar is None:
+                bar = {name: values[i] for name, values in zip(r.names, r.ind_lists)}
+            r.pending = r.rule(a, r.p, i, close, bar, r.withstop)
+        r.pending_price = close
+        if r.pending:
+            a.orders += 1
+    return outcome
+
+
+def run_bars(runs, columns, commission):
+    # Every Run trades the same bars with its own account, until its position is closed for good
+    # (withstop exits: the rest of the window is skipped, as StopExitStrategy stops cerebro) or
+    # the bars run out
+    opens = np.asarray(columns['open'], dtype=np.float64).tolist()
+    closes = np.asarray(columns['close'], dtype=np.float64).tolist()
+    n = len(closes)
+    active = list(runs)
+    for i in range(n):
+        if not active:
+            break
+        open_ = opens[i]
+        close = closes[i]
+        finished = False
+        for r in active:
+            step(r, i, open_, close, commission)
+            r.equity[i] = r.a.value
+            if r.a.close_index is not None:
+                r.stop = i + 1
+                finished = True
+        if finished:
+            active = [r for r in active if r.stop is None]
+    return [EngineResult(r.a, columns['open_time'], r.equity[:r.stop if r.stop is not None else n], r.capital)
+            for r in runs]
+
+
+def run_many(strategies, columns, capital, commission=0.0, params=None, indicators=None):
+    # Several strategies over the same bars in one pass, each with its own account.
+    # strategies: {label: strategy class}; params: {label: params overrides}; indicators: a
+    # cache dict shared with indicator_arrays, so indicators common to the strategies (MACD with
+    # the default periods) are computed once. Returns {label: EngineResult}.
+    params = params or {}
+    cache = indicators if indicators is not None else {}
+    n = len(columns['close'])
+    runs = [Run(strategy, indicator_arrays(strategy, columns, params.get(label), cache), capital, n,
+                params.get(label))
+            for label, strategy in strategies.items()]
+    return dict(zip(strategies, run_bars(runs, columns, commission)))
+
+
+def run_vectorized(strategy, columns, capital, commission=0.0, params=None, indicators=None):
+    # params overrides the strategy's default params; indicators may be passed in precomputed
+    # (from indicator_arrays with the same indicator_key) to share them between runs
+    ind = indicators if indicators is not None else indicator_arrays(strategy, columns, params)
+    run = Run(strategy, ind, capital, len(columns['close']), params)
+    return run_bars([run], columns, commission)[0]
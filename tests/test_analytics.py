@@ -0,0 +1,36 @@
+import json
+
+from analytics import ResultsStore
+
+
+def write_results(path, rows):
+    with open(path, 'w') as file:
+        for symbol, start_date, end_value in rows:
+            file.write(json.dumps({'symbol': symbol, 'start_date': start_date, 'market': 'Uptrend',
+                                   'end_value': end_value, 'max_drawdown': 1.0}) + '\n')
+
+
+def test_several_files_into_one_run(tmp_path):
+    first, second = tmp_path / 'a.jsonl', tmp_path / 'b.jsonl'
+    write_results(first, [('BTCUSDT', '2024-01-01', 1010.0), ('ETHUSDT', '2024-01-01', 990.0)])
+    write_results(second, [('SOLUSDT', '2024-01-02', 1020.0)])
+    store = ResultsStore(str(tmp_path / 'store'))
+
+    counts = store.import_files([str(first), str(second)], run='base')
+    assert counts == {str(first): 2, str(second): 1}
+    assert len(store) == 3
+    assert store.categories('run') == ['base']
+
+    # Importing again replaces the run instead of adding to it
+    store.import_files([str(first), str(second)], run='base')
+    assert len(store) == 3
+
+
+def test_runs_default_to_file_names(tmp_path):
+    first, second = tmp_path / 'a.jsonl', tmp_path / 'b.jsonl'
+    write_results(first, [('BTCUSDT', '2024-01-01', 1010.0)])
+    write_results(second, [('BTCUSDT', '2024-01-01', 1020.0)])
+    store = ResultsStore(str(tmp_path / 'store'))
+    store.import_files([str(first), str(second)])
+    assert sorted(store.categories('run')) == ['a', 'b']
+    assert len(store) == 2
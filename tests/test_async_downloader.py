@@ -0,0 +1,149 @@
+import asyncio
+import json
+import random
+import threading
+import time
+
+import pytest
+
+from async_downloader import AsyncKlineDownloader, TokenBucket, klines_weight, page_ranges
+from kline_source import PAGE_LIMIT, KlineSource, ReplaySource, columns_to_klines, fixture_path, serve_klines
+from kline_store import INTERVAL_MS, KlineStore, date_to_ms
+from synthetic import synthetic_klines
+
+# The downloader against a local fake endpoint (serve_klines on recorded fixtures): concurrent
+# page requests, reassembled complete, in order and without duplicates, within the token
+# bucket's budget.
+
+SYMBOLS = ('AAAUSDT', 'BBBUSDT', 'CCCUSDT')
+MINUTE = INTERVAL_MS['1m']
+START = date_to_ms('2024-01-01')
+
+
+class SlowSource(KlineSource):
+    # Answers after a random delay and records how many requests were in flight at once
+    def __init__(self, source):
+        self.source = source
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+
+    def get_historical_klines(self, symbol, interval, start_ms, end_ms):
+        with self.lock:
+            self.in_flight += 1
+            self.requests += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(random.uniform(0.005, 0.03))
+            return self.source.get_historical_klines(symbol, interval, start_ms, end_ms)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture(scope='module')
+def recorded(tmp_path_factory):
+    # Two days of 1-minute fixtures per symbol
+    root = tmp_path_factory.mktemp('fixtures')
+    rows = {}
+    for seed, symbol in enumerate(SYMBOLS):
+        rows[symbol] = columns_to_klines(synthetic_klines(2 * 1440, seed=seed), '1m')
+        with open(fixture_path(str(root), symbol, '1m'), 'w') as file:
+            json.dump(rows[symbol], file)
+    return ReplaySource(str(root)), rows
+
+
+@pytest.fixture
+def endpoint(recorded):
+    source = SlowSource(recorded[0])
+    server = serve_klines(source)
+    yield server.url, source
+    server.shutdown()
+    server.server_close()
+
+
+def expected_rows(rows, start_ms, end_ms):
+    return [row for row in rows if start_ms <= row[0] <= end_ms]
+
+
+def test_concurrent_ranges_under_budget(recorded, endpoint):
+    url, source = endpoint
+    _, rows = recorded
+    # Ranges that do not start on a page boundary of the fixtures
+    ranges = [(symbol, START + 7 * MINUTE * k, START + (2 * 1440 - 3 * k) * MINUTE - 1) for k, symbol in enumerate(SYMBOLS)]
+    pages = sum(len(page_ranges('1m', start_ms, end_ms)) for _, start_ms, end_ms in ranges)
+    bucket = TokenBucket(capacity=10, period=0.1)  # 100 weight per second
+    downloader = AsyncKlineDownloader(url, concurrency=4, bucket=bucket)
+
+    async def download():
+        return await asyncio.gather(*(downloader.fetch_range(symbol, '1m', start_ms, end_ms)
+                                      for symbol, start_ms, end_ms in ranges))
+
+    started = time.monotonic()
+    downloaded = asyncio.run(download())
+    elapsed = time.monotonic() - started
+
+    for (symbol, start_ms, end_ms), got in zip(ranges, downloaded):
+        assert got == expected_rows(rows[symbol], start_ms, end_ms)
+    assert source.requests == pages
+    assert 1 < source.max_in_flight <= 4
+    # Everything past the bucket's initial capacity had to wait for refills
+    weight = pages * klines_weight(PAGE_LIMIT)
+    assert elapsed >= (weight - bucket.capacity) / bucket.rate * 0.95
+
+
+def test_overlapping_pages_are_deduplicated(recorded, endpoint):
+    url, _ = endpoint
+    _, rows = recorded
+    downloader = AsyncKlineDownloader(url, concurrency=4)
+    fetch_page = downloader.fetch_page
+
+    async def overlapping_page(symbol, interval, start_ms, end_ms, limit=PAGE_LIMIT):
+        # Every page also carries the bar before its range: the previous page's last bar (or,
+        # for the first page, a bar outside the requested range)
+        before = await fetch_page(symbol, interval, start_ms - MINUTE, start_ms - MINUTE)
+        return before + await fetch_page(symbol, interval, start_ms, end_ms, limit)
+
+    downloader.fetch_page = overlapping_page
+    start_ms, end_ms = START + 5 * MINUTE, START + 2 * 1440 * MINUTE - 1
+    got = downloader.get_historical_klines('AAAUSDT', '1m', start_ms, end_ms)
+    assert got == expected_rows(rows['AAAUSDT'], start_ms, end_ms)
+
+
+def test_prefetch_overlapping_ranges(tmp_path, recorded, endpoint):
+    url, _ = endpoint
+    _, rows = recorded
+    store = KlineStore(str(tmp_path))
+    downloader = AsyncKlineDownloader(url, concurrency=4)
+    ranges = [('BBBUSDT', '1m', START, START + 1440 * MINUTE - 1),
+              ('BBBUSDT', '1m', START + 600 * MINUTE, START + 2 * 1440 * MINUTE - 1),
+              ('CCCUSDT', '1m', START, START + 2 * 1440 * MINUTE - 1)]
+    asyncio.run(downloader.prefetch(ranges, store))
+
+    for symbol in ('BBBUSDT', 'CCCUSDT'):
+        columns = store.read_all(symbol, '1m')
+        assert columns['open_time'].tolist() == [row[0] for row in rows[symbol]]
+        assert store.missing(symbol, '1m', START, START + 2 * 1440 * MINUTE - 1) == []
+
+
+def test_sync_calls_share_the_budget_and_bans(recorded, endpoint):
+    url, _ = endpoint
+    _, rows = recorded
+    symbol = SYMBOLS[0]
+    end_ms = START + 5 * PAGE_LIMIT * MINUTE - 1  # 5 pages, weight 25
+    bucket = TokenBucket(capacity=25, period=0.5)  # 50 weight per second
+    downloader = AsyncKlineDownloader(url, concurrency=4, bucket=bucket)
+
+    # The first call spends the whole budget, so the second has to wait for it to refill
+    started = time.monotonic()
+    for _ in range(2):
+        assert downloader.get_historical_klines(symbol, '1m', START, end_ms) == expected_rows(rows[symbol], START, end_ms)
+    assert time.monotonic() - started >= 0.5 * 0.95
+    assert downloader.bucket is bucket
+
+    # A Retry-After ban outlives the call that received it
+    bucket.block(0.3)
+    started = time.monotonic()
+    downloader.get_historical_klines(symbol, '1m', START, START + MINUTE - 1)
+    assert time.monotonic() - started >= 0.3 * 0.95
@@ -0,0 +1,75 @@
+import json
+
+import numpy as np
+import pytest
+
+from indicators import ATR, EMA, INDICATORS, MACD, RSI, SMA, atr, ema, macd, rsi, sma
+from synthetic import synthetic_klines
+
+# The NumPy batch functions against the streaming classes, value for value, and a warm start
+# from a saved state against an uninterrupted run.
+
+
+@pytest.fixture(scope='module')
+def bars():
+    return synthetic_klines(5000, segment_bars=1000, seed=5)
+
+
+def streamed(indicator, *series):
+    return np.array([indicator.update(*values) for values in zip(*(np.asarray(s).tolist() for s in series))])
+
+
+@pytest.mark.parametrize('period', [5, 14, 51])
+def test_sma_ema(bars, period):
+    close = bars['close']
+    np.testing.assert_array_equal(sma(close, period), streamed(SMA(period), close))
+    np.testing.assert_array_equal(ema(close, period), streamed(EMA(period), close))
+
+
+def test_ema_skips_leading_nan(bars):
+    values = np.concatenate([[np.nan] * 3, bars['close'][:100]])
+    np.testing.assert_array_equal(ema(values, 9), streamed(EMA(9), values))
+
+
+def test_macd_rsi_atr(bars):
+    close = bars['close']
+    line, signal = macd(close, 12, 26, 9)
+    expected = streamed(MACD(12, 26, 9), close)
+    np.testing.assert_array_equal(line, expected[:, 0])
+    np.testing.assert_array_equal(signal, expected[:, 1])
+    np.testing.assert_array_equal(rsi(close, 14), streamed(RSI(14), close))
+    np.testing.assert_array_equal(atr(bars['high'], bars['low'], close, 5),
+                                  streamed(ATR(5), bars['high'], bars['low'], close))
+
+
+def test_short_series():
+    assert np.isnan(sma([1.0, 2.0], 5)).all()
+    assert np.isnan(rsi([1.0])).all() and np.isnan(atr([1.0], [1.0], [1.0])).all()
+    assert [len(values) for values in macd([])] == [0, 0]
+
+
+@pytest.mark.parametrize('kind', ['SMA', 'EMA', 'MACD', 'RSI'])
+def test_warm_start(bars, kind):
+    close = bars['close'].tolist()
+    indicator = INDICATORS[kind](14)
+    full = [indicator.update(x) for x in close]
+    first = INDICATORS[kind](14)
+    for x in close[:2000]:
+        first.update(x)
+    resumed = INDICATORS[kind].from_state(json.loads(json.dumps(first.state())))
+    assert [resumed.update(x) for x in close[2000:]] == full[2000:]
+
+
+@pytest.mark.parametrize('kind', ['EMA', 'MACD', 'RSI'])
+def test_array_updates(bars, kind):
+    # One array per bar updates several series at once, each as if streamed on its own; before
+    # the warm-up ends a single NaN stands for all of them
+    series = bars['close'][:3000].reshape(3, 1000)
+    together = INDICATORS[kind](9)
+    values = []
+    for row in series.T:
+        value = together.update(row)
+        values.append([np.broadcast_to(v, 3) for v in value] if kind == 'MACD' else np.broadcast_to(value, 3))
+    values = np.array(values)
+    for k, close in enumerate(series):
+        np.testing.assert_array_equal(values[..., k], streamed(INDICATORS[kind](9), close))
@@ -0,0 +1,88 @@
+import json
+
+import numpy as np
+import pytest
+
+import kline_source
+import kline_store
+from kline_source import KlineSource, ReplaySource, StoreSource, columns_to_klines, fixture_path
+from kline_store import KlineStore, date_to_ms
+from Martingalev1 import fetch_binance_data
+from synthetic import synthetic_klines
+
+# Offline sources feeding fetch_binance_data: the bars come from recorded fixtures or another
+# store, land in the (empty) kline store and are served from it afterwards.
+
+START = '2024-01-02'
+END = '2024-01-03'
+COLUMNS = ('open_time', 'open', 'high', 'low', 'close', 'volume')
+
+
+class CountingSource(KlineSource):
+    def __init__(self, source):
+        self.source = source
+        self.calls = 0
+
+    def get_historical_klines(self, symbol, interval, start_ms, end_ms):
+        self.calls += 1
+        return self.source.get_historical_klines(symbol, interval, start_ms, end_ms)
+
+
+@pytest.fixture
+def bars():
+    return synthetic_klines(3 * 1440, start_date='2024-01-01', seed=1)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # An empty default store, so fetch_binance_data has to go to the kline source
+    store = KlineStore(str(tmp_path / 'klines'))
+    monkeypatch.setattr(kline_store, '_default_store', store)
+    return store
+
+
+def expected_window(bars):
+    keep = (bars['open_time'] >= date_to_ms(START)) & (bars['open_time'] <= date_to_ms(END))
+    return {name: bars[name][keep] for name in COLUMNS}
+
+
+def check_columns(columns, expected):
+    assert len(columns['open_time']) == 1441
+    for name in COLUMNS:
+        np.testing.assert_array_equal(columns[name], expected[name])
+    np.testing.assert_array_equal(columns['datetime'].astype(np.int64), expected['open_time'])
+
+
+def test_source_is_abstract():
+    with pytest.raises(TypeError):
+        KlineSource()
+
+
+def test_replay_source_feeds_fetch_binance_data(tmp_path, monkeypatch, store, bars):
+    fixtures = tmp_path / 'fixtures'
+    fixtures.mkdir()
+    with open(fixture_path(str(fixtures), 'SYNTHUSDT', '1m'), 'w') as file:
+        json.dump(columns_to_klines(bars, '1m'), file)
+    source = CountingSource(ReplaySource(str(fixtures)))
+    monkeypatch.setattr(kline_source, '_default_source', source)
+
+    check_columns(fetch_binance_data('SYNTHUSDT', '1m', START, END, 'UTC'), expected_window(bars))
+    assert source.calls == 1
+    assert store.missing('SYNTHUSDT', '1m', date_to_ms(START), date_to_ms(END)) == []
+
+    # Served from the store the second time
+    check_columns(fetch_binance_data('SYNTHUSDT', '1m', START, END, 'UTC'), expected_window(bars))
+    assert source.calls == 1
+
+
+def test_store_source_feeds_fetch_binance_data(tmp_path, monkeypatch, store, bars):
+    other = KlineStore(str(tmp_path / 'other'))
+    other.write('SYNTHUSDT', '1m', bars, int(bars['open_time'][0]), int(bars['open_time'][-1]))
+    monkeypatch.setattr(kline_source, '_default_source', StoreSource(other))
+
+    check_columns(fetch_binance_data('SYNTHUSDT', '1m', START, END, 'UTC'), expected_window(bars))
+
+
+def test_replay_source_unknown_symbol(tmp_path):
+    with pytest.raises(KeyError):
+        ReplaySource(str(tmp_path)).get_historical_klines('NOPEUSDT', '1m', 0, 1)
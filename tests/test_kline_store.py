@@ -0,0 +1,35 @@
+from multiprocessing import get_context
+
+from kline_store import INTERVAL_MS, KlineStore
+
+# Several processes filling gaps of the same symbol at once (as sweep and optimizer workers do on
+# a cold store) must each get their own bars, and the index must keep every range.
+
+MINUTE = INTERVAL_MS['1m']
+DAY = INTERVAL_MS['1d']
+START = 1_704_067_200_000  # 2024-01-01
+
+
+def fetch(symbol, interval, start_ms, end_ms):
+    first = -(-start_ms // MINUTE) * MINUTE
+    return [[t, 1.0, 2.0, 0.5, 1.5, 10.0] for t in range(first, end_ms + 1, MINUTE)]
+
+
+def load_window(args):
+    root, k = args
+    start = START + k * DAY // 2
+    columns = KlineStore(root).load('TESTUSDT', '1m', start, start + 3 * DAY - 1, fetch)
+    return len(columns['open_time']), int(columns['open_time'][0]) == start
+
+
+def test_concurrent_loads_keep_every_range(tmp_path):
+    with get_context('fork').Pool(8) as pool:
+        loaded = pool.map(load_window, [(str(tmp_path), k) for k in range(16)])
+    assert loaded == [(3 * 1440, True)] * 16
+
+    store = KlineStore(str(tmp_path))
+    assert store.coverage('TESTUSDT', '1m') == [[START, START + 10 * DAY + DAY // 2]]
+    columns = store.read_all('TESTUSDT', '1m')
+    assert len(columns['open_time']) == (10 * DAY + DAY // 2) // MINUTE
+    data_dirs = [entry for entry in (tmp_path / 'TESTUSDT' / '1m').iterdir() if entry.name.startswith('data-')]
+    assert len(data_dirs) == 1
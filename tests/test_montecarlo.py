@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import Martingalev1
+import Martingalev1_withstop
+from montecarlo import simulate
+from synthetic import synthetic_klines
+from vector_engine import run_vectorized
+
+# vector_engine's path rules, as the Monte Carlo simulation runs them on many paths at once,
+# against the scalar rules of run_vectorized on every path on its own.
+
+CAPITAL = 1000
+COMMISSION = 0.001
+CASES = [(module, market) for module in (Martingalev1, Martingalev1_withstop) for market in module.market_strategies]
+
+
+class FixedPaths:
+    # Stands in for a PathGenerator with given bars
+    block = 60
+
+    def __init__(self, paths):
+        self.bars = {name: np.stack([path[name] for path in paths]) for name in ('open', 'high', 'low', 'close')}
+        self.n_paths = len(paths)
+        self.done = 0
+
+    def next_chunk(self, n_bars):
+        chunk = {name: values[:, self.done:self.done + n_bars] for name, values in self.bars.items()}
+        self.done += n_bars
+        return chunk
+
+
+@pytest.fixture(scope='module')
+def paths():
+    return [synthetic_klines(3 * 1440, segment_bars=720, seed=seed) for seed in range(6)]
+
+
+@pytest.mark.parametrize('module, market', CASES, ids=[f'{module.__name__}-{market}' for module, market in CASES])
+def test_paths_match_vector_engine(paths, module, market):
+    strategy = module.market_strategies[market]
+    n_bars = len(paths[0]['close'])
+    result = simulate(strategy, FixedPaths(paths), n_bars, CAPITAL, COMMISSION, chunk_bars=1000)
+    for k, path in enumerate(paths):
+        expected = run_vectorized(strategy, path, CAPITAL, COMMISSION)
+        assert result.end_value[k] == pytest.approx(expected.value, rel=1e-12)
+        assert result.add_rejected[k] == expected.add_rejected
+        assert result.closed[k] == (expected.close_time is not None)
+    assert result.add_position_count.any()
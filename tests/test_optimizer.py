@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+import kline_source
+import kline_store
+from kline_source import ReplaySource, columns_to_klines, fixture_path
+from kline_store import KlineStore
+from Martingalev1_withstop import fetch_binance_data, strategies
+from optimizer import optimize, window_dates
+from synthetic import synthetic_klines
+from vector_engine import run_vectorized
+
+# A sweep on recorded klines: the windows are loaded once in the parent, a window whose bars
+# cannot be loaded is skipped and reported instead of breaking the pool, and every combination
+# gives the same end values as run_vectorized on the windows it ran on.
+
+SPACE = {'reverse_mult': [1.5, 2.0]}
+JOBS = [('2023-12-31', 'SYNTHUSDT'), ('2024-01-03', 'SYNTHUSDT'), ('2023-12-31', 'NOPEUSDT')]
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    fixtures = tmp_path / 'fixtures'
+    fixtures.mkdir()
+    with open(fixture_path(str(fixtures), 'SYNTHUSDT', '1m'), 'w') as file:
+        json.dump(columns_to_klines(synthetic_klines(36 * 1440, seed=2), '1m'), file)
+    monkeypatch.setattr(kline_store, '_default_store', KlineStore(str(tmp_path / 'klines')))
+    monkeypatch.setattr(kline_source, '_default_source', ReplaySource(str(fixtures)))
+
+
+def test_sweep_skips_windows_that_cannot_be_loaded(tmp_path, source):
+    skipped = []
+    table = optimize('reverse', SPACE, JOBS, workers=2, chunk_size=1, out_path=str(tmp_path / 'sweep.jsonl'),
+                     on_error=lambda symbol, start_date, exc: skipped.append((symbol, start_date)))
+    assert skipped == [('NOPEUSDT', '2023-12-31')]
+    assert [row['symbol'] for row in table.attrs['skipped']] == ['NOPEUSDT']
+    assert len(table) == 2
+    assert (table['windows'] == 2).all()
+
+    for _, row in table.iterrows():
+        values = [run_vectorized(strategies['reverse'],
+                                 fetch_binance_data(symbol, '1m', *window_dates(start_date), 'UTC'),
+                                 1000, 0.001, params={'reverse_mult': row['reverse_mult']}).value
+                  for start_date, symbol in JOBS[:2]]
+        assert row['mean_end_value'] == pytest.approx(sum(values) / 2, rel=1e-12)
+
+
+def test_sweep_with_no_loadable_window(tmp_path, source):
+    with pytest.raises(ValueError):
+        optimize('reverse', SPACE, JOBS[2:], workers=1, out_path=str(tmp_path / 'sweep.jsonl'))
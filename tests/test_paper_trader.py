@@ -0,0 +1,96 @@
+import pytest
+
+from kline_feed import prepare_columns
+from Martingalev1_withstop import market_strategies
+from paper_trader import COMMISSION, PaperTrader, QueueFeed, kline_message, latency_summary, replay_messages
+from synthetic import synthetic_klines
+from vector_engine import run_vectorized
+
+# Stored bars replayed as kline stream messages through a QueueFeed into the paper trader must
+# trade exactly like the NumPy engine on the same bars: same fills, commission, final position
+# and value.
+
+CAPITAL = 1000
+SYMBOL = 'SYNTHUSDT'
+
+
+@pytest.fixture(scope='module')
+def bars():
+    return prepare_columns(synthetic_klines(6 * 1440, segment_bars=1440, seed=3))
+
+
+def replay(bars, market):
+    trader = PaperTrader(SYMBOL, market, CAPITAL)
+    feed = QueueFeed()
+    feed.feed(replay_messages(SYMBOL, bars))
+    return trader, trader.run(feed)
+
+
+@pytest.mark.parametrize('market', sorted(market_strategies))
+def test_replay_matches_vector_engine(bars, market):
+    trader, report = replay(bars, market)
+    expected = run_vectorized(market_strategies[market], bars, CAPITAL, COMMISSION)
+
+    assert report['bars'] == expected.bars
+    assert report['value'] == pytest.approx(expected.value, rel=1e-12)
+    assert report['buy_count'] == expected.buy_count > 0
+    assert report['orders'] == expected.orders
+    assert report['add_rejected'] == expected.add_rejected
+    assert report['fills'] == len(expected.changes)
+    position = expected.changes[-1][1]
+    assert report['position_size'] == pytest.approx(position, rel=1e-12)
+    if expected.close_time is not None:
+        assert report['close_time'].startswith(expected.close_time.isoformat())
+        assert position == 0.0
+
+    # The fills happen on the engine's bars, and the cash left is the capital less the fills
+    # and their commission
+    open_time = bars['open_time']
+    assert [t for t, _, _, _ in trader.fills] == [int(open_time[i]) for i, _ in expected.changes]
+    spent = 0.0
+    for _, size, price, commission in trader.fills:
+        assert commission == pytest.approx(abs(size * price) * COMMISSION, rel=1e-12)
+        spent += size * price + commission
+    assert report['cash'] == pytest.approx(CAPITAL - spent, rel=1e-9)
+
+
+def test_latency_report(bars):
+    _, report = replay(bars, 'Uptrend')
+    latency = report['latency']
+    assert latency['bars'] == report['bars']
+    assert 0 < latency['p50_us'] <= latency['p99_us'] <= latency['max_us']
+    assert latency['mean_us'] <= latency['max_us']
+    assert latency['budget_ms'] == 50.0
+    assert 0 <= latency['over_budget'] <= latency['bars']
+
+
+def test_latency_summary():
+    assert latency_summary([]) == {'bars': 0}
+    summary = latency_summary([1000, 2000, 3000, 4000])
+    assert summary == {'bars': 4, 'mean_us': 2.5, 'p50_us': 2.5, 'p99_us': pytest.approx(3.97), 'max_us': 4.0}
+
+
+def test_open_and_repeated_candles_are_skipped(bars):
+    trader = PaperTrader(SYMBOL, 'Ranging', CAPITAL)
+    messages = list(replay_messages(SYMBOL, bars))[:3]
+    open_candle = kline_message(SYMBOL, bars['open_time'][3], 1.0, 1.0, 1.0, 1.0, 1.0, closed=False)
+    feed = QueueFeed()
+    feed.feed(messages + [open_candle, messages[1], messages[2]])
+    report = trader.run(feed)
+    assert report['bars'] == 3
+    assert report['latency']['bars'] == 3
+
+
+def test_stream_error_stops_the_trader(bars):
+    trader = PaperTrader(SYMBOL, 'Ranging', CAPITAL)
+    messages = list(replay_messages(SYMBOL, bars))[:3]
+    feed = QueueFeed()
+    feed.feed(messages[:2] + [{'e': 'outboundAccountPosition'}, {'e': 'error', 'm': 'Max reconnect retries reached'},
+                              messages[2]])
+    with pytest.raises(ConnectionError, match='Max reconnect retries reached'):
+        trader.run(feed)
+    assert trader.bars == 2  # the unknown event was ignored, nothing after the error was read
+
+    # A bare kline (a replayed row) is still traded
+    trader.on_message(messages[2]['k'])
+    assert trader.bars == 3
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+import Martingalev1
+import Martingalev1_withstop
+from kline_feed import prepare_columns
+from optimizer import COMMISSIONS
+from performance import max_drawdown
+from portfolio import Sleeve, run_portfolio
+from synthetic import synthetic_klines
+from vector_engine import run_vectorized
+
+# Windows trading against one cash pool: a window on its own trades as run_vectorized does, and
+# with several the portfolio's value, drawdown and open-position count follow from the windows'
+# fills.
+
+CAPITAL = 1000
+MODULES = {'v1': Martingalev1, 'withstop': Martingalev1_withstop}
+CASES = [(name, market) for name, module in MODULES.items() for market in module.market_strategies]
+
+
+def window(start_date, days, seed):
+    return prepare_columns(synthetic_klines(days * 1440, start_date=start_date, segment_bars=720, seed=seed))
+
+
+def sleeve_values(sleeve, times):
+    # The window's part of the portfolio value and its position at each time, rebuilt from its
+    # fills: cash spent or received so far plus the position marked at the close
+    open_time = np.asarray(sleeve.columns['open_time'])
+    close = np.asarray(sleeve.columns['close'])
+    cash = np.zeros(len(close))
+    position = np.zeros(len(close))
+    for i, size, price, fee, _ in sleeve.run.a.fills:
+        cash[i] -= size * price + fee
+        position[i] += size
+    position = np.cumsum(position)
+    value = np.cumsum(cash) + position * close
+    k = np.searchsorted(open_time, times, side='right') - 1
+    started = k >= 0
+    k = np.maximum(k, 0)
+    return np.where(started, value[k], 0.0), np.where(started, position[k], 0.0)
+
+
+@pytest.mark.parametrize('module_name, market', CASES, ids=[f'{name}-{market}' for name, market in CASES])
+def test_single_window_matches_vector_engine(module_name, market):
+    strategy = MODULES[module_name].market_strategies[market]
+    commission = COMMISSIONS[module_name]
+    bars = window('2024-01-01', 4, seed=1)
+    result = run_portfolio([Sleeve('AUSDT', '2023-12-31', market, strategy, bars)], CAPITAL, commission)
+    expected = run_vectorized(strategy, bars, CAPITAL, commission)
+    sleeve = result.sleeves[0]
+
+    # An open position is sold at the window's last close
+    fills = list(expected.fills)
+    size = sum(fill[1] for fill in fills)
+    if expected.close_time is None and fills and size:
+        last = len(bars['close']) - 1
+        close = float(bars['close'][last])
+        fee = abs(size * close) * commission
+        fills.append((last, -size, close, fee, fills[-1][4]))
+        assert result.value == pytest.approx(expected.value - fee, rel=1e-12)
+    else:
+        assert result.value == expected.value
+    assert sleeve.run.a.fills == fills
+    assert sleeve.run.a.buys == expected.buy_count > 0
+    assert sleeve.run.a.add_rejected == expected.add_rejected
+    assert CAPITAL + sleeve.pnl == pytest.approx(result.value, rel=1e-12)
+
+
+@pytest.fixture(scope='module')
+def overlapping():
+    # Two windows of the same regime, open at the same time for two of their days
+    strategy = Martingalev1_withstop.market_strategies['Uptrend']
+    sleeves = [Sleeve('AUSDT', '2023-12-31', 'Uptrend', strategy, window('2024-01-01', 4, seed=1)),
+               Sleeve('BUSDT', '2024-01-02', 'Uptrend', strategy, window('2024-01-03', 4, seed=2))]
+    return run_portfolio(sleeves, CAPITAL, COMMISSIONS['withstop'])
+
+
+def test_pnl_adds_up(overlapping):
+    assert CAPITAL + sum(row['pnl'] for row in overlapping.rows()) == pytest.approx(overlapping.value, rel=1e-12)
+
+
+def test_value_drawdown_and_open_positions(overlapping):
+    curve = overlapping.curve
+    parts = [sleeve_values(sleeve, curve.time) for sleeve in overlapping.sleeves]
+    expected = CAPITAL + sum(value for value, _ in parts)
+    np.testing.assert_allclose(curve.value, expected, rtol=1e-9)
+    assert overlapping.metrics(('max_drawdown',))['max_drawdown'] == pytest.approx(max_drawdown(expected), rel=1e-9)
+
+    held = sum((np.abs(position) > 1e-9).astype(int) for _, position in parts)
+    assert overlapping.max_open == held.max() == 2
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+import Martingalev1_withstop
+from kline_feed import prepare_columns
+from Martingalev1_withstop import ReverseMartingaleStrategy, martingale_withstop
+from result_cache import ResultCache, run_key, strategy_params
+from synthetic import synthetic_klines
+
+# The result cache's key (what a result depends on) and its store on disk: least recently used
+# eviction, invalidation by metadata, and damaged entries read as misses.
+
+
+@pytest.fixture(scope='module')
+def bars():
+    return prepare_columns(synthetic_klines(1440, seed=4))
+
+
+def key(bars, strategy=ReverseMartingaleStrategy, commission=0.001, **settings):
+    return run_key(martingale_withstop, strategy, bars, 1000, commission, engine='numpy', **settings)
+
+
+def test_key_follows_the_inputs(bars):
+    same = {name: column.copy() for name, column in bars.items()}
+    assert key(bars) == key(same)
+
+    changed = {name: column.copy() for name, column in bars.items()}
+    changed['close'][100] = changed['close'][100] * (1 + 1e-12)
+    assert key(changed) != key(bars)
+
+    assert key(bars, commission=0.0) != key(bars)
+    assert key(bars, metrics=('sharpe',)) != key(bars)
+    assert key(bars, strategy=Martingalev1_withstop.MultifactorMartingaleStrategy) != key(bars)
+
+
+def test_key_follows_the_params(bars):
+    class Tuned(ReverseMartingaleStrategy):
+        params = (('reverse_mult', 3.0),)
+
+    assert strategy_params(Tuned)['reverse_mult'] == 3.0
+    assert key(bars, strategy=Tuned) != key(bars)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    keys = [f'{k:02x}' + 'a' * 62 for k in range(3)]
+    for age, name in enumerate(keys):
+        cache.put(name, b'x' * 1000)
+        os.utime(cache._path(name), (1_000_000 + age, 1_000_000 + age))
+    assert cache.get(keys[0]) == b'x' * 1000  # now the most recently used
+
+    size = max(size for _, size, _ in cache.entries())
+    assert cache.evict(2 * size) == 1
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    assert cache.stats()['entries'] == 2
+
+
+def test_put_evicts_over_the_limit(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=2500)
+    for k in range(4):
+        cache.put(f'{k:02x}' + 'b' * 62, b'x' * 1000)
+    assert cache.stats()['bytes'] <= 2500
+
+
+def test_invalidate_by_metadata(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    cache.put('aa' + '0' * 62, 1, strategy='A', symbol='BTCUSDT')
+    cache.put('bb' + '0' * 62, 2, strategy='A', symbol='ETHUSDT')
+    cache.put('cc' + '0' * 62, 3, strategy='B', symbol='BTCUSDT')
+
+    assert cache.invalidate(strategy='A', symbol='BTCUSDT') == 1
+    assert cache.get('aa' + '0' * 62) is None
+    assert cache.invalidate(strategy='A') == 1
+    assert cache.get('cc' + '0' * 62) == 3
+    assert cache.invalidate() == 1
+    assert cache.stats()['entries'] == 0
+
+
+@pytest.mark.parametrize('damage', ['garbage', 'truncated', 'empty'])
+def test_damaged_entry_is_a_miss(tmp_path, damage):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    name = 'dd' + '0' * 62
+    cache.put(name, {'value': 1234.5, 'trades': list(range(100))})
+    path = cache._path(name)
+    with open(path, 'rb') as file:
+        data = file.read()
+    with open(path, 'wb') as file:
+        file.write({'garbage': b'not a pickle', 'truncated': data[:len(data) // 2], 'empty': b''}[damage])
+    assert cache.get(name) is None
+    assert cache.get('ee' + '0' * 62) is None  # never stored
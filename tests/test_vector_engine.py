@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import Martingalev1
+import Martingalev1_withstop
+from kline_feed import prepare_columns
+from ledger import load_ledger
+from synthetic import synthetic_klines
+
+# The NumPy engine against cerebro on the same synthetic bars: every strategy of both modules
+# must give the same end value, Sharpe ratio, max drawdown, buy count, last entry, (withstop)
+# close time and trade ledger.
+
+CAPITAL = 1000
+METRICS = ('sharpe', 'max_drawdown')
+RUNS = {
+    Martingalev1.martingale: Martingalev1.market_strategies,
+    Martingalev1_withstop.martingale_withstop: Martingalev1_withstop.market_strategies,
+}
+CASES = [(run, market) for run, markets in RUNS.items() for market in markets]
+
+
+@pytest.fixture(scope='module')
+def bars():
+    # Six days cycling through the trend, range and high-volatility regimes
+    return prepare_columns(synthetic_klines(6 * 1440, segment_bars=1440, seed=3))
+
+
+@pytest.mark.parametrize('run, market', CASES, ids=[f'{run.__name__}-{market}' for run, market in CASES])
+def test_numpy_engine_matches_backtrader(bars, run, market):
+    expected = run('SYNTHUSDT', None, None, market, CAPITAL, engine='backtrader', metrics=METRICS, bars=bars)
+    result = run('SYNTHUSDT', None, None, market, CAPITAL, engine='numpy', metrics=METRICS, bars=bars)
+
+    *values, metrics = result
+    *expected_values, expected_metrics = expected
+    end_value, performance, buy_count, last_entry = values[:4]
+    assert end_value == pytest.approx(expected_values[0], rel=1e-9)
+    assert performance == pytest.approx(expected_values[1], rel=1e-9, abs=1e-12)
+    assert buy_count == expected_values[2]
+    assert buy_count > 0
+    assert last_entry == expected_values[3]
+    assert values[4:] == expected_values[4:]  # withstop close time
+    for name in METRICS:
+        assert metrics[name] == pytest.approx(expected_metrics[name], rel=1e-9, abs=1e-12)
+
+
+@pytest.mark.parametrize('run, market', CASES, ids=[f'{run.__name__}-{market}' for run, market in CASES])
+def test_numpy_engine_saves_the_same_ledger(bars, tmp_path, run, market):
+    paths = {engine: str(tmp_path / f'{engine}.npz') for engine in ('backtrader', 'numpy')}
+    for engine, path in paths.items():
+        run('SYNTHUSDT', None, None, market, CAPITAL, engine=engine, ledger_path=path, bars=bars)
+    expected = load_ledger(paths['backtrader'])
+    ledger = load_ledger(paths['numpy'])
+    assert len(ledger['time']) == len(expected['time']) > 0
+    for name in ('time', 'side', 'size', 'add_level'):
+        np.testing.assert_array_equal(ledger[name], expected[name])
+    for name in ('price', 'commission'):
+        np.testing.assert_allclose(ledger[name], expected[name], rtol=1e-12)